@@ -0,0 +1,93 @@
+import asyncio
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+from playwright.async_api import async_playwright, Browser
+from ai_agent import AIAgent
+from ai_providers import get_ai_provider, BaseAIProvider
+from browser_controller import BrowserController, launch_browser
+from load_profiles import DomainLoadProfiles
+from macros import MacroStore
+from selector_memory import SelectorMemory
+from provider_transport import close_shared_clients
+from config import MACROS_ENABLED, SELECTOR_MEMORY_ENABLED
+
+
+class AgentRuntime:
+    def __init__(self, provider: str = 'openrouter', provider_kwargs: Dict = None, headless: bool = True,
+                 max_concurrency: int = 4, browser_kwargs: Dict = None):
+        self.provider_name = provider
+        self.provider_kwargs = provider_kwargs or {}
+        self.headless = headless
+        self.max_concurrency = max_concurrency
+        self.browser_kwargs = browser_kwargs or {}
+        self.playwright = None
+        self.browser: Browser = None
+        self.ai_provider: Optional[BaseAIProvider] = None
+        self.load_profiles: Optional[DomainLoadProfiles] = None
+        self.macros: Optional[MacroStore] = None
+        self.selector_memory: Optional[SelectorMemory] = None
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self.active_sessions = 0
+
+    async def start(self):
+        # Один процесс Chromium и один клиент провайдера на все сессии
+        self.playwright = await async_playwright().start()
+        self.browser = await launch_browser(self.playwright, self.headless)
+        self.ai_provider = get_ai_provider(self.provider_name, **self.provider_kwargs)
+        user_data_dir = self.browser_kwargs.get('user_data_dir') or str(Path.home() / ".browser-ai-agent")
+        self.load_profiles = DomainLoadProfiles(
+            str(Path(user_data_dir) / 'load_profiles.json'),
+            max_settle=self.browser_kwargs.get('max_settle', 10.0)
+        )
+        if MACROS_ENABLED:
+            self.macros = MacroStore(str(Path(user_data_dir) / 'macros.json'))
+        if SELECTOR_MEMORY_ENABLED:
+            self.selector_memory = SelectorMemory(str(Path(user_data_dir) / 'selectors.json'))
+        return self
+
+    async def close(self):
+        if self.selector_memory:
+            self.selector_memory.flush()
+        if self.browser:
+            await self.browser.close()
+        if self.playwright:
+            await self.playwright.stop()
+        await close_shared_clients()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    @asynccontextmanager
+    async def session(self, start_url: str = None):
+        # Каждая сессия получает изолированный BrowserContext и своего агента
+        # со своими ContextManager, PageAnalyzer и ElementFinder
+        async with self._slots:
+            controller = BrowserController(headless=self.headless, load_profiles=self.load_profiles,
+                                           **self.browser_kwargs)
+            self.active_sessions += 1
+            try:
+                await controller.start(start_url=start_url, browser=self.browser)
+                agent = AIAgent(provider=self.ai_provider)
+                agent.macros = self.macros
+                agent.selector_memory = self.selector_memory
+                agent.set_browser(controller)
+                yield agent
+            finally:
+                self.active_sessions -= 1
+                await controller.close()
+
+    async def run_task(self, task: str, start_url: str = None) -> str:
+        async with self.session(start_url=start_url) as agent:
+            return await agent.process_task(task)
+
+    async def run_tasks(self, tasks: List[str], start_url: str = None) -> List:
+        # Задачи запускаются одновременно, но не больше max_concurrency сессий сразу;
+        # ошибка одной задачи не прерывает остальные
+        return await asyncio.gather(
+            *(self.run_task(task, start_url=start_url) for task in tasks),
+            return_exceptions=True
+        )
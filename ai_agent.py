@@ -5,181 +5,303 @@ from page_analyzer import PageAnalyzer
 from security_layer import SecurityLayer
 from context_manager import ContextManager
 from element_finder import ElementFinder
-from ai_providers import get_ai_provider, BaseAIProvider
+from ai_providers import get_ai_provider, BaseAIProvider, CacheMissError
+from provider_transport import ProviderAuthError
 from guardrails import GuardrailsSystem, RiskLevel
+from tool_scheduler import ToolScheduler
+from page_encoder import PAGE_FORMAT_LEGEND
+from tracing import span, traced
+import tracing
+from macros import MacroStore, MacroRecorder, action_failed, fill_slots, page_key, start_domain
+from selector_memory import SelectorMemory
+from intent_matcher import match_intent, CONFIDENT_CLICK_METHODS, CONFIDENT_CLICK_SCORE
+from pathlib import Path
+from config import (PAGE_ANALYZER_ENGINE, PAGE_SUMMARY_FORMAT, PAGE_SUMMARY_TOKEN_BUDGET,
+                    STREAM_COMPLETIONS, MAX_CONTEXT_LENGTH, MACROS_ENABLED, SELECTOR_MEMORY_ENABLED,
+                    FAST_PATH_ENABLED, BATCH_ASK_USER_POLICY)
 import json
 import asyncio
 
 
-class AIAgent:
-    def __init__(self, provider: str = 'groq', **provider_kwargs):
-        self.ai_provider: BaseAIProvider = get_ai_provider(provider, **provider_kwargs)
-        self.provider_name = provider
-        self.browser_controller: Optional[BrowserController] = None
-        self.page_analyzer: Optional[PageAnalyzer] = None
-        self.element_finder: Optional[ElementFinder] = None
-        self.context_manager = ContextManager()
-        self.guardrails = GuardrailsSystem()
-        
-    def set_browser(self, browser_controller: BrowserController):
-        self.browser_controller = browser_controller
-        if browser_controller.page:
-            self.page_analyzer = PageAnalyzer(browser_controller.page)
-            self.element_finder = ElementFinder(browser_controller.page)
-        else:
-            self.element_finder = None
-    
-    def get_tools(self) -> List[Dict]:
-        return [
-            {
-                "type": "function",
-                "function": {
-                    "name": "navigate_to_url",
-                    "description": "Перейти на указанный URL",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "url": {
-                                "type": "string",
-                                "description": "URL для перехода"
-                            }
-                        },
-                        "required": ["url"]
+SYSTEM_PROMPT = """Ты автономный AI-агент, который управляет браузером для выполнения задач пользователя.
+
+Твои возможности:
+- Переходить на страницы
+- Кликать на элементы (кнопки, ссылки)
+- Вводить текст в поля
+- Получать информацию о странице
+- Прокручивать страницу
+
+КРИТИЧЕСКИ ВАЖНЫЕ ПРАВИЛА:
+1. Анализируй задачу пользователя и выполняй ТОЛЬКО необходимые действия для её выполнения
+2. НЕ делай лишних кликов и переходов - если задача уже выполнена, используй task_complete
+3. Если ты на странице с результатами поиска и нашел нужный контент - задача выполнена, используй task_complete
+4. НЕ переходи по ссылкам "Каталог", "О нас", "Контакты" и другим, если они не нужны для выполнения задачи
+5. Если задача - найти что-то на сайте, используй поиск или фильтры, а не навигационное меню
+6. После каждого действия проверяй, выполнена ли задача - если да, используй task_complete
+7. НЕ используй заготовленные планы - адаптируйся к ситуации
+8. НЕ используй хардкоженные селекторы - находи элементы по их тексту и описанию
+9. Если не можешь найти элемент, попробуй разные способы (текст, aria-label, классы)
+10. Если задача требует деструктивного действия (оплата, удаление), система спросит подтверждение
+11. Если нужна дополнительная информация от пользователя, используй ask_user
+
+Начни с получения информации о текущей странице, если она уже открыта."""
+
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "navigate_to_url",
+            "description": "Перейти на указанный URL",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "url": {
+                        "type": "string",
+                        "description": "URL для перехода"
                     }
+                },
+                "required": [
+                    "url"
+                ]
             }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "click_element",
-                "description": "Кликнуть на элемент страницы. Используй текст элемента или его описание для поиска",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "element_text": {
-                            "type": "string",
-                            "description": "Текст или описание элемента для клика (например, 'кнопка Войти', 'ссылка Вакансии')"
-                        },
-                        "selector": {
-                            "type": "string",
-                            "description": "CSS селектор элемента (опционально, если известен)"
-                        }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "click_element",
+            "description": "Кликнуть на элемент страницы. Используй текст элемента или его описание для поиска",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "element_text": {
+                        "type": "string",
+                        "description": "Текст или описание элемента для клика (например, 'кнопка Войти', 'ссылка Вакансии')"
                     },
-                    "required": ["element_text"]
-                }
+                    "selector": {
+                        "type": "string",
+                        "description": "CSS селектор элемента (опционально, если известен)"
+                    }
+                },
+                "required": [
+                    "element_text"
+                ]
             }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "type_text",
-                "description": "Ввести текст в поле ввода",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "field_description": {
-                            "type": "string",
-                            "description": "Описание поля (например, 'поле email', 'поле пароль')"
-                        },
-                        "text": {
-                            "type": "string",
-                            "description": "Текст для ввода"
-                        },
-                        "selector": {
-                            "type": "string",
-                            "description": "CSS селектор поля (опционально)"
-                        }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "type_text",
+            "description": "Ввести текст в поле ввода",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "field_description": {
+                        "type": "string",
+                        "description": "Описание поля (например, 'поле email', 'поле пароль')"
+                    },
+                    "text": {
+                        "type": "string",
+                        "description": "Текст для ввода"
                     },
-                    "required": ["field_description", "text"]
-                }
+                    "selector": {
+                        "type": "string",
+                        "description": "CSS селектор поля (опционально)"
+                    }
+                },
+                "required": [
+                    "field_description",
+                    "text"
+                ]
             }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "get_page_info",
-                "description": "Получить информацию о текущей странице (ссылки, кнопки, формы)",
-                "parameters": {
-                    "type": "object",
-                    "properties": {},
-                    "required": []
-                }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_page_info",
+            "description": "Получить информацию о текущей странице (ссылки, кнопки, формы)",
+            "parameters": {
+                "type": "object",
+                "properties": {},
+                "required": []
             }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "wait",
-                "description": "Подождать указанное время (в секундах)",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "seconds": {
-                            "type": "number",
-                            "description": "Количество секунд для ожидания"
-                        }
-                    },
-                    "required": ["seconds"]
-                }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "wait",
+            "description": "Подождать указанное время (в секундах)",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "seconds": {
+                        "type": "number",
+                        "description": "Количество секунд для ожидания"
+                    }
+                },
+                "required": [
+                    "seconds"
+                ]
             }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "scroll",
-                "description": "Прокрутить страницу вниз или вверх",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "direction": {
-                            "type": "string",
-                            "enum": ["down", "up"],
-                            "description": "Направление прокрутки"
-                        },
-                        "amount": {
-                            "type": "number",
-                            "description": "Количество пикселей для прокрутки (по умолчанию 500)"
-                        }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "scroll",
+            "description": "Прокрутить страницу вниз или вверх",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "direction": {
+                        "type": "string",
+                        "enum": [
+                            "down",
+                            "up"
+                        ],
+                        "description": "Направление прокрутки"
                     },
-                    "required": ["direction"]
-                }
+                    "amount": {
+                        "type": "number",
+                        "description": "Количество пикселей для прокрутки (по умолчанию 500)"
+                    }
+                },
+                "required": [
+                    "direction"
+                ]
             }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "task_complete",
-                "description": "Сообщить, что задача выполнена и предоставить результат",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "result": {
-                            "type": "string",
-                            "description": "Описание результата выполнения задачи"
-                        }
-                    },
-                    "required": ["result"]
-                }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "go_back",
+            "description": "Вернуться на предыдущую страницу в истории браузера",
+            "parameters": {
+                "type": "object",
+                "properties": {},
+                "required": []
             }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "ask_user",
-                "description": "Запросить дополнительную информацию у пользователя, если задача не может быть выполнена без неё",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "question": {
-                            "type": "string",
-                            "description": "Вопрос для пользователя"
-                        }
-                    },
-                    "required": ["question"]
-                }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "task_complete",
+            "description": "Сообщить, что задача выполнена и предоставить результат",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "result": {
+                        "type": "string",
+                        "description": "Описание результата выполнения задачи"
+                    }
+                },
+                "required": [
+                    "result"
+                ]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "ask_user",
+            "description": "Запросить дополнительную информацию у пользователя, если задача не может быть выполнена без неё",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "question": {
+                        "type": "string",
+                        "description": "Вопрос для пользователя"
+                    }
+                },
+                "required": [
+                    "question"
+                ]
             }
         }
-    ]
+    }
+]
+
+
+def freeze_json(value):
+    # Канонический порядок ключей: одинаковые данные всегда сериализуются в одинаковые байты,
+    # и начало запроса совпадает с кешем на стороне провайдера
+    return json.loads(json.dumps(value, sort_keys=True, ensure_ascii=False))
+
+
+class TaskState:
+    def __init__(self, task: str):
+        self.task = task
+        self.recent_actions: List[str] = []
+        self.consecutive_same_actions = 0
+        self.last_page_info = None
+        self.last_successful_result = None
+        self.consecutive_success_count = 0
+        self.recorder = MacroRecorder()
+        # Итог задачи для пакетного режима: completed, needs_input, stopped, incomplete или error
+        self.status = 'completed'
+        self.route = 'llm'
+        self.iterations = 0
+        self.llm_seconds = 0.0
+
+
+class AIAgent:
+    def __init__(self, provider='groq', **provider_kwargs):
+        # Можно передать имя провайдера или готовый экземпляр, общий для нескольких агентов
+        if isinstance(provider, BaseAIProvider):
+            self.ai_provider: BaseAIProvider = provider
+            self.provider_name = type(provider).__name__
+        else:
+            self.ai_provider: BaseAIProvider = get_ai_provider(provider, **provider_kwargs)
+            self.provider_name = provider
+        self.browser_controller: Optional[BrowserController] = None
+        self.page_analyzer: Optional[PageAnalyzer] = None
+        self.element_finder: Optional[ElementFinder] = None
+        self.context_manager = ContextManager(max_context_length=MAX_CONTEXT_LENGTH)
+        self.guardrails = GuardrailsSystem()
+        self.stream_completions = STREAM_COMPLETIONS
+        self.last_stream_metrics: Optional[Dict] = None
+        self.last_page_report: Optional[Dict] = None
+        # Селектор, который сработал в последнем действии, - для записи сценария
+        self.last_action: Optional[Dict] = None
+        # Хранилище сценариев; AgentRuntime передает общее для всех сессий
+        self.macros: Optional[MacroStore] = None
+        self.selector_memory: Optional[SelectorMemory] = None
+        # Системный промпт и схемы инструментов фиксируются один раз на агента
+        self.system_prompt = SYSTEM_PROMPT
+        if PAGE_SUMMARY_FORMAT == 'compact':
+            self.system_prompt += "\n\n" + PAGE_FORMAT_LEGEND
+        self.tools = freeze_json(TOOLS)
+        self.usage_totals = {'requests': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'completion_tokens': 0}
+        # Без пользователя подтверждения и вопросы решаются политикой, а не через input()
+        self.interactive = True
+        self.ask_user_policy = BATCH_ASK_USER_POLICY
+        self.last_task: Optional[TaskState] = None
+        
+    def set_browser(self, browser_controller: BrowserController):
+        self.browser_controller = browser_controller
+        self.interactive = browser_controller.interactive
+        if SELECTOR_MEMORY_ENABLED and self.selector_memory is None:
+            self.selector_memory = SelectorMemory(str(Path(browser_controller.user_data_dir) / 'selectors.json'))
+        if browser_controller.page:
+            self.page_analyzer = PageAnalyzer(browser_controller.page, engine=PAGE_ANALYZER_ENGINE,
+                                              summary_format=PAGE_SUMMARY_FORMAT,
+                                              token_budget=PAGE_SUMMARY_TOKEN_BUDGET or None)
+            self.element_finder = ElementFinder(browser_controller.page, memory=self.selector_memory)
+        else:
+            self.element_finder = None
+        if MACROS_ENABLED and self.macros is None:
+            self.macros = MacroStore(str(Path(browser_controller.user_data_dir) / 'macros.json'))
+    
+    def get_tools(self) -> List[Dict]:
+        # Схемы инструментов заморожены при создании агента и не пересобираются на каждой итерации
+        return self.tools
     
     async def execute_function(self, function_name: str, arguments: dict) -> str:
         tool_passed, tool_reason, tool_risk = self.guardrails.check_tool(function_name, arguments)
@@ -189,14 +311,14 @@ class AIAgent:
                 return f"❌ БЛОКИРОВАНО: {tool_reason}"
             elif tool_risk == RiskLevel.HIGH:
                 print(f"⚠️  ВНИМАНИЕ: {tool_reason}")
-                if not await SecurityLayer.check_and_confirm(f"Выполнить {function_name}", str(arguments)):
+                if not await SecurityLayer.check_and_confirm(f"Выполнить {function_name}", str(arguments),
+                                                             interactive=self.interactive):
                     return f"❌ Действие отменено пользователем: {tool_reason}"
         page = self.browser_controller.page
         
         if function_name == "navigate_to_url":
             url = arguments.get("url")
             await self.browser_controller.navigate(url)
-            await asyncio.sleep(2)
             
             captcha_info = await self.browser_controller.check_captcha()
             if captcha_info['has_captcha']:
@@ -213,7 +335,7 @@ class AIAgent:
                 print("\n🔐 Обнаружена форма входа после перехода на сайт. Ожидаю успешного входа...")
                 login_success = await self.browser_controller.wait_for_login()
                 if login_success:
-                    await asyncio.sleep(1)
+                    await tracing.sleep(1, 'after_login')
                     if self.page_analyzer:
                         page_info = await self.page_analyzer.get_page_summary()
                         self.context_manager.update_page_info(page_info)
@@ -228,7 +350,7 @@ class AIAgent:
             selector = arguments.get("selector")
             
             # Проверяем безопасность
-            if not await SecurityLayer.check_and_confirm("click", element_text):
+            if not await SecurityLayer.check_and_confirm("click", element_text, interactive=self.interactive):
                 return "Действие отменено пользователем"
             
             try:
@@ -244,12 +366,14 @@ class AIAgent:
                         found = await self.element_finder.find_clickable_element(element_text)
                         if found and found.get('element'):
                             await found['element'].click()
+                            self.last_action = {'selector': found['selector']}
+                            self.element_finder.remember('click', element_text, found)
                         else:
                             return f"Не удалось найти элемент с текстом '{element_text}'. Попробуй получить информацию о странице через get_page_info."
                     else:
                         return "Element finder не инициализирован"
                 
-                await asyncio.sleep(1)  # Ждем после клика
+                await tracing.sleep(1, 'after_click')  # Ждем после клика
                 
                 # Проверяем наличие капчи после клика
                 captcha_info = await self.browser_controller.check_captcha()
@@ -277,12 +401,17 @@ class AIAgent:
                         await page.fill(selector, text)
                     except:
                         return f"Не удалось заполнить поле по селектору '{selector}'"
+                    self.last_action = {'selector': selector,
+                                        'input_type': await self._input_type(await page.query_selector(selector))}
                 else:
                     # Используем улучшенный поиск полей
                     if self.element_finder:
                         found = await self.element_finder.find_input_field(field_description)
                         if found and found.get('element'):
                             await found['element'].fill(text)
+                            self.last_action = {'selector': found['selector'],
+                                                'input_type': await self._input_type(found['element'])}
+                            self.element_finder.remember('input', field_description, found)
                         else:
                             return f"Не удалось найти поле '{field_description}'. Попробуй получить информацию о странице через get_page_info."
                     else:
@@ -296,12 +425,16 @@ class AIAgent:
             if self.page_analyzer:
                 page_info = await self.page_analyzer.get_page_summary()
                 self.context_manager.update_page_info(page_info)
-                return json.dumps(page_info, ensure_ascii=False, indent=2)
+                # Если страница та же, модели уходит только разница с предыдущим снимком
+                self.last_page_report = self.page_analyzer.get_page_report(
+                    page_info, self.context_manager.live_snapshots()
+                )
+                return self.last_page_report['content']
             return "Page analyzer не инициализирован"
         
         elif function_name == "wait":
             seconds = arguments.get("seconds", 1)
-            await asyncio.sleep(seconds)
+            await tracing.sleep(seconds, 'wait_tool')
             return f"Подождал {seconds} секунд"
         
         elif function_name == "scroll":
@@ -313,9 +446,19 @@ class AIAgent:
             else:
                 await page.evaluate(f"window.scrollBy(0, -{amount})")
             
-            await asyncio.sleep(0.5)
+            await tracing.sleep(0.5, 'after_scroll')
             return f"Прокрутил страницу {direction} на {amount}px"
         
+        elif function_name == "go_back":
+            previous_url = page.url
+            response = await page.go_back(wait_until='domcontentloaded')
+            if response is None and page.url == previous_url:
+                return "Не удалось вернуться назад: нет предыдущей страницы"
+            if self.page_analyzer:
+                page_info = await self.page_analyzer.get_page_summary()
+                self.context_manager.update_page_info(page_info)
+            return f"Вернулся на {page.url}"
+        
         elif function_name == "task_complete":
             result = arguments.get("result", "")
             return f"✅ Задача выполнена: {result}"
@@ -326,278 +469,484 @@ class AIAgent:
         
         return f"Неизвестная функция: {function_name}"
     
+    async def _input_type(self, element) -> str:
+        # Тип поля нужен записи сценария: значение из поля пароля не сохраняется. Пустая строка - тип неизвестен
+        try:
+            return await element.evaluate(
+                "el => el.isContentEditable ? 'contenteditable' : (el.type || el.tagName || '').toLowerCase()"
+            ) if element else ''
+        except Exception:
+            return ''
+    
+    def _parse_tool_call(self, tool_call: Dict):
+        function_name = tool_call['function']['name']
+        try:
+            arguments = json.loads(tool_call['function']['arguments'])
+        except:
+            arguments = tool_call['function'].get('arguments', {})
+            if isinstance(arguments, str):
+                try:
+                    arguments = json.loads(arguments)
+                except:
+                    arguments = {}
+        return function_name, arguments
+    
+    def _check_repetition(self, state: 'TaskState', function_name: str, arguments: dict) -> Optional[str]:
+        action_key = f"{function_name}:{json.dumps(arguments, sort_keys=True)}"
+        
+        if len(state.recent_actions) > 0 and state.recent_actions[-1] == action_key:
+            state.consecutive_same_actions += 1
+            if state.consecutive_same_actions >= 2:
+                print("⚠️  Обнаружено повторение одних и тех же действий. Завершаю выполнение.")
+                return f"⚠️  Прервано из-за повторяющихся действий."
+        else:
+            state.consecutive_same_actions = 0
+        
+        state.recent_actions.append(action_key)
+        if len(state.recent_actions) > 5:
+            state.recent_actions.pop(0)
+        return None
+    
+    async def _execute_tool_call(self, state: 'TaskState', function_name: str, arguments: dict):
+        # Возвращает результат инструмента, итоговый ответ (для task_complete)
+        # и отчет о снимке страницы для get_page_info
+        try:
+            self.last_page_report = None
+            self.last_action = None
+            page_url = self.browser_controller.page.url if self.browser_controller and self.browser_controller.page else ''
+            with span('tool', tool=function_name):
+                result = await self.execute_function(function_name, arguments)
+            page_report = self.last_page_report
+            state.recorder.record(function_name, arguments, self.last_action, page_url, result)
+            print(f"   Результат: {result}")
+            if function_name == "task_complete":
+                return result, result, None
+            return result, None, page_report
+        except Exception as e:
+            result = f"Ошибка при выполнении функции {function_name}: {str(e)}"
+            print(f"   ❌ Ошибка: {result}")
+            return result, None, None
+    
+    def _evaluate_tool_result(self, state: 'TaskState', function_name: str, result: str) -> Optional[str]:
+        task = state.task
+        if function_name == "get_page_info" and self.context_manager.current_page_info:
+            # Модель может получить только разницу снимков, эвристики же смотрят на страницу целиком
+            result = json.dumps(self.context_manager.current_page_info, ensure_ascii=False, indent=2)
+        if function_name == "get_page_info":
+            current_page_info = result
+            if state.last_page_info and current_page_info == state.last_page_info:
+                result_str = str(result)
+                result_lower = result_str.lower()
+                task_lower = task.lower()
+                
+                if any(keyword in result_lower for keyword in ["додж", "dodge", "challenger", "челенджер", "челленджер"]):
+                    if any(keyword in result_lower for keyword in ["цена", "стоимость", "руб", "₽"]):
+                        print("✅ Найден искомый контент, страница не изменилась. Завершаю выполнение.")
+                        return f"✅ Задача выполнена: найден {task_lower.split('найди')[1] if 'найди' in task_lower else 'искомый контент'}"
+                
+                if "найден" in result_lower or "нашел" in result_lower or "найдено" in result_lower:
+                    print("✅ Контент уже найден, страница не изменилась. Завершаю выполнение.")
+                    return f"✅ Задача выполнена: {result}"
+            state.last_page_info = current_page_info
+        
+        result_lower = str(result).lower()
+        task_lower = task.lower()
+        success_indicators = ["найден", "нашел", "найдено", "успешно", "готово", "выполнено", "завершено"]
+        
+        if function_name == "get_page_info":
+            result_str = str(result)
+            if any(keyword in task_lower for keyword in ["найди", "найти", "найди там"]):
+                search_keywords = []
+                if "додж" in task_lower or "dodge" in task_lower:
+                    search_keywords.extend(["додж", "dodge"])
+                if "челенджер" in task_lower or "challenger" in task_lower or "челленджер" in task_lower:
+                    search_keywords.extend(["challenger", "челенджер", "челленджер"])
+                
+                if search_keywords and any(keyword in result_str.lower() for keyword in search_keywords):
+                    if "цена" in result_str.lower() or "стоимость" in result_str.lower() or "руб" in result_str.lower():
+                        print("✅ Найден искомый контент на странице. Завершаю выполнение.")
+                        return f"✅ Задача выполнена: найден {task_lower.split('найди')[1] if 'найди' in task_lower else 'искомый контент'}"
+        
+        if any(indicator in result_lower for indicator in success_indicators):
+            if function_name in ["get_page_info", "click_element", "navigate_to_url", "scroll"]:
+                if state.last_successful_result == result:
+                    state.consecutive_success_count += 1
+                    if state.consecutive_success_count >= 2:
+                        print("✅ Обнаружен повторяющийся успешный результат. Завершаю выполнение.")
+                        return f"✅ Задача выполнена: {result}"
+                else:
+                    state.consecutive_success_count = 1
+                    state.last_successful_result = result
+                
+                if "найден" in result_lower or "нашел" in result_lower or "найдено" in result_lower:
+                    print("✅ Обнаружен успешный результат. Завершаю выполнение.")
+                    return f"✅ Задача выполнена: {result}"
+        
+        return None
+    
+    @traced('fast_path')
+    async def _run_fast_path(self, state: 'TaskState', intent: List) -> Optional[str]:
+        print("⚡ Простая команда, выполняю без модели")
+        done = []
+        for function_name, arguments in intent:
+            print(f"🔧 Вызываю: {function_name}({json.dumps(arguments, ensure_ascii=False)})")
+            found = None
+            if function_name == 'click_element':
+                # Элемент ищется до клика: слабое частичное совпадение может указать на что угодно
+                found = await self._find_confident_click(arguments['element_text'])
+                if found:
+                    arguments = dict(arguments, selector=found['selector'])
+            if function_name == 'click_element' and not found:
+                result = f"Не удалось уверенно найти элемент с текстом '{arguments['element_text']}'"
+            else:
+                result, _, _ = await self._execute_tool_call(state, function_name, arguments)
+            if action_failed(result):
+                # Команда распознана, но не выполнилась: дальше решает модель
+                self.context_manager.add_message({
+                    "role": "user",
+                    "content": "Команду пытались выполнить напрямую:\n" + "\n".join(done + [
+                        f"- {function_name}({json.dumps(arguments, ensure_ascii=False)}) → {result}"
+                    ]) + "\nПродолжи выполнение задачи с текущего состояния страницы."
+                })
+                return None
+            if found:
+                self.element_finder.remember('click', arguments['element_text'], found)
+            done.append(f"- {function_name}({json.dumps(arguments, ensure_ascii=False)}) → {result}")
+        return f"✅ Задача выполнена: {result}"
+    
+    async def _find_confident_click(self, element_text: str) -> Optional[Dict]:
+        if not self.element_finder:
+            return None
+        found = await self.element_finder.find_clickable_element(element_text)
+        if not found or not found.get('selector'):
+            return None
+        if found.get('method') in CONFIDENT_CLICK_METHODS or (found.get('score') or 0) >= CONFIDENT_CLICK_SCORE:
+            return found
+        return None
+    
+    @traced('macro.replay')
+    async def _replay_macro(self, state: 'TaskState', macro: Dict, params: List[str]) -> Optional[str]:
+        print(f"⚡ Найден сохраненный сценарий ({len(macro['steps'])} шагов), выполняю без модели")
+        done = []
+        diverged = None
+        for step in macro['steps']:
+            arguments = fill_slots(step['arguments'], params)
+            expected_page = fill_slots(step['page'], params)
+            current_url = self.browser_controller.page.url
+            if expected_page and page_key(current_url) != expected_page:
+                diverged = f"открыта страница {current_url}, сценарий ожидал {expected_page}"
+                break
+            selector = arguments.get('selector')
+            if selector and step['tool'] in ('click_element', 'type_text'):
+                try:
+                    element = await self.browser_controller.page.query_selector(selector)
+                    visible = bool(element) and await element.is_visible()
+                except Exception:
+                    visible = False
+                if not visible:
+                    diverged = f"на странице нет элемента {selector}"
+                    break
+            
+            print(f"🔁 Шаг сценария: {step['tool']}({json.dumps(arguments, ensure_ascii=False)})")
+            result, _, _ = await self._execute_tool_call(state, step['tool'], arguments)
+            if action_failed(result):
+                diverged = result
+                break
+            done.append(f"- {step['tool']}({json.dumps(arguments, ensure_ascii=False)}) → {result}")
+        
+        if diverged is None:
+            self.macros.mark_replayed(macro)
+            if not macro['needs_answer']:
+                print("✅ Сценарий выполнен полностью")
+                return fill_slots(macro['result'], params)
+            note = "Действия выполнены автоматически по сохраненному сценарию:\n" + "\n".join(done) + \
+                "\nПолучи информацию со страницы через get_page_info и заверши задачу."
+        else:
+            print(f"⚠️  Сценарий разошелся со страницей: {diverged}. Продолжаю с моделью")
+            self.macros.forget(macro)
+            note = "Часть действий выполнена автоматически по сохраненному сценарию:\n" + \
+                ("\n".join(done) or "- ничего") + \
+                f"\nСледующий шаг не удался: {diverged}. Продолжи выполнение задачи с текущего состояния страницы."
+        self.context_manager.add_message({"role": "user", "content": note})
+        return None
+    
+    async def _stream_completion(self, messages: List[Dict], tools: List[Dict], on_tool_call) -> Dict:
+        # Вызовы инструментов передаются в on_tool_call сразу, как только их аргументы полностью получены,
+        # пока модель еще генерирует остальной ответ
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        metrics = {'time_to_first_token': None, 'time_to_first_action': None, 'total': None}
+        response = {'content': None, 'tool_calls': []}
+        
+        async for event in self.ai_provider.stream_chat_completion(messages=messages, tools=tools, tool_choice="auto"):
+            if metrics['time_to_first_token'] is None:
+                metrics['time_to_first_token'] = loop.time() - started
+            if event['type'] == 'tool_call':
+                if metrics['time_to_first_action'] is None:
+                    metrics['time_to_first_action'] = loop.time() - started
+                on_tool_call(event['tool_call'])
+            elif event['type'] == 'done':
+                response = event['response']
+        
+        metrics['total'] = loop.time() - started
+        self.last_stream_metrics = metrics
+        parts = [f"первый токен {metrics['time_to_first_token']:.2f} с"] if metrics['time_to_first_token'] is not None else []
+        if metrics['time_to_first_action'] is not None:
+            parts.append(f"первое действие {metrics['time_to_first_action']:.2f} с")
+        parts.append(f"ответ {metrics['total']:.2f} с")
+        print(f"⏱️  Модель: {', '.join(parts)}")
+        return response
+    
+    def _record_usage(self, usage: Optional[Dict]):
+        if not usage:
+            return
+        self.usage_totals['requests'] += 1
+        for key in ('prompt_tokens', 'cached_tokens', 'completion_tokens'):
+            self.usage_totals[key] += usage.get(key, 0)
+        print(f"📊 Токены: промпт {usage.get('prompt_tokens', 0)} (из кеша {usage.get('cached_tokens', 0)}), "
+              f"ответ {usage.get('completion_tokens', 0)}")
+    
+    @traced('process_task')
     async def process_task(self, task: str) -> str:
         print(f"\n🤖 Начинаю выполнение задачи: {task}\n")
         
-        # Инициализируем контекст
-        system_prompt = """Ты автономный AI-агент, который управляет браузером для выполнения задач пользователя.
-
-Твои возможности:
-- Переходить на страницы
-- Кликать на элементы (кнопки, ссылки)
-- Вводить текст в поля
-- Получать информацию о странице
-- Прокручивать страницу
-
-КРИТИЧЕСКИ ВАЖНЫЕ ПРАВИЛА:
-1. Анализируй задачу пользователя и выполняй ТОЛЬКО необходимые действия для её выполнения
-2. НЕ делай лишних кликов и переходов - если задача уже выполнена, используй task_complete
-3. Если ты на странице с результатами поиска и нашел нужный контент - задача выполнена, используй task_complete
-4. НЕ переходи по ссылкам "Каталог", "О нас", "Контакты" и другим, если они не нужны для выполнения задачи
-5. Если задача - найти что-то на сайте, используй поиск или фильтры, а не навигационное меню
-6. После каждого действия проверяй, выполнена ли задача - если да, используй task_complete
-7. НЕ используй заготовленные планы - адаптируйся к ситуации
-8. НЕ используй хардкоженные селекторы - находи элементы по их тексту и описанию
-9. Если не можешь найти элемент, попробуй разные способы (текст, aria-label, классы)
-10. Если задача требует деструктивного действия (оплата, удаление), система спросит подтверждение
-11. Если нужна дополнительная информация от пользователя, используй ask_user
-
-Начни с получения информации о текущей странице, если она уже открыта."""
-        
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": task}
-        ]
+        # Инициализируем контекст: историю сообщений и бюджет токенов ведет ContextManager
+        self.context_manager.start(self.system_prompt, task)
         
         max_iterations = 50
         iteration = 0
         login_checked = False
-        recent_actions = []
-        last_page_info = None
-        consecutive_same_actions = 0
-        task_completed = False
-        last_successful_result = None
-        consecutive_success_count = 0
+        state = TaskState(task)
+        self.last_task = state
+        domain = start_domain(self.browser_controller.page.url) if self.browser_controller and self.browser_controller.page else ''
+        
+        # Простые команды (открыть адрес, прокрутить, подождать, назад, нажать) выполняются без модели
+        intent = match_intent(task) if FAST_PATH_ENABLED else None
+        if intent:
+            final = await self._run_fast_path(state, intent)
+            if final is not None:
+                state.route = 'fast_path'
+                return final
+        
+        # Знакомая задача повторяется по сохраненному сценарию; модель нужна, только если сценарий разошелся
+        # со страницей или итог надо прочитать со страницы
+        match = self.macros.match(task, domain) if self.macros and not intent else None
+        if match:
+            final = await self._replay_macro(state, *match)
+            if final is not None:
+                state.route = 'macro'
+                return final
         
-        while iteration < max_iterations and not task_completed:
+        while iteration < max_iterations:
             iteration += 1
-            print(f"\n[Итерация {iteration}]")
-            
-            try:
-                if not login_checked:
-                    login_status = await self.browser_controller.check_login_status()
-                    if login_status['has_login_form'] and not login_status['is_logged_in']:
-                        print("\n🔐 Обнаружена форма входа. Ожидаю успешного входа...")
-                        login_success = await self.browser_controller.wait_for_login()
-                        login_checked = True
-                        if login_success:
-                            await asyncio.sleep(1)
-                            if self.page_analyzer:
-                                page_info = await self.page_analyzer.get_page_summary()
-                                self.context_manager.update_page_info(page_info)
-                            messages.append({"role": "user", "content": "Вход выполнен успешно. Продолжи выполнение задачи."})
-                        continue
-                    else:
-                        login_checked = True
-                
-                captcha_info = await self.browser_controller.check_captcha()
-                if captcha_info['has_captcha']:
-                    print(f"\n⚠️  {captcha_info['message']}")
-                    await self.browser_controller.wait_for_captcha_completion()
-                
-                # Вызываем AI через провайдер
-                tools = self.get_tools()
-                response = await self.ai_provider.chat_completion(
-                    messages=messages,
-                    tools=tools,
-                    tool_choice="auto"
-                )
-                
-                content = response.get('content', '')
-                tool_calls = response.get('tool_calls', [])
+            state.iterations = iteration
+            with span('iteration', number=iteration):
+                print(f"\n[Итерация {iteration}]")
+                scheduler = None
                 
-                if content:
-                    output_passed, output_errors = self.guardrails.check_output(content)
-                    if not output_passed:
-                        print(f"⚠️  Предупреждения системы безопасности:")
-                        for err in output_errors:
-                            print(f"  - {err}")
-                
-                # Форматируем tool_calls для OpenAI API (добавляем поле type)
-                formatted_tool_calls = []
-                if tool_calls:
-                    for tc in tool_calls:
-                        formatted_tool_calls.append({
-                            "id": tc.get('id', ''),
-                            "type": "function",  # Обязательное поле для OpenAI API
-                            "function": tc.get('function', {})
-                        })
-                
-                # Добавляем ответ AI в контекст
-                assistant_message = {
-                    "role": "assistant",
-                    "content": content or None
-                }
-                if formatted_tool_calls:
-                    assistant_message["tool_calls"] = formatted_tool_calls
-                
-                messages.append(assistant_message)
-                
-                # Если есть tool calls, выполняем их
-                if tool_calls:
-                    for tool_call in tool_calls:
-                        function_name = tool_call['function']['name']
-                        tool_call_id = tool_call.get('id', '')
-                        
-                        try:
-                            arguments = json.loads(tool_call['function']['arguments'])
-                        except:
-                            arguments = tool_call['function'].get('arguments', {})
-                            if isinstance(arguments, str):
-                                try:
-                                    arguments = json.loads(arguments)
-                                except:
-                                    arguments = {}
-                        
+                try:
+                    if not login_checked:
+                        login_status = await self.browser_controller.check_login_status()
+                        if login_status['has_login_form'] and not login_status['is_logged_in']:
+                            print("\n🔐 Обнаружена форма входа. Ожидаю успешного входа...")
+                            login_success = await self.browser_controller.wait_for_login()
+                            login_checked = True
+                            if login_success:
+                                await tracing.sleep(1, 'after_login')
+                                if self.page_analyzer:
+                                    page_info = await self.page_analyzer.get_page_summary()
+                                    self.context_manager.update_page_info(page_info)
+                                self.context_manager.add_message({"role": "user", "content": "Вход выполнен успешно. Продолжи выполнение задачи."})
+                            continue
+                        else:
+                            login_checked = True
+                    
+                    captcha_info = await self.browser_controller.check_captcha()
+                    if captcha_info['has_captcha']:
+                        print(f"\n⚠️  {captcha_info['message']}")
+                        await self.browser_controller.wait_for_captcha_completion()
+                    
+                    scheduler = ToolScheduler()
+                    dispatched = []
+                    stop_message = None
+                    
+                    def dispatch(tool_call: Dict):
+                        nonlocal stop_message
+                        if stop_message or scheduler.stopped:
+                            return
+                        function_name, arguments = self._parse_tool_call(tool_call)
                         print(f"🔧 Вызываю: {function_name}({json.dumps(arguments, ensure_ascii=False)})")
-                        
-                        action_key = f"{function_name}:{json.dumps(arguments, sort_keys=True)}"
-                        
-                        if len(recent_actions) > 0 and recent_actions[-1] == action_key:
-                            consecutive_same_actions += 1
-                            if consecutive_same_actions >= 2:
-                                print("⚠️  Обнаружено повторение одних и тех же действий. Завершаю выполнение.")
-                                task_completed = True
-                                return f"⚠️  Прервано из-за повторяющихся действий."
+                        stop_message = self._check_repetition(state, function_name, arguments)
+                        if stop_message:
+                            return
+                        job = scheduler.submit(
+                            lambda: self._execute_tool_call(state, function_name, arguments),
+                            read_only=self.guardrails.is_read_only_tool(function_name),
+                            # Эвристики завершения меняют состояние задачи, поэтому применяются по порядку
+                            evaluate=lambda outcome: (
+                                outcome[0],
+                                outcome[1] if outcome[1] is not None
+                                else self._evaluate_tool_result(state, function_name, outcome[0]),
+                                outcome[2]
+                            )
+                        )
+                        dispatched.append((tool_call, function_name, job))
+                    
+                    # Вызываем AI через провайдер
+                    tools = self.get_tools()
+                    messages = self.context_manager.get_messages()
+                    llm_started = asyncio.get_running_loop().time()
+                    with span('llm', streaming=self.stream_completions, messages=len(messages)) as llm_span:
+                        if self.stream_completions:
+                            response = await self._stream_completion(messages, tools, dispatch)
                         else:
-                            consecutive_same_actions = 0
-                        
-                        recent_actions.append(action_key)
-                        if len(recent_actions) > 5:
-                            recent_actions.pop(0)
+                            response = await self.ai_provider.chat_completion(
+                                messages=messages,
+                                tools=tools,
+                                tool_choice="auto"
+                            )
+                        llm_span.set(tool_calls=len(response.get('tool_calls') or []))
+                    state.llm_seconds += asyncio.get_running_loop().time() - llm_started
+                    
+                    self._record_usage(response.get('usage'))
+                    content = response.get('content', '')
+                    tool_calls = response.get('tool_calls', [])
+                    
+                    if content:
+                        output_passed, output_errors = self.guardrails.check_output(content)
+                        if not output_passed:
+                            print(f"⚠️  Предупреждения системы безопасности:")
+                            for err in output_errors:
+                                print(f"  - {err}")
+                    
+                    # Форматируем tool_calls для OpenAI API (добавляем поле type)
+                    formatted_tool_calls = []
+                    if tool_calls:
+                        for tc in tool_calls:
+                            formatted_tool_calls.append({
+                                "id": tc.get('id', ''),
+                                "type": "function",  # Обязательное поле для OpenAI API
+                                "function": tc.get('function', {})
+                            })
+                    
+                    # Добавляем ответ AI в контекст
+                    assistant_message = {
+                        "role": "assistant",
+                        "content": content or None
+                    }
+                    if formatted_tool_calls:
+                        assistant_message["tool_calls"] = formatted_tool_calls
+                    
+                    self.context_manager.add_message(assistant_message)
+                    
+                    # Если есть tool calls, выполняем их (в потоковом режиме они уже запущены)
+                    if tool_calls:
+                        if not self.stream_completions:
+                            for tool_call in tool_calls:
+                                dispatch(tool_call)
                         
-                        try:
-                            result = await self.execute_function(function_name, arguments)
-                            print(f"   Результат: {result}")
-                            
-                            if function_name == "get_page_info":
-                                current_page_info = result
-                                if last_page_info and current_page_info == last_page_info:
-                                    result_str = str(result)
-                                    result_lower = result_str.lower()
-                                    task_lower = task.lower()
-                                    
-                                    if any(keyword in result_lower for keyword in ["додж", "dodge", "challenger", "челенджер", "челленджер"]):
-                                        if any(keyword in result_lower for keyword in ["цена", "стоимость", "руб", "₽"]):
-                                            print("✅ Найден искомый контент, страница не изменилась. Завершаю выполнение.")
-                                            task_completed = True
-                                            return f"✅ Задача выполнена: найден {task_lower.split('найди')[1] if 'найди' in task_lower else 'искомый контент'}"
-                                    
-                                    if "найден" in result_lower or "нашел" in result_lower or "найдено" in result_lower:
-                                        print("✅ Контент уже найден, страница не изменилась. Завершаю выполнение.")
-                                        task_completed = True
-                                        return f"✅ Задача выполнена: {result}"
-                                last_page_info = current_page_info
-                            
-                            result_lower = str(result).lower()
-                            task_lower = task.lower()
-                            success_indicators = ["найден", "нашел", "найдено", "успешно", "готово", "выполнено", "завершено"]
+                        questions = []
+                        for tool_call, function_name, job in dispatched:
+                            outcome = await job
+                            if outcome is None:
+                                continue
+                            result, final, page_report = outcome
+                            if final is not None:
+                                await scheduler.drain()
+                                if function_name == "task_complete" and self.macros:
+                                    self.macros.record(task, domain, state.recorder, final)
+                                return final
                             
-                            if function_name == "get_page_info":
-                                result_str = str(result)
-                                if any(keyword in task_lower for keyword in ["найди", "найти", "найди там"]):
-                                    search_keywords = []
-                                    if "додж" in task_lower or "dodge" in task_lower:
-                                        search_keywords.extend(["додж", "dodge"])
-                                    if "челенджер" in task_lower or "challenger" in task_lower or "челленджер" in task_lower:
-                                        search_keywords.extend(["challenger", "челенджер", "челленджер"])
-                                    
-                                    if search_keywords and any(keyword in result_str.lower() for keyword in search_keywords):
-                                        if "цена" in result_str.lower() or "стоимость" in result_str.lower() or "руб" in result_str.lower():
-                                            print("✅ Найден искомый контент на странице. Завершаю выполнение.")
-                                            task_completed = True
-                                            return f"✅ Задача выполнена: найден {task_lower.split('найди')[1] if 'найди' in task_lower else 'искомый контент'}"
+                            self.context_manager.add_tool_result(tool_call.get('id', ''), function_name, result,
+                                                                snapshot=page_report)
                             
-                            if any(indicator in result_lower for indicator in success_indicators):
-                                if function_name in ["get_page_info", "click_element", "navigate_to_url", "scroll"]:
-                                    if last_successful_result == result:
-                                        consecutive_success_count += 1
-                                        if consecutive_success_count >= 2:
-                                            print("✅ Обнаружен повторяющийся успешный результат. Завершаю выполнение.")
-                                            task_completed = True
-                                            return f"✅ Задача выполнена: {result}"
-                                    else:
-                                        consecutive_success_count = 1
-                                        last_successful_result = result
-                                    
-                                    if "найден" in result_lower or "нашел" in result_lower or "найдено" in result_lower:
-                                        print("✅ Обнаружен успешный результат. Завершаю выполнение.")
-                                        task_completed = True
-                                        return f"✅ Задача выполнена: {result}"
-                        except Exception as e:
-                            result = f"Ошибка при выполнении функции {function_name}: {str(e)}"
-                            print(f"   ❌ Ошибка: {result}")
+                            if function_name == "ask_user":
+                                questions.append(result)
                         
-                        messages.append({
-                            "role": "tool",
-                            "tool_call_id": tool_call_id,
-                            "content": result
-                        })
+                        if stop_message:
+                            state.status = 'stopped'
+                            return stop_message
                         
-                        if function_name == "task_complete":
-                            task_completed = True
-                            return result
-                        elif function_name == "ask_user":
-                            # Запрашиваем ответ у пользователя
-                            user_response = input(f"\n{result}\nВаш ответ: ")
-                            messages.append({
+                        # Ответы пользователя добавляются после всех результатов инструментов,
+                        # чтобы сообщения tool шли сразу за ответом модели
+                        for question in questions:
+                            if not self.interactive:
+                                if self.ask_user_policy != 'continue':
+                                    state.status = 'needs_input'
+                                    return question
+                                print(f"{question}\n   Пользователь недоступен, продолжаю без ответа")
+                                self.context_manager.add_message({
+                                    "role": "user",
+                                    "content": "Пользователь недоступен и не ответит. Продолжи задачу, выбрав разумный вариант, "
+                                               "или заверши ее через task_complete и опиши, каких данных не хватило."
+                                })
+                                continue
+                            user_response = input(f"\n{question}\nВаш ответ: ")
+                            self.context_manager.add_message({
                                 "role": "user",
                                 "content": user_response
                             })
-                
-                # Если нет tool calls и есть текстовый ответ
-                elif content:
-                    print(f"💬 {content}")
-                    content_lower = content.lower()
-                    completion_keywords = ["выполнена", "завершена", "готово", "найдено", "нашел", "найден", "успешно"]
-                    if any(keyword in content_lower for keyword in completion_keywords):
-                        if "найдено" in content_lower or "нашел" in content_lower or "найден" in content_lower:
-                            print("✅ Агент сообщил об успешном выполнении. Завершаю выполнение.")
-                            task_completed = True
-                            return content
-                
-            except Exception as e:
-                error_msg = str(e)
-                print(f"❌ Ошибка: {error_msg}")
-                
-                # Проверяем ошибки API провайдера
-                if ("403" in error_msg or "402" in error_msg or 
-                    "permission" in error_msg.lower() or 
-                    "credits" in error_msg.lower() or 
-                    "licenses" in error_msg.lower() or
-                    "insufficient balance" in error_msg.lower() or
-                    "insufficient" in error_msg.lower()):
-                    print("\n⚠️  ПРОБЛЕМА С API ПРОВАЙДЕРОМ!")
-                    print("   Похоже, у вашего аккаунта нет кредитов, баланса или доступа.")
-                    print("   Рекомендуется переключиться на бесплатный провайдер:")
-                    print("   - Groq (бесплатный): https://console.groq.com/")
-                    print("   - Ollama (локальный, полностью бесплатный): https://ollama.ai/")
-                    print("\n   См. инструкции в SWITCH_TO_GROQ.md")
-                    return f"Ошибка API провайдера: {error_msg}. Переключитесь на бесплатный провайдер (Groq или Ollama)."
-                
-                # Адаптация: добавляем контекст об ошибке и предлагаем альтернативы
-                error_context = f"Произошла ошибка: {error_msg}. "
-                
-                # Анализируем тип ошибки и предлагаем решение
-                if "не удалось найти" in error_msg.lower() or "not found" in error_msg.lower():
-                    error_context += "Попробуй получить актуальную информацию о странице через get_page_info, чтобы увидеть доступные элементы."
-                elif "timeout" in error_msg.lower() or "waiting" in error_msg.lower():
-                    error_context += "Страница может загружаться медленно. Попробуй подождать несколько секунд через wait."
-                elif "click" in error_msg.lower() or "клик" in error_msg.lower():
-                    error_context += "Элемент может быть не виден или перекрыт. Попробуй прокрутить страницу через scroll или найти элемент другим способом."
-                else:
-                    error_context += "Попробуй другой подход или получи информацию о текущем состоянии страницы."
-                
-                messages.append({
-                    "role": "user",
-                    "content": error_context
-                })
-                
-                # Ограничиваем количество ошибок подряд
-                if iteration > 5:
-                    consecutive_errors = sum(1 for msg in messages[-5:] if "ошибка" in msg.get('content', '').lower() or "error" in msg.get('content', '').lower())
-                    if consecutive_errors >= 3:
-                        return f"Слишком много ошибок подряд. Возможно, задача требует дополнительной информации или другого подхода. Последняя ошибка: {error_msg}"
+                    
+                    # Если нет tool calls и есть текстовый ответ
+                    elif content:
+                        print(f"💬 {content}")
+                        content_lower = content.lower()
+                        completion_keywords = ["выполнена", "завершена", "готово", "найдено", "нашел", "найден", "успешно"]
+                        if any(keyword in content_lower for keyword in completion_keywords):
+                            if "найдено" in content_lower or "нашел" in content_lower or "найден" in content_lower:
+                                print("✅ Агент сообщил об успешном выполнении. Завершаю выполнение.")
+                                return content
+                    
+                except Exception as e:
+                    error_msg = str(e)
+                    print(f"❌ Ошибка: {error_msg}")
+                    
+                    # Уже запущенные инструменты доводим до конца, новые не запускаем
+                    if scheduler:
+                        scheduler.stop()
+                        await scheduler.drain()
+                    
+                    # В режиме replay промах кеша не исправится повтором запроса
+                    if isinstance(e, CacheMissError):
+                        state.status = 'error'
+                        return f"Ошибка кеша ответов модели: {error_msg}"
+                    
+                    # Ошибки доступа к провайдеру (ключ, кредиты, права) не исправятся повтором
+                    if isinstance(e, ProviderAuthError):
+                        print("\n⚠️  ПРОБЛЕМА С API ПРОВАЙДЕРОМ!")
+                        print("   Похоже, у вашего аккаунта нет кредитов, баланса или доступа.")
+                        print("   Рекомендуется переключиться на бесплатный провайдер:")
+                        print("   - Groq (бесплатный): https://console.groq.com/")
+                        print("   - Ollama (локальный, полностью бесплатный): https://ollama.ai/")
+                        print("\n   См. инструкции в SWITCH_TO_GROQ.md")
+                        state.status = 'error'
+                        return f"Ошибка API провайдера: {error_msg}. Переключитесь на бесплатный провайдер (Groq или Ollama)."
+                    
+                    # Адаптация: добавляем контекст об ошибке и предлагаем альтернативы
+                    error_context = f"Произошла ошибка: {error_msg}. "
+                    
+                    # Анализируем тип ошибки и предлагаем решение
+                    if "не удалось найти" in error_msg.lower() or "not found" in error_msg.lower():
+                        error_context += "Попробуй получить актуальную информацию о странице через get_page_info, чтобы увидеть доступные элементы."
+                    elif "timeout" in error_msg.lower() or "waiting" in error_msg.lower():
+                        error_context += "Страница может загружаться медленно. Попробуй подождать несколько секунд через wait."
+                    elif "click" in error_msg.lower() or "клик" in error_msg.lower():
+                        error_context += "Элемент может быть не виден или перекрыт. Попробуй прокрутить страницу через scroll или найти элемент другим способом."
+                    else:
+                        error_context += "Попробуй другой подход или получи информацию о текущем состоянии страницы."
+                    
+                    self.context_manager.add_message({
+                        "role": "user",
+                        "content": error_context
+                    })
+                    
+                    # Ограничиваем количество ошибок подряд
+                    if iteration > 5:
+                        consecutive_errors = sum(1 for msg in self.context_manager.recent_messages(5) if "ошибка" in (msg.get('content') or '').lower() or "error" in (msg.get('content') or '').lower())
+                        if consecutive_errors >= 3:
+                            state.status = 'error'
+                            return f"Слишком много ошибок подряд. Возможно, задача требует дополнительной информации или другого подхода. Последняя ошибка: {error_msg}"
         
+        state.status = 'incomplete'
         return "Достигнуто максимальное количество итераций. Задача может быть не завершена."
 
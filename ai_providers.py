@@ -1,41 +1,78 @@
 import os
 import asyncio
-from typing import List, Dict, Optional, Any
-from openai import AsyncOpenAI
+import random
+from collections import deque
+from typing import List, Dict, Optional, Any, AsyncIterator
+from provider_transport import TransportSettings, ProviderError, openai_client, translate_error, with_retries
+from pathlib import Path
+from llm_cache import LLMResponseCache
+from token_estimator import estimate_tokens
 import json
 
 
+def usage_from_response(usage) -> Optional[Dict]:
+    # cached_tokens - часть промпта, взятая из кеша провайдера (дешевле и быстрее)
+    if not usage:
+        return None
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return {
+        'prompt_tokens': usage.prompt_tokens or 0,
+        'completion_tokens': usage.completion_tokens or 0,
+        'cached_tokens': (getattr(details, 'cached_tokens', None) or 0) if details else 0
+    }
+
+
 class BaseAIProvider:
     async def chat_completion(self, messages: List[Dict], tools: List[Dict], tool_choice: str = "auto") -> Dict:
         raise NotImplementedError
     
+    async def stream_chat_completion(self, messages: List[Dict], tools: List[Dict],
+                                     tool_choice: str = "auto") -> AsyncIterator[Dict]:
+        # События: content (фрагмент текста), tool_call (полностью полученный вызов), done (итоговый ответ).
+        # Провайдеры без потоковой передачи отдают весь ответ сразу
+        response = await self.chat_completion(messages, tools, tool_choice)
+        if response.get('content'):
+            yield {'type': 'content', 'delta': response['content']}
+        for tool_call in response.get('tool_calls', []):
+            yield {'type': 'tool_call', 'tool_call': tool_call}
+        yield {'type': 'done', 'response': response}
+    
     def format_tools(self, tools: List[Dict]) -> Any:
         return tools
 
 
-class OpenRouterProvider(BaseAIProvider):
-    def __init__(self, api_key: str, model: str = "openai/gpt-4o-mini"):
+class OpenAICompatibleProvider(BaseAIProvider):
+    # Любой сервер с API OpenAI Chat Completions: OpenRouter, vLLM, llama.cpp, Ollama, LM Studio
+    def __init__(self, base_url: str, model: str, api_key: str = '', name: str = '',
+                 transport: TransportSettings = None, default_headers: Dict = None):
         self.api_key = api_key
         self.model = model
-        self.base_url = "https://openrouter.ai/api/v1"
-        self.client = AsyncOpenAI(
-            api_key=self.api_key,
-            base_url=self.base_url,
-            default_headers={
-                "HTTP-Referer": "https://github.com/andrewvoevodin/browser-ai-agent",
-                "X-Title": "Browser AI Agent"
-            }
-        )
-        
-        print(f"🔑 Инициализирован OpenRouter провайдер с моделью: {self.model}")
+        self.base_url = base_url
+        self.name = name or base_url
+        self.transport = transport or TransportSettings()
+        # Локальные серверы обычно не проверяют ключ, но клиент OpenAI требует непустой
+        self.client = openai_client(self.api_key or 'none', self.base_url, self.transport, default_headers)
+    
+    def _prepare_messages(self, messages: List[Dict]) -> List[Dict]:
+        # OpenAI и большинство моделей кешируют общий префикс запроса автоматически,
+        # а модели Anthropic - только до отмеченной точки: отмечаем неизменный системный промпт
+        if not self.model.startswith('anthropic/') or not messages or messages[0].get('role') != 'system':
+            return messages
+        system = dict(messages[0])
+        system['content'] = [{'type': 'text', 'text': system['content'], 'cache_control': {'type': 'ephemeral'}}]
+        return [system] + messages[1:]
     
     async def chat_completion(self, messages: List[Dict], tools: List[Dict], tool_choice: str = "auto") -> Dict:
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                tools=tools if tools else None,
-                tool_choice=tool_choice if tools else None
+            response = await with_retries(
+                lambda: self.client.chat.completions.create(
+                    model=self.model,
+                    messages=self._prepare_messages(messages),
+                    tools=tools if tools else None,
+                    tool_choice=tool_choice if tools else None
+                ),
+                self.transport,
+                self.name
             )
             
             message = response.choices[0].message
@@ -50,21 +87,426 @@ class OpenRouterProvider(BaseAIProvider):
                             'arguments': tc.function.arguments
                         }
                     } for tc in (message.tool_calls or [])
-                ]
+                ],
+                'usage': usage_from_response(response.usage)
             }
         except Exception as e:
-            error_msg = str(e)
-            print(f"❌ Ошибка OpenRouter: {error_msg}")
-            raise RuntimeError(f"Ошибка OpenRouter: {error_msg}")
+            error = translate_error(e, self.name)
+            print(f"❌ {error}")
+            if error is e:
+                raise
+            raise error from e
+    
+    async def stream_chat_completion(self, messages: List[Dict], tools: List[Dict],
+                                     tool_choice: str = "auto") -> AsyncIterator[Dict]:
+        content_parts = []
+        usage = None
+        pending: Dict[int, Dict] = {}
+        emitted = set()
+        tool_calls = []
+        
+        def complete(index: int) -> Dict:
+            emitted.add(index)
+            call = pending[index]
+            tool_call = {'id': call['id'], 'function': {'name': call['name'], 'arguments': call['arguments']}}
+            tool_calls.append(tool_call)
+            return {'type': 'tool_call', 'tool_call': tool_call}
+        
+        try:
+            # Повторяется только установка потока: уже полученную часть ответа повторить нельзя
+            stream = await with_retries(
+                lambda: self.client.chat.completions.create(
+                    model=self.model,
+                    messages=self._prepare_messages(messages),
+                    tools=tools if tools else None,
+                    tool_choice=tool_choice if tools else None,
+                    stream=True,
+                    stream_options={'include_usage': True}
+                ),
+                self.transport,
+                self.name
+            )
+            
+            async for chunk in stream:
+                # Расход токенов приходит в последнем фрагменте без choices
+                if getattr(chunk, 'usage', None):
+                    usage = usage_from_response(chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content_parts.append(delta.content)
+                    yield {'type': 'content', 'delta': delta.content}
+                
+                for tc in (delta.tool_calls or []):
+                    # Фрагменты аргументов приходят по частям; вызов с меньшим индексом
+                    # считается завершенным, как только начался следующий
+                    for index in sorted(pending):
+                        if index < tc.index and index not in emitted:
+                            yield complete(index)
+                    call = pending.setdefault(tc.index, {'id': '', 'name': '', 'arguments': ''})
+                    if tc.id:
+                        call['id'] = tc.id
+                    if tc.function and tc.function.name:
+                        call['name'] += tc.function.name
+                    if tc.function and tc.function.arguments:
+                        call['arguments'] += tc.function.arguments
+                    if call['name'] and call['arguments'] and tc.index not in emitted:
+                        try:
+                            json.loads(call['arguments'])
+                        except ValueError:
+                            continue
+                        yield complete(tc.index)
+        except Exception as e:
+            error = translate_error(e, self.name)
+            print(f"❌ {error}")
+            if error is e:
+                raise
+            raise error from e
+        
+        for index in sorted(pending):
+            if index not in emitted:
+                yield complete(index)
+        
+        yield {'type': 'done', 'response': {
+            'content': ''.join(content_parts) or None,
+            'tool_calls': tool_calls,
+            'usage': usage
+        }}
+
+
+class OpenRouterProvider(OpenAICompatibleProvider):
+    def __init__(self, api_key: str, model: str = "openai/gpt-4o-mini", transport: TransportSettings = None):
+        super().__init__(
+            "https://openrouter.ai/api/v1",
+            model,
+            api_key=api_key,
+            name='OpenRouter',
+            transport=transport,
+            default_headers={
+                "HTTP-Referer": "https://github.com/andrewvoevodin/browser-ai-agent",
+                "X-Title": "Browser AI Agent"
+            }
+        )
+        
+        print(f"🔑 Инициализирован OpenRouter провайдер с моделью: {self.model}")
+
+
+class BackendStats:
+    def __init__(self, window: int = 50):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+    
+    def record(self, latency: float, ok: bool):
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.append(latency)
+    
+    def record_censored(self, latency: float):
+        # Запрос отменен до ответа (проиграл страховочному): настоящая задержка не меньше этой.
+        # Без таких замеров медленные ответы не попадают в окно и p95 занижается
+        self.latencies.append(latency)
+    
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    
+    @property
+    def p50(self) -> Optional[float]:
+        return self.percentile(0.5)
+    
+    @property
+    def p95(self) -> Optional[float]:
+        return self.percentile(0.95)
+    
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+
+class RouterProvider(BaseAIProvider):
+    # Отправляет запрос самому быстрому исправному бэкенду по скользящей медиане задержки.
+    # Если ответ задерживается дольше p95 этого бэкенда, параллельно отправляется
+    # страховочный запрос на следующий бэкенд и используется тот ответ, что пришел первым
+    def __init__(self, backends: List[BaseAIProvider], hedge: bool = True, window: int = 50,
+                 max_error_rate: float = 0.5, min_samples: int = 5, explore_interval: int = 20):
+        if not backends:
+            raise ValueError("Для маршрутизатора не задано ни одного бэкенда")
+        self.backends = backends
+        self.hedge = hedge
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.explore_interval = explore_interval
+        self.stats = {id(backend): BackendStats(window) for backend in backends}
+        self.last_used = {id(backend): 0 for backend in backends}
+        self.requests = 0
+        self.hedged_requests = 0
+        self.hedge_wins = 0
+        # Ключ кеша ответов не зависит от того, какой бэкенд ответил
+        self.model = 'router:' + ','.join(getattr(backend, 'model', '') for backend in backends)
+    
+    def _name(self, backend: BaseAIProvider) -> str:
+        return getattr(backend, 'name', '') or type(backend).__name__
+    
+    def ranked_backends(self) -> List[BaseAIProvider]:
+        self.requests += 1
+        
+        def key(backend):
+            stats = self.stats[id(backend)]
+            unhealthy = len(stats.outcomes) >= self.min_samples and stats.error_rate > self.max_error_rate
+            # Бэкенд с малым числом замеров пробуем первым, чтобы узнать его задержку
+            p50 = stats.p50 if len(stats.latencies) >= self.min_samples else 0.0
+            return (unhealthy, p50, stats.error_rate)
+        ranked = sorted(self.backends, key=key)
+        
+        # Время от времени запрос уходит бэкенду, который дольше всех не использовался:
+        # так обновляется статистика медленных и ранее недоступных бэкендов
+        if self.explore_interval and self.requests % self.explore_interval == 0:
+            stale = min(ranked, key=lambda backend: self.last_used[id(backend)])
+            ranked.remove(stale)
+            ranked.insert(0, stale)
+        self.last_used[id(ranked[0])] = self.requests
+        return ranked
+    
+    async def _timed(self, backend: BaseAIProvider, messages: List[Dict], tools: List[Dict], tool_choice: str) -> Dict:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            response = await backend.chat_completion(messages, tools, tool_choice)
+        except asyncio.CancelledError:
+            self.stats[id(backend)].record_censored(loop.time() - started)
+            raise
+        except Exception:
+            self.stats[id(backend)].record(loop.time() - started, False)
+            raise
+        self.stats[id(backend)].record(loop.time() - started, True)
+        return response
+    
+    async def chat_completion(self, messages: List[Dict], tools: List[Dict], tool_choice: str = "auto") -> Dict:
+        ranked = self.ranked_backends()
+        last_error = None
+        
+        while ranked:
+            primary = ranked.pop(0)
+            attempts = {asyncio.ensure_future(self._timed(primary, messages, tools, tool_choice)): primary}
+            stats = self.stats[id(primary)]
+            
+            try:
+                # Страховочный запрос только по устоявшейся статистике: p95 по одному замеру - случайное число
+                if self.hedge and ranked and len(stats.latencies) >= self.min_samples:
+                    p95 = stats.p95
+                    done, _ = await asyncio.wait(attempts, timeout=p95)
+                    if not done:
+                        secondary = ranked.pop(0)
+                        self.hedged_requests += 1
+                        print(f"⏱️  {self._name(primary)} отвечает дольше обычного ({p95:.1f} с), "
+                              f"дублирую запрос в {self._name(secondary)}")
+                        attempts[asyncio.ensure_future(self._timed(secondary, messages, tools, tool_choice))] = secondary
+                
+                pending = set(attempts)
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            if attempts[task] is not primary:
+                                self.hedge_wins += 1
+                            return task.result()
+                        last_error = task.exception()
+                        print(f"⚠️  Бэкенд {self._name(attempts[task])} недоступен: {last_error}")
+            finally:
+                # Проигравший запрос и запросы отмененного вызова не должны продолжать тратить токены
+                for task in attempts:
+                    if not task.done():
+                        task.cancel()
+        
+        raise last_error
+    
+    async def stream_chat_completion(self, messages: List[Dict], tools: List[Dict],
+                                     tool_choice: str = "auto") -> AsyncIterator[Dict]:
+        # Потоковый ответ не дублируется: вызовы инструментов из него запускаются сразу.
+        # На следующий бэкенд переходим, только если поток оборвался до первого события
+        loop = asyncio.get_running_loop()
+        last_error = None
+        for backend in self.ranked_backends():
+            started = loop.time()
+            received = False
+            try:
+                async for event in backend.stream_chat_completion(messages, tools, tool_choice):
+                    received = True
+                    if event['type'] == 'done':
+                        self.stats[id(backend)].record(loop.time() - started, True)
+                    yield event
+                return
+            except ProviderError as e:
+                self.stats[id(backend)].record(loop.time() - started, False)
+                if received:
+                    raise
+                last_error = e
+                print(f"⚠️  Бэкенд {self._name(backend)} недоступен: {e}")
+        raise last_error
+    
+    def get_stats(self) -> List[Dict]:
+        return [
+            {
+                'backend': self._name(backend),
+                'p50': self.stats[id(backend)].p50,
+                'p95': self.stats[id(backend)].p95,
+                'error_rate': self.stats[id(backend)].error_rate,
+                'requests': len(self.stats[id(backend)].outcomes)
+            } for backend in self.backends
+        ]
+
+
+class MockProvider(BaseAIProvider):
+    # Проигрывает заранее записанный сценарий без сети: каждый шаг - ответ модели
+    # {"content": "...", "tool_calls": [{"name": "navigate_to_url", "arguments": {"url": "..."}}]}.
+    # Нужен для воспроизводимых прогонов агента и замеров без ключа API
+    def __init__(self, script=None, latency: float = 0.0, latency_jitter: float = 0.0, seed: int = 0):
+        if isinstance(script, (str, Path)):
+            with open(script, encoding='utf-8') as f:
+                script = json.load(f)
+        if isinstance(script, dict):
+            script = script.get('steps', [])
+        self.steps: List[Dict] = list(script or [])
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.random = random.Random(seed)
+        self.model = 'mock'
+        self.position = 0
+        self.requests: List[List[Dict]] = []
+    
+    def reset(self, script=None):
+        if script is not None:
+            self.steps = list(script.get('steps', []) if isinstance(script, dict) else script)
+        self.position = 0
+        self.requests = []
+    
+    async def chat_completion(self, messages: List[Dict], tools: List[Dict], tool_choice: str = "auto") -> Dict:
+        self.requests.append(messages)
+        delay = self.latency + self.random.uniform(0, self.latency_jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        
+        if self.position < len(self.steps):
+            step = self.steps[self.position]
+        else:
+            # Сценарий закончился - завершаем задачу, чтобы прогон не зациклился
+            step = {'tool_calls': [{'name': 'task_complete', 'arguments': {'result': 'Сценарий закончился'}}]}
+        self.position += 1
+        
+        tool_calls = []
+        for index, call in enumerate(step.get('tool_calls', [])):
+            arguments = call.get('arguments', {})
+            tool_calls.append({
+                'id': f"call_{self.position}_{index}",
+                'function': {
+                    'name': call['name'],
+                    'arguments': arguments if isinstance(arguments, str) else json.dumps(arguments, ensure_ascii=False)
+                }
+            })
+        
+        prompt_tokens = sum(estimate_tokens(message.get('content') or '') for message in messages
+                            if isinstance(message.get('content'), str))
+        return {
+            'content': step.get('content'),
+            'tool_calls': tool_calls,
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': 0, 'cached_tokens': 0}
+        }
+
+
+class CacheMissError(ProviderError):
+    pass
+
+
+class CachingProvider(BaseAIProvider):
+    # exact - отвечаем из кеша, при промахе обращаемся к модели и сохраняем ответ;
+    # record - всегда обращаемся к модели и перезаписываем кеш;
+    # replay - только из кеша, промах считается ошибкой (для тестов без сети)
+    MODES = ('exact', 'record', 'replay')
+    
+    def __init__(self, provider: BaseAIProvider, cache: LLMResponseCache, mode: str = 'exact'):
+        if mode not in self.MODES:
+            raise ValueError(f"Неизвестный режим кеша: {mode}")
+        self.provider = provider
+        self.cache = cache
+        self.mode = mode
+        self.model = getattr(provider, 'model', '')
+    
+    async def chat_completion(self, messages: List[Dict], tools: List[Dict], tool_choice: str = "auto") -> Dict:
+        key = self.cache.make_key(self.model, messages, tools, tool_choice)
+        
+        if self.mode != 'record':
+            cached = self.cache.get(key)
+            if cached is not None:
+                # Ответ из локального кеша не расходует токены провайдера
+                return dict(cached, usage=None)
+            if self.mode == 'replay':
+                raise CacheMissError(f"Ответ модели не найден в кеше (режим replay): {key[:12]}")
+        
+        response = await self.provider.chat_completion(messages, tools, tool_choice)
+        self.cache.put(key, response)
+        return response
+    
+    def format_tools(self, tools: List[Dict]) -> Any:
+        return self.provider.format_tools(tools)
 
 
 def get_ai_provider(provider_name: str, **kwargs) -> BaseAIProvider:
     provider_name = provider_name.lower()
     
+    transport = TransportSettings(
+        connect_timeout=kwargs.get('connect_timeout', 10.0),
+        read_timeout=kwargs.get('read_timeout', 60.0),
+        max_retries=kwargs.get('max_retries', 3),
+        max_connections=kwargs.get('max_connections', 20)
+    )
+    
     if provider_name == 'openrouter':
-        return OpenRouterProvider(
+        provider = OpenRouterProvider(
             api_key=kwargs.get('api_key', ''),
-            model=kwargs.get('model', 'openai/gpt-4o-mini')
+            model=kwargs.get('model', 'openai/gpt-4o-mini'),
+            transport=transport
+        )
+    elif provider_name == 'router':
+        # backends: [{"name": ..., "base_url": ..., "model": ..., "api_key": ...}, ...];
+        # бэкенд без base_url - OpenRouter с общим ключом
+        backends = []
+        for backend in kwargs.get('backends') or []:
+            if backend.get('base_url'):
+                backends.append(OpenAICompatibleProvider(
+                    backend['base_url'],
+                    backend.get('model', ''),
+                    api_key=backend.get('api_key', ''),
+                    name=backend.get('name', ''),
+                    transport=transport
+                ))
+            else:
+                backends.append(OpenRouterProvider(
+                    api_key=backend.get('api_key') or kwargs.get('api_key', ''),
+                    model=backend.get('model') or kwargs.get('model', 'openai/gpt-4o-mini'),
+                    transport=transport
+                ))
+        provider = RouterProvider(backends, hedge=kwargs.get('hedge', True))
+    elif provider_name == 'mock':
+        provider = MockProvider(
+            script=kwargs.get('script'),
+            latency=kwargs.get('latency', 0.0),
+            latency_jitter=kwargs.get('latency_jitter', 0.0)
+        )
+    else:
+        raise ValueError(f"Неизвестный провайдер: {provider_name}")
+    
+    cache_mode = kwargs.get('cache_mode', 'off')
+    if cache_mode and cache_mode != 'off':
+        cache = LLMResponseCache(
+            kwargs.get('cache_path') or str(Path.home() / ".browser-ai-agent" / "llm_cache.sqlite"),
+            ttl=kwargs.get('cache_ttl', 7 * 24 * 3600),
+            max_entries=kwargs.get('cache_max_entries', 5000)
         )
+        provider = CachingProvider(provider, cache, mode=cache_mode)
     
-    raise ValueError(f"Неизвестный провайдер: {provider_name}")
+    return provider
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import time
+from collections import Counter
+from typing import Dict, Optional, TextIO
+
+from agent_runtime import AgentRuntime
+
+
+# Пакетный режим: задачи читаются построчно из JSONL, результаты пишутся по мере готовности,
+# тоже JSONL, в порядке завершения (поле id связывает результат с задачей)
+
+
+def parse_task_line(line: str, number: int) -> Optional[Dict]:
+    # Строка - объект {"task": ..., "id": ..., "start_url": ...} или просто JSON-строка с задачей
+    line = line.strip()
+    if not line:
+        return None
+    item = json.loads(line)
+    if isinstance(item, str):
+        item = {'task': item}
+    if not isinstance(item, dict) or not str(item.get('task') or '').strip():
+        raise ValueError("ожидается строка с задачей или объект с полем task")
+    item.setdefault('id', number)
+    return item
+
+
+async def read_lines(source: TextIO):
+    # Чтение в отдельном потоке: stdin может быть каналом, в который задачи дописываются по ходу работы
+    loop = asyncio.get_running_loop()
+    while True:
+        line = await loop.run_in_executor(None, source.readline)
+        if not line:
+            return
+        yield line
+
+
+async def run_item(runtime: AgentRuntime, item: Dict, start_url: str = None) -> Dict:
+    record = {'id': item['id'], 'task': item['task']}
+    submitted = time.perf_counter()
+    started = None
+    agent = None
+    try:
+        async with runtime.session(start_url=item.get('start_url') or start_url) as agent:
+            started = time.perf_counter()
+            result = await agent.process_task(item['task'])
+        record.update(status=agent.last_task.status, result=result)
+    except Exception as e:
+        record.update(status='error', result=None, error=f"{type(e).__name__}: {e}")
+    finished = time.perf_counter()
+
+    state = agent.last_task if agent else None
+    record.update(
+        route=state.route if state else None,
+        iterations=state.iterations if state else 0,
+        timings={
+            'total_s': round(finished - submitted, 3),
+            'task_s': round(finished - started, 3) if started else 0.0,
+            'llm_s': round(state.llm_seconds, 3) if state else 0.0
+        }
+    )
+    return record
+
+
+async def run_batch(source: TextIO, output: TextIO, runtime: AgentRuntime, start_url: str = None) -> Counter:
+    statuses = Counter()
+    pending = set()
+
+    def write(record: Dict):
+        output.write(json.dumps(record, ensure_ascii=False) + '\n')
+        output.flush()
+        statuses[record['status']] += 1
+
+    async def collect(return_when):
+        nonlocal pending
+        done, pending = await asyncio.wait(pending, return_when=return_when)
+        for future in done:
+            write(future.result())
+
+    number = 0
+    async for line in read_lines(source):
+        number += 1
+        try:
+            item = parse_task_line(line, number)
+        except ValueError as e:
+            write({'id': number, 'task': None, 'status': 'invalid', 'result': None, 'error': str(e)})
+            continue
+        if item is None:
+            continue
+        pending.add(asyncio.ensure_future(run_item(runtime, item, start_url)))
+        # Следующая строка читается, только когда освободилось место: очередь не растет без ограничения
+        if len(pending) >= runtime.max_concurrency:
+            await collect(asyncio.FIRST_COMPLETED)
+
+    if pending:
+        await collect(asyncio.ALL_COMPLETED)
+    return statuses
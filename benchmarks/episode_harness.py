@@ -0,0 +1,168 @@
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from collections import defaultdict
+
+from ai_agent import AIAgent
+from ai_providers import MockProvider
+from browser_controller import BrowserController
+from benchmarks.fixture_site import FixtureServer
+
+
+# Сценарии полного прогона агента на локальном стенде. {base} заменяется адресом стенда
+EPISODES = {
+    'search': {
+        'start': '/',
+        'task': 'Найди Dodge Challenger через поиск и узнай цену',
+        'steps': [
+            {'tool_calls': [{'name': 'get_page_info', 'arguments': {}}]},
+            {'tool_calls': [{'name': 'type_text', 'arguments': {'field_description': 'Поиск', 'text': 'Dodge Challenger'}}]},
+            {'tool_calls': [{'name': 'click_element', 'arguments': {'element_text': 'Найти'}}]},
+            {'tool_calls': [{'name': 'get_page_info', 'arguments': {}}]},
+            {'tool_calls': [{'name': 'task_complete', 'arguments': {'result': 'Dodge Challenger 2020: 3 500 000 руб.'}}]},
+        ]
+    },
+    'catalog': {
+        'start': '/catalog',
+        'task': 'Открой карточку Dodge Challenger в каталоге',
+        'steps': [
+            {'tool_calls': [{'name': 'get_page_info', 'arguments': {}}]},
+            {'tool_calls': [{'name': 'scroll', 'arguments': {'direction': 'down', 'amount': 2000}}]},
+            {'tool_calls': [{'name': 'scroll', 'arguments': {'direction': 'up', 'amount': 2000}}]},
+            {'tool_calls': [{'name': 'click_element', 'arguments': {'element_text': 'Dodge Challenger 2020'}}]},
+            {'tool_calls': [{'name': 'get_page_info', 'arguments': {}}]},
+            {'tool_calls': [{'name': 'task_complete', 'arguments': {'result': 'Открыта карточка Dodge Challenger 2020'}}]},
+        ]
+    },
+    'navigate': {
+        'start': '/',
+        'task': 'Перейди в каталог, затем на страницу товара 5',
+        'steps': [
+            {'tool_calls': [{'name': 'navigate_to_url', 'arguments': {'url': '{base}/catalog'}}]},
+            {'tool_calls': [{'name': 'navigate_to_url', 'arguments': {'url': '{base}/product/5'}},
+                            {'name': 'get_page_info', 'arguments': {}}]},
+            {'tool_calls': [{'name': 'task_complete', 'arguments': {'result': 'Открыта страница товара 5'}}]},
+        ]
+    },
+    'login': {
+        'start': '/login',
+        'task': 'Войди в аккаунт и открой личный кабинет',
+        'steps': [
+            {'tool_calls': [{'name': 'get_page_info', 'arguments': {}}]},
+            {'tool_calls': [{'name': 'task_complete', 'arguments': {'result': 'Вход выполнен'}}]},
+        ]
+    },
+    'captcha': {
+        'start': '/captcha',
+        'task': 'Пройди проверку и найди цену первого автомобиля',
+        'steps': [
+            {'tool_calls': [{'name': 'get_page_info', 'arguments': {}}]},
+            {'tool_calls': [{'name': 'task_complete', 'arguments': {'result': 'Dodge Challenger 2020: 3 500 000 руб.'}}]},
+        ]
+    },
+}
+
+
+class ComponentTimer:
+    # Оборачивает асинхронные методы конкретных объектов и суммирует время их выполнения
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+
+    def wrap(self, component: str, owner, method: str):
+        original = getattr(owner, method)
+
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await original(*args, **kwargs)
+            finally:
+                self.seconds[component] += time.perf_counter() - started
+                self.calls[component] += 1
+
+        setattr(owner, method, timed)
+
+    def report(self) -> dict:
+        return {
+            component: {'seconds': round(self.seconds[component], 4), 'calls': self.calls[component]}
+            for component in sorted(self.seconds)
+        }
+
+
+def substitute(value, base_url: str):
+    if isinstance(value, str):
+        return value.replace('{base}', base_url)
+    if isinstance(value, list):
+        return [substitute(item, base_url) for item in value]
+    if isinstance(value, dict):
+        return {key: substitute(item, base_url) for key, item in value.items()}
+    return value
+
+
+async def run_episode(name: str, episode: dict, base_url: str, latency: float, headless: bool) -> dict:
+    provider = MockProvider(substitute(episode['steps'], base_url), latency=latency)
+    browser = BrowserController(headless=headless, user_data_dir=tempfile.mkdtemp(prefix='agent-episode-'))
+    timer = ComponentTimer()
+    started = time.perf_counter()
+    try:
+        await browser.start(start_url=base_url + episode['start'])
+        agent = AIAgent(provider=provider)
+        agent.set_browser(browser)
+
+        timer.wrap('llm', provider, 'chat_completion')
+        timer.wrap('tools', agent, 'execute_function')
+        timer.wrap('page_summary', agent.page_analyzer, 'get_page_summary')
+        timer.wrap('element_finder', agent.element_finder, 'find_clickable_element')
+        timer.wrap('element_finder', agent.element_finder, 'find_input_field')
+        timer.wrap('navigation', browser, 'navigate')
+        timer.wrap('state_probes', browser, 'probe_page_state')
+        timer.wrap('user_waits', browser, 'wait_for_captcha_completion')
+        timer.wrap('user_waits', browser, 'wait_for_login')
+
+        result = await agent.process_task(episode['task'])
+    finally:
+        await browser.close()
+    wall = time.perf_counter() - started
+
+    return {
+        'episode': name,
+        'result': result,
+        'completed': result.startswith('✅'),
+        'iterations': provider.position,
+        'wall_seconds': round(wall, 4),
+        'prompt_tokens': agent.usage_totals['prompt_tokens'],
+        'components': timer.report()
+    }
+
+
+def print_report(results: list):
+    print(f"\n{'эпизод':<10} {'итераций':>9} {'время, с':>9}  компоненты (с)")
+    for item in results:
+        components = ', '.join(f"{name} {data['seconds']:.2f}" for name, data in item['components'].items())
+        status = '' if item['completed'] else '  [не завершен]'
+        print(f"{item['episode']:<10} {item['iterations']:>9} {item['wall_seconds']:>9.2f}  {components}{status}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Прогон агента на локальном стенде со сценарной моделью')
+    parser.add_argument('--episode', action='append', choices=sorted(EPISODES), help='эпизод (можно несколько)')
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа модели, с')
+    parser.add_argument('--headed', action='store_true', help='показывать окно браузера')
+    parser.add_argument('--json', help='сохранить результаты в JSON-файл')
+    args = parser.parse_args()
+
+    results = []
+    with FixtureServer() as server:
+        for name in args.episode or list(EPISODES):
+            results.append(await run_episode(name, EPISODES[name], server.base_url, args.latency, not args.headed))
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
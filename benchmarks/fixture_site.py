@@ -0,0 +1,202 @@
+import html
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+# Локальный сайт-стенд для прогонов агента без сети: поиск, длинный каталог,
+# форма входа и имитация проверки на бота. Вход и "капча" проходятся сами через пару секунд,
+# изображая действия пользователя в браузере
+AUTO_RESOLVE_MS = 1500
+
+PRODUCTS = [
+    ('Dodge Challenger 2020', 3_500_000),
+    ('Dodge Charger 2019', 2_900_000),
+    ('Ford Mustang 2021', 4_100_000),
+    ('Chevrolet Camaro 2018', 2_700_000),
+    ('Toyota Camry 2022', 3_200_000),
+    ('Lada Vesta 2023', 1_400_000),
+    ('Kia Rio 2020', 1_300_000),
+    ('BMW M3 2019', 5_600_000),
+]
+CATALOG_SIZE = 2000
+
+
+def _catalog():
+    items = []
+    for i in range(CATALOG_SIZE):
+        name, price = PRODUCTS[i % len(PRODUCTS)]
+        items.append((i + 1, f"{name} #{i + 1}" if i >= len(PRODUCTS) else name, price + (i // len(PRODUCTS)) * 1000))
+    return items
+
+
+CATALOG = _catalog()
+
+
+def _layout(title: str, body: str, script: str = '') -> str:
+    return f"""<!DOCTYPE html>
+<html lang="ru">
+<head><meta charset="utf-8"><title>{html.escape(title)}</title></head>
+<body>
+<header><nav><a href="/">Главная</a> <a href="/catalog">Каталог</a> <a href="/about">О нас</a> <a href="/login">Вход</a></nav></header>
+<main>{body}</main>
+<footer><a href="/contacts">Контакты</a></footer>
+{f'<script>{script}</script>' if script else ''}
+</body>
+</html>"""
+
+
+def _product_card(number: int, name: str, price: int) -> str:
+    return (f'<div class="product"><a href="/product/{number}">{html.escape(name)}</a> '
+            f'<span class="price">Цена: {price:,} руб.</span></div>').replace(',', ' ')
+
+
+def home_page() -> str:
+    return _layout('Автомаркет', """
+<h1>Автомаркет</h1>
+<form action="/search" method="get">
+  <label for="q">Поиск</label>
+  <input id="q" name="q" type="text" placeholder="Поиск автомобилей">
+  <button type="submit">Найти</button>
+</form>
+<h2>Популярное</h2>
+""" + ''.join(_product_card(number, name, price) for number, name, price in CATALOG[:8]))
+
+
+def search_page(query: str) -> str:
+    words = [word for word in query.lower().split() if word]
+    found = [item for item in CATALOG if all(word in item[1].lower() for word in words)][:20]
+    cards = ''.join(_product_card(*item) for item in found) or '<p>Нет результатов</p>'
+    return _layout(f'Поиск: {query}', f"""
+<h1>Результаты поиска: {html.escape(query)}</h1>
+<p>Результатов: {len(found)}</p>
+{cards}
+<a href="/search?q={html.escape(query)}&page=2">Следующая страница</a>
+""")
+
+
+def catalog_page() -> str:
+    return _layout('Каталог', '<h1>Каталог автомобилей</h1>' +
+                   ''.join(_product_card(*item) for item in CATALOG))
+
+
+def product_page(number: int) -> str:
+    number, name, price = CATALOG[(number - 1) % CATALOG_SIZE]
+    return _layout(name, f"""
+<h1>{html.escape(name)}</h1>
+<p class="price">Цена: {price:,} руб.</p>
+<p>Пробег 20 000 км, один владелец.</p>
+<button type="button">Добавить в избранное</button>
+""".replace(',', ' '))
+
+
+def login_page() -> str:
+    return _layout('Вход', """
+<h1>Вход на сайт</h1>
+<form id="login" action="/login" method="post">
+  <input type="email" name="email" placeholder="Email">
+  <input type="password" name="password" placeholder="Пароль">
+  <button type="submit">Войти</button>
+</form>
+""", f"""
+setTimeout(() => {{
+  document.querySelector('[name=email]').value = 'user@example.com';
+  document.querySelector('[name=password]').value = 'secret';
+  document.getElementById('login').submit();
+}}, {AUTO_RESOLVE_MS});
+""")
+
+
+def account_page() -> str:
+    return _layout('Личный кабинет', """
+<h1>Личный кабинет</h1>
+<p>Добро пожаловать, user@example.com</p>
+<a href="/logout">Выход</a>
+""")
+
+
+def captcha_page() -> str:
+    return _layout('Проверка', """
+<div id="challenge">
+  <h1>Verify you are human</h1>
+  <iframe src="/captcha-frame" title="captcha"></iframe>
+</div>
+<div id="content" hidden>""" + _product_card(*CATALOG[0]) + """</div>
+""", f"""
+setTimeout(() => {{
+  document.getElementById('challenge').remove();
+  document.getElementById('content').hidden = false;
+}}, {AUTO_RESOLVE_MS});
+""")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body: str, status: int = 200, headers: dict = None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        path = url.path.rstrip('/') or '/'
+        if path == '/':
+            self._send(home_page())
+        elif path == '/search':
+            self._send(search_page(query.get('q', [''])[0]))
+        elif path == '/catalog':
+            self._send(catalog_page())
+        elif path.startswith('/product/') and path.rsplit('/', 1)[1].isdigit():
+            self._send(product_page(int(path.rsplit('/', 1)[1])))
+        elif path == '/login':
+            self._send(login_page())
+        elif path == '/account':
+            self._send(account_page())
+        elif path == '/captcha':
+            self._send(captcha_page())
+        elif path == '/captcha-frame':
+            self._send('<html><body>captcha</body></html>')
+        else:
+            self._send(_layout('Страница', f'<h1>{html.escape(path)}</h1>'))
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if urlparse(self.path).path == '/login':
+            self._send('', 303, {'Location': '/account', 'Set-Cookie': 'session=fixture; Path=/'})
+        else:
+            self._send('', 404)
+
+
+class FixtureServer:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
@@ -0,0 +1,279 @@
+"""Замеры анализа страниц, поиска элементов и проверок состояния в headless Chromium.
+
+Число обменов с браузером считается подменой приватного метода Playwright
+Connection._send_message_to_server. Если после обновления Playwright метода нет
+или он стал корутиной, обмены не считаются и выводятся как n/a.
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+try:
+    from playwright._impl._connection import Connection
+except ImportError:
+    Connection = None
+
+from browser_controller import BrowserController
+from element_finder import ElementFinder
+from page_analyzer import PageAnalyzer
+from selector_memory import SelectorMemory
+
+
+# Цели поиска есть на каждой сгенерированной странице и стоят в самом конце документа,
+# чтобы пошаговые стратегии проходили страницу целиком
+CLICK_TEXT = 'Подписаться на рассылку'
+FIELD_DESCRIPTION = 'email'
+
+TARGETS = f"""
+<form action="/subscribe" method="post">
+  <input type="email" name="email" placeholder="Ваш email">
+  <button type="submit" aria-label="{CLICK_TEXT}" title="{CLICK_TEXT}">{CLICK_TEXT}</button>
+</form>
+"""
+
+LEGACY_STRATEGIES = ('_find_by_text_selectors', '_find_by_partial_text', '_find_by_aria_label',
+                     '_find_by_title', '_find_by_xpath')
+
+
+def _document(title: str, body: str) -> str:
+    return (f'<!DOCTYPE html><html lang="ru"><head><meta charset="utf-8"><title>{title}</title></head>'
+            f'<body><header><nav><a href="/">Главная</a> <a href="/catalog">Каталог</a> '
+            f'<a href="/login">Вход</a></nav></header><main>{body}</main>{TARGETS}</body></html>')
+
+
+def _product(number: int) -> str:
+    return (f'<div class="product" data-id="{number}"><h3><a href="/product/{number}">Товар {number}</a></h3>'
+            f'<p>Описание товара {number}: доставка по Москве, гарантия один год, отзывы покупателей.</p>'
+            f'<span class="price">{1000 + number * 7} руб.</span>'
+            f'<button type="button">В избранное</button></div>')
+
+
+def _listing(size: int) -> str:
+    parts = ['<h1>Каталог</h1>']
+    length = 0
+    number = 0
+    while length < size:
+        number += 1
+        card = _product(number)
+        parts.append(card)
+        length += len(card.encode('utf-8'))
+    return ''.join(parts)
+
+
+def make_small() -> str:
+    return _document('Главная', '<h1>Магазин</h1><p>Добро пожаловать.</p>' +
+                     ''.join(_product(i) for i in range(1, 11)))
+
+
+def make_nested(depth: int = 400, branches: int = 20) -> str:
+    # Парсер Chromium ограничивает вложенность, поэтому несколько глубоких веток вместо одной
+    branch = ''.join(f'<div class="level-{i}">' for i in range(depth)) + \
+        '<span>Глубокий элемент</span><a href="/deep">Ссылка в глубине</a>' + '</div>' * depth
+    return _document('Глубокая вложенность', '<h1>Вложенность</h1>' + branch * branches)
+
+
+def make_links(count: int = 5000) -> str:
+    links = ''.join(f'<li><a href="/page/{i}" title="Раздел {i}">Раздел {i}</a></li>' for i in range(count))
+    return _document('Много ссылок', f'<h1>Карта сайта</h1><ul>{links}</ul>')
+
+
+PAGES = {
+    'small': make_small,
+    '1mb': lambda: _document('Каталог 1 МБ', _listing(1024 * 1024)),
+    '10mb': lambda: _document('Каталог 10 МБ', _listing(10 * 1024 * 1024)),
+    'nested': make_nested,
+    'links': make_links,
+}
+
+
+class RoundTripCounter:
+    # Считает сообщения от Python к процессу браузера: каждое - отдельный обмен по каналу Playwright
+    def __init__(self):
+        self.calls = Counter()
+        self._original = None
+
+    @staticmethod
+    def supported() -> bool:
+        # Приватный API: подмена безопасна, только пока метод есть и остается обычной функцией
+        method = getattr(Connection, '_send_message_to_server', None) if Connection else None
+        return method is not None and not inspect.iscoroutinefunction(method)
+
+    def __enter__(self):
+        if not self.supported():
+            return self
+        self._original = Connection._send_message_to_server
+        counter = self
+
+        def send(connection, object, method, *args, **kwargs):
+            counter.calls[method] += 1
+            return counter._original(connection, object, method, *args, **kwargs)
+
+        Connection._send_message_to_server = send
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._original is not None:
+            Connection._send_message_to_server = self._original
+            self._original = None
+
+    @property
+    def total(self) -> Optional[int]:
+        return sum(self.calls.values()) if self.supported() else None
+
+
+def build_cases(browser: BrowserController, click_text: str, field: str) -> list:
+    page = browser.page
+    dom_analyzer = PageAnalyzer(page, engine='dom')
+    soup_analyzer = PageAnalyzer(page, engine='soup')
+    finder = ElementFinder(page)
+    # Первый (разогревочный) вызов находит элемент обычным поиском и запоминает селектор,
+    # замеряются повторные поиски по памяти
+    memory_finder = ElementFinder(page, memory=SelectorMemory(tempfile.mktemp(suffix='.json')))
+
+    async def remembered_click():
+        found = await memory_finder.find_clickable_element(click_text)
+        memory_finder.remember('click', click_text, found)
+        return found
+
+    async def remembered_input():
+        found = await memory_finder.find_input_field(field)
+        memory_finder.remember('input', field, found)
+        return found
+
+    async def check_captcha():
+        # Кешированное состояние сбрасывается, чтобы измерить сам опрос страницы
+        browser.invalidate_page_state()
+        return await browser.check_captcha()
+
+    async def check_login_status():
+        browser.invalidate_page_state()
+        return await browser.check_login_status()
+
+    cases = [
+        ('get_page_summary[dom]', dom_analyzer.get_page_summary),
+        ('get_page_summary[soup]', soup_analyzer.get_page_summary),
+        ('find_clickable_element', lambda: finder.find_clickable_element(click_text)),
+        ('find_clickable_element[memory]', remembered_click),
+    ]
+    cases.extend((f'legacy{name}', lambda name=name: getattr(finder, name)(click_text)) for name in LEGACY_STRATEGIES)
+    cases.extend([
+        ('find_input_field', lambda: finder.find_input_field(field)),
+        ('find_input_field[memory]', remembered_input),
+        ('legacy_find_input_field', lambda: finder._find_input_field_legacy(field)),
+        ('check_captcha', check_captcha),
+        ('check_login_status', check_login_status),
+    ])
+    return cases
+
+
+async def measure(run, repeat: int) -> dict:
+    await run()
+    timings = []
+    round_trips = []
+    peaks = []
+    found = None
+    for _ in range(repeat):
+        tracemalloc.start()
+        with RoundTripCounter() as counter:
+            started = time.perf_counter()
+            result = await run()
+            timings.append(time.perf_counter() - started)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        round_trips.append(counter.total)
+        found = result is not None
+    return {
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'min_ms': round(min(timings) * 1000, 3),
+        'round_trips': None if None in round_trips else max(round_trips),
+        'peak_memory_kb': round(max(peaks) / 1024, 1),
+        'found': found
+    }
+
+
+async def run_suite(pages: dict, repeat: int, click_text: str, field: str) -> list:
+    results = []
+    if not RoundTripCounter.supported():
+        print("⚠️  Эта версия Playwright не позволяет считать обмены с браузером: они будут выведены как n/a")
+    workdir = Path(tempfile.mkdtemp(prefix='page-benchmark-'))
+    browser = BrowserController(headless=True, user_data_dir=str(workdir / 'profile'))
+    await browser.start()
+    try:
+        for name, html in pages.items():
+            path = workdir / f'{name}.html'
+            path.write_text(html, encoding='utf-8')
+            await browser.page.goto(path.as_uri(), wait_until='load', timeout=120000)
+            browser.invalidate_page_state()
+            size_kb = round(len(html.encode('utf-8')) / 1024, 1)
+            print(f"📄 {name}: {size_kb} КБ")
+            for case, run in build_cases(browser, click_text, field):
+                # Большие страницы замеряются меньшее число раз
+                result = await measure(run, repeat if size_kb < 1024 else max(1, repeat // 3))
+                results.append(dict(page=name, page_kb=size_kb, case=case, **result))
+                round_trips = 'n/a' if result['round_trips'] is None else result['round_trips']
+                print(f"   {case:<34}{result['median_ms']:>10.1f} мс{round_trips:>7} обм."
+                      f"{result['peak_memory_kb']:>11.1f} КБ{'' if result['found'] else '  (не найдено)'}")
+    finally:
+        await browser.close()
+    return results
+
+
+def _round_trips(item: dict) -> str:
+    return 'n/a' if item.get('round_trips') is None else str(item['round_trips'])
+
+
+def compare(results: list, baseline_path: str):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(item['page'], item['case']): item for item in json.load(f)['results']}
+    print(f"\nСравнение с {baseline_path}:")
+    for item in results:
+        before = baseline.get((item['page'], item['case']))
+        if not before or not before['median_ms']:
+            continue
+        ratio = item['median_ms'] / before['median_ms']
+        print(f"   {item['page']:<8}{item['case']:<34}{before['median_ms']:>10.1f} → {item['median_ms']:<10.1f}мс"
+              f"{ratio:>7.2f}x   обмены {_round_trips(before)} → {_round_trips(item)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замеры анализа страниц, поиска элементов и проверок состояния')
+    parser.add_argument('--page', action='append', choices=sorted(PAGES), help='сгенерированная страница (можно несколько)')
+    parser.add_argument('--html-dir', help='папка с сохраненными страницами *.html')
+    parser.add_argument('--click-text', default=CLICK_TEXT, help='текст элемента для поиска на сохраненных страницах')
+    parser.add_argument('--field', default=FIELD_DESCRIPTION, help='описание поля для поиска на сохраненных страницах')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', default='page_benchmark.json', help='файл для результатов')
+    parser.add_argument('--baseline', help='JSON прошлого запуска для сравнения')
+    args = parser.parse_args()
+
+    pages = {name: PAGES[name]() for name in (args.page or list(PAGES))}
+    if args.html_dir:
+        for path in sorted(Path(args.html_dir).glob('*.html')):
+            pages[path.stem] = path.read_text(encoding='utf-8', errors='replace')
+
+    results = asyncio.run(run_suite(pages, args.repeat, args.click_text, args.field))
+    with open(args.json, 'w', encoding='utf-8') as f:
+        json.dump({
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'results': results
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 Результаты сохранены в {args.json}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,44 +1,184 @@
 import asyncio
+import sys
 from playwright.async_api import async_playwright, Browser, BrowserContext, Page
 from pathlib import Path
+from urllib.parse import urlparse
+from load_profiles import DomainLoadProfiles
+from browser_profile import BrowserProfile
+from request_router import RequestRouter
+from tracing import span, traced
+import tracing
+
+
+CLOUDFLARE_INDICATORS = [
+    'checking your browser',
+    'just a moment',
+    'please wait',
+    'ddos protection',
+    'cloudflare'
+]
+
+CAPTCHA_KEYWORDS = ['captcha', 'verify you are human', 'i am not a robot', 'robot check']
+
+LOGGED_IN_INDICATORS = [
+    'профиль', 'profile', 'личный кабинет', 'выход', 'logout',
+    'настройки', 'settings', 'аккаунт', 'account', 'мой профиль',
+    'добро пожаловать', 'welcome', 'ваши', 'мои'
+]
+
+LOGIN_URL_PATHS = ['/login', '/signin', '/auth', '/войти', '/вход', '/sign-in', '/log-in']
+
+LOGIN_BUTTON_TEXTS = ['войти', 'вход', 'login', 'sign in']
+
+LOGOUT_TEXTS = ['выход', 'logout']
+
+# Интервал напоминаний во время ожидания и пауза, чтобы серия изменений страницы успела завершиться
+WAIT_PROGRESS_INTERVAL = 10
+# Повтор проверки страницы, если ее контекст пересоздавался во время предыдущей проверки
+PROBE_RETRY_INTERVAL = 1
+WAIT_SETTLE_DELAY = 0.1
+
+# Запросы, висящие дольше этого времени (long polling, потоки событий), не мешают считать сеть затихшей
+LONG_REQUEST_SECONDS = 2
+
+# Наблюдатель за DOM: после последней проверки состояния страницы сообщает в Python
+# о первом изменении, чтобы сбросить закешированный результат
+_DOM_OBSERVER_BODY = """
+    if (window === window.top && !window.__aiAgentObserver) {
+        window.__aiAgentDirty = false;
+        window.__aiAgentObserver = new MutationObserver(() => {
+            if (window.__aiAgentDirty) return;
+            window.__aiAgentDirty = true;
+            if (typeof window.__aiAgentDomChanged === 'function') window.__aiAgentDomChanged();
+        });
+        window.__aiAgentObserver.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    }
+"""
+
+DOM_OBSERVER_SCRIPT = "(() => {" + _DOM_OBSERVER_BODY + "})();"
+
+# Все признаки капчи, формы входа и профиля собираются за один page.evaluate
+PAGE_STATE_SCRIPT = """
+(args) => {
+""" + _DOM_OBSERVER_BODY + """
+    window.__aiAgentDirty = false;
+    const exists = (selector) => document.querySelector(selector) !== null;
+    const text = document.body ? document.body.innerText.toLowerCase() : '';
+    const hasAny = (value, keywords) => keywords.some((keyword) => value.includes(keyword));
+    const textMatches = (selector, keywords) => Array.from(document.querySelectorAll(selector))
+        .some((el) => hasAny((el.textContent || '').toLowerCase(), keywords));
+
+    return {
+        recaptcha: exists('.g-recaptcha, #recaptcha, [data-sitekey]'),
+        hcaptcha: exists('.h-captcha, [data-sitekey*="hcaptcha"]'),
+        cloudflareText: hasAny(text, args.cloudflareIndicators),
+        cloudflareChallenge: exists('#challenge-form, .cf-browser-verification, [data-ray]'),
+        captchaText: hasAny(text, args.captchaKeywords),
+        captchaIframe: exists('iframe[src*="recaptcha"], iframe[src*="hcaptcha"], iframe[src*="captcha"]'),
+        emailField: exists('input[type="email"], input[type="text"][name*="email" i], input[type="text"][name*="login" i], ' +
+            'input[type="tel"], input[type="text"][placeholder*="email" i], input[type="text"][placeholder*="телефон" i], ' +
+            'input[type="text"][placeholder*="phone" i]'),
+        passwordField: exists('input[type="password"]'),
+        loginButton: exists('button[type="submit"], input[type="submit"]') || textMatches('button', args.loginButtonTexts),
+        loggedInText: hasAny(text, args.loggedInIndicators),
+        profileElements: exists('[class*="profile" i], [class*="user" i], [class*="account" i], [id*="profile" i], ' +
+            '[id*="user" i], [id*="account" i]'),
+        logoutButton: textMatches('button, a', args.logoutTexts)
+    };
+}
+"""
+
+
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+
+def browser_args(headless: bool) -> list:
+    if headless:
+        return []
+    return [
+        '--start-maximized',
+        '--start-fullscreen'
+    ]
+
+
+def context_options(headless: bool) -> dict:
+    if not headless:
+        return {
+            'viewport': None,
+            'user_agent': USER_AGENT,
+            'no_viewport': True
+        }
+    return {
+        'viewport': {'width': 1920, 'height': 1080},
+        'user_agent': USER_AGENT
+    }
+
+
+async def launch_browser(playwright, headless: bool) -> Browser:
+    return await playwright.chromium.launch(
+        headless=headless,
+        args=browser_args(headless)
+    )
 
 
 class BrowserController:
-    def __init__(self, headless: bool = False, user_data_dir: str = None):
+    def __init__(self, headless: bool = False, user_data_dir: str = None, settle_mode: str = 'network',
+                 max_settle: float = 10.0, quiet_ms: int = 500, load_profiles: DomainLoadProfiles = None,
+                 persistent: bool = False, profile_template: str = None, route_profile: str = '',
+                 route_allow_domains: list = None, interactive: bool = True, manual_wait_timeout: float = None):
         self.headless = headless
+        # Без пользователя (пакетный режим) ожидание капчи и входа не читает stdin и ограничено по времени
+        self.interactive = interactive
+        self.manual_wait_timeout = manual_wait_timeout
+        self.persistent = persistent
+        self.request_router = None
+        if route_profile:
+            profiles = [name.strip() for name in route_profile.split(',') if name.strip()]
+            self.request_router = RequestRouter(profiles, route_allow_domains)
+            if persistent or profile_template:
+                # Перехват запросов через context.route отключает HTTP-кеш браузера
+                print("⚠️  BROWSER_ROUTE_PROFILE отключает HTTP-кеш браузера: кеш постоянного профиля "
+                      "или профиля-шаблона не будет использоваться")
+        self.profile = BrowserProfile(user_data_dir or str(Path.home() / ".browser-ai-agent"), profile_template)
         self.user_data_dir = user_data_dir or str(Path.home() / ".browser-ai-agent")
+        self.settle_mode = settle_mode
+        self.quiet_window = quiet_ms / 1000
+        self.load_profiles = load_profiles or DomainLoadProfiles(
+            str(Path(self.user_data_dir) / 'load_profiles.json'),
+            max_settle=max_settle
+        )
         self.playwright = None
         self.browser: Browser = None
+        self.owns_browser = False
         self.context: BrowserContext = None
         self.page: Page = None
+        self._page_state = None
+        self._dom_version = 0
+        self._page_activity = asyncio.Event()
         
-    async def start(self, start_url: str = None):
-        self.playwright = await async_playwright().start()
-        browser_args = []
-        if not self.headless:
-            browser_args = [
-                '--start-maximized',
-                '--start-fullscreen'
-            ]
-        
-        self.browser = await self.playwright.chromium.launch(
-            headless=self.headless,
-            args=browser_args
-        )
-        
-        if not self.headless:
-            self.context = await self.browser.new_context(
-                viewport=None,
-                user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                no_viewport=True
-            )
+    async def start(self, start_url: str = None, browser: Browser = None):
+        # Если браузер передан снаружи, контроллер работает в отдельном контексте общего процесса Chromium
+        if browser:
+            self.browser = browser
+            self.context = await self.browser.new_context(**context_options(self.headless))
+        elif self.persistent:
+            await self._start_persistent()
         else:
-            self.context = await self.browser.new_context(
-                viewport={'width': 1920, 'height': 1080},
-                user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-            )
+            self.playwright = await async_playwright().start()
+            self.browser = await launch_browser(self.playwright, self.headless)
+            self.owns_browser = True
+            self.context = await self.browser.new_context(**context_options(self.headless))
         
-        self.page = await self.context.new_page()
+        if self.request_router:
+            await self.request_router.attach(self.context)
+        await self.context.expose_binding('__aiAgentDomChanged', self._on_dom_changed)
+        await self.context.add_init_script(DOM_OBSERVER_SCRIPT)
+        if self.context.pages:
+            self.page = self.context.pages[0]
+            await self.page.evaluate(DOM_OBSERVER_SCRIPT)
+        else:
+            self.page = await self.context.new_page()
+        self.page.on('framenavigated', self._on_frame_navigated)
         
         if not self.headless:
             await self.page.evaluate("window.moveTo(0, 0); window.resizeTo(screen.width, screen.height);")
@@ -48,317 +188,413 @@ class BrowserController:
         
         return self.page
     
+    async def _start_persistent(self):
+        # Постоянный профиль: кеш, service workers и cookies сохраняются между запусками
+        profile_dir = self.profile.acquire()
+        try:
+            self.playwright = await async_playwright().start()
+            self.context = await self.playwright.chromium.launch_persistent_context(
+                profile_dir,
+                headless=self.headless,
+                args=browser_args(self.headless),
+                **context_options(self.headless)
+            )
+        except Exception:
+            self.profile.release()
+            raise
+    
     async def close(self):
         if self.context:
             await self.context.close()
-        if self.browser:
+        if self.browser and self.owns_browser:
             await self.browser.close()
         if self.playwright:
             await self.playwright.stop()
+        self.profile.release()
     
+    @traced('browser.navigate')
     async def navigate(self, url: str, timeout: int = 60000):
+        # Сначала ждем готовности DOM, затем затихания страницы, но не дольше,
+        # чем этому сайту обычно требовалось раньше
+        loop = asyncio.get_running_loop()
+        activity = _NetworkActivity(loop)
+        self.page.on('request', activity.on_request)
+        self.page.on('requestfinished', activity.on_request_done)
+        self.page.on('requestfailed', activity.on_request_done)
+        self.page.on('load', activity.on_load)
+        
         try:
-            await self.page.goto(url, wait_until='networkidle', timeout=timeout)
-        except Exception as e:
             try:
                 await self.page.goto(url, wait_until='domcontentloaded', timeout=timeout)
-            except:
-                await self.page.goto(url, wait_until='load', timeout=timeout)
-                await asyncio.sleep(2)
+            except Exception as e:
+                await self.page.goto(url, wait_until='commit', timeout=timeout)
+            
+            domain = urlparse(self.page.url).hostname
+            if self.settle_mode == 'none' or not domain:
+                return
+            
+            dom_ready = loop.time()
+            budget = self.load_profiles.settle_budget(domain)
+            if self.settle_mode == 'load':
+                settled, settle_time = await self._wait_for_load(activity, dom_ready, budget)
+            else:
+                settled, settle_time = await self._wait_for_network_quiet(activity, dom_ready, budget)
+            self.load_profiles.record(domain, settle_time, settled)
+        finally:
+            self.page.remove_listener('request', activity.on_request)
+            self.page.remove_listener('requestfinished', activity.on_request_done)
+            self.page.remove_listener('requestfailed', activity.on_request_done)
+            self.page.remove_listener('load', activity.on_load)
+    
+    async def _wait_for_load(self, activity, dom_ready: float, budget: float):
+        try:
+            await self.page.wait_for_load_state('load', timeout=budget * 1000)
+            return True, activity.loop.time() - dom_ready
+        except Exception:
+            return False, budget
+    
+    async def _wait_for_network_quiet(self, activity, dom_ready: float, budget: float):
+        loop = activity.loop
+        deadline = dom_ready + budget
+        while True:
+            now = loop.time()
+            busy = any(now - started < LONG_REQUEST_SECONDS for started in activity.inflight.values())
+            quiet_for = now - activity.last_activity
+            if not busy and quiet_for >= self.quiet_window:
+                return True, max(0.0, activity.last_activity - dom_ready)
+            if now >= deadline:
+                # Сайт так и не затих (фоновые запросы) - запоминаем момент load как реальную потребность сайта
+                if activity.load_time is not None:
+                    return False, max(0.0, activity.load_time - dom_ready)
+                return False, max(0.0, min(activity.last_activity, deadline) - dom_ready)
+            step = self.quiet_window / 2 if busy else self.quiet_window - quiet_for
+            await asyncio.sleep(max(0.01, min(step, deadline - now)))
     
     def get_page(self) -> Page:
         return self.page
     
-    async def check_captcha(self) -> dict:
+    async def probe_page_state(self) -> dict:
+        # Результат действует до следующей навигации или изменения DOM
+        if self._page_state is not None:
+            return self._page_state
+        
+        version = self._dom_version
+        with span('browser.probe_page_state'):
+            probe = await self.page.evaluate(PAGE_STATE_SCRIPT, {
+                'cloudflareIndicators': CLOUDFLARE_INDICATORS,
+                'captchaKeywords': CAPTCHA_KEYWORDS,
+                'loggedInIndicators': LOGGED_IN_INDICATORS,
+                'loginButtonTexts': LOGIN_BUTTON_TEXTS,
+                'logoutTexts': LOGOUT_TEXTS
+            })
+        state = {
+            'url': self.page.url,
+            'captcha': self._captcha_from_probe(probe),
+            'login': self._login_from_probe(probe, self.page.url.lower()),
+            'signals': probe
+        }
+        if version == self._dom_version:
+            self._page_state = state
+        return state
+    
+    def invalidate_page_state(self):
+        self._dom_version += 1
+        self._page_state = None
+        self._page_activity.set()
+    
+    def _on_frame_navigated(self, frame):
+        if frame == self.page.main_frame:
+            self.invalidate_page_state()
+    
+    def _on_dom_changed(self, source):
+        self.invalidate_page_state()
+    
+    def _captcha_from_probe(self, probe: dict) -> dict:
         captcha_info = {
             'has_captcha': False,
             'type': None,
             'message': None
         }
         
-        try:
-            recaptcha = await self.page.query_selector('.g-recaptcha, #recaptcha, [data-sitekey]')
-            if recaptcha:
-                captcha_info['has_captcha'] = True
-                captcha_info['type'] = 'reCAPTCHA'
-                captcha_info['message'] = 'Обнаружена reCAPTCHA. Пожалуйста, пройдите проверку в браузере.'
-                return captcha_info
-            
-            hcaptcha = await self.page.query_selector('.h-captcha, [data-sitekey*="hcaptcha"]')
-            if hcaptcha:
-                captcha_info['has_captcha'] = True
-                captcha_info['type'] = 'hCaptcha'
-                captcha_info['message'] = 'Обнаружена hCaptcha. Пожалуйста, пройдите проверку в браузере.'
-                return captcha_info
-            
-            page_text = await self.page.evaluate("document.body.innerText")
-            cloudflare_indicators = [
-                'checking your browser',
-                'just a moment',
-                'please wait',
-                'ddos protection',
-                'cloudflare'
-            ]
-            if any(indicator in page_text.lower() for indicator in cloudflare_indicators):
-                cf_challenge = await self.page.query_selector('#challenge-form, .cf-browser-verification, [data-ray]')
-                if cf_challenge:
-                    captcha_info['has_captcha'] = True
-                    captcha_info['type'] = 'Cloudflare'
-                    captcha_info['message'] = 'Обнаружена проверка Cloudflare. Пожалуйста, дождитесь завершения проверки в браузере.'
-                    return captcha_info
-            
-            captcha_keywords = ['captcha', 'verify you are human', 'i am not a robot', 'robot check']
-            if any(keyword in page_text.lower() for keyword in captcha_keywords):
-                captcha_iframe = await self.page.query_selector('iframe[src*="recaptcha"], iframe[src*="hcaptcha"], iframe[src*="captcha"]')
-                if captcha_iframe:
-                    captcha_info['has_captcha'] = True
-                    captcha_info['type'] = 'Generic Captcha'
-                    captcha_info['message'] = 'Обнаружена проверка на бота. Пожалуйста, пройдите проверку в браузере.'
-                    return captcha_info
-            
-        except Exception as e:
-            pass
+        if probe['recaptcha']:
+            captcha_info['has_captcha'] = True
+            captcha_info['type'] = 'reCAPTCHA'
+            captcha_info['message'] = 'Обнаружена reCAPTCHA. Пожалуйста, пройдите проверку в браузере.'
+        elif probe['hcaptcha']:
+            captcha_info['has_captcha'] = True
+            captcha_info['type'] = 'hCaptcha'
+            captcha_info['message'] = 'Обнаружена hCaptcha. Пожалуйста, пройдите проверку в браузере.'
+        elif probe['cloudflareText'] and probe['cloudflareChallenge']:
+            captcha_info['has_captcha'] = True
+            captcha_info['type'] = 'Cloudflare'
+            captcha_info['message'] = 'Обнаружена проверка Cloudflare. Пожалуйста, дождитесь завершения проверки в браузере.'
+        elif probe['captchaText'] and probe['captchaIframe']:
+            captcha_info['has_captcha'] = True
+            captcha_info['type'] = 'Generic Captcha'
+            captcha_info['message'] = 'Обнаружена проверка на бота. Пожалуйста, пройдите проверку в браузере.'
         
         return captcha_info
     
+    def _login_from_probe(self, probe: dict, page_url: str) -> dict:
+        login_status = {
+            'is_logged_in': False,
+            'has_login_form': False,
+            'indicators': []
+        }
+        
+        has_login_url = any(path in page_url for path in LOGIN_URL_PATHS)
+        has_email_field = probe['emailField']
+        has_password_field = probe['passwordField']
+        
+        if has_login_url:
+            login_status['has_login_form'] = True
+            login_status['indicators'].append('URL указывает на страницу входа')
+        elif has_email_field and has_password_field:
+            login_status['has_login_form'] = True
+            login_status['indicators'].append('Обнаружена форма входа (email/телефон + пароль)')
+        
+        has_logged_in_text = probe['loggedInText']
+        has_profile_elements = probe['profileElements']
+        has_logout = probe['logoutButton']
+        
+        if has_logged_in_text or has_profile_elements or has_logout:
+            login_status['is_logged_in'] = True
+            if has_logged_in_text:
+                login_status['indicators'].append('Обнаружен текст, указывающий на вход')
+            if has_profile_elements:
+                login_status['indicators'].append('Обнаружены элементы профиля')
+            if has_logout:
+                login_status['indicators'].append('Обнаружена кнопка выхода')
+        
+        if not login_status['has_login_form']:
+            if has_logged_in_text or has_profile_elements:
+                login_status['is_logged_in'] = True
+                login_status['indicators'].append('Форма входа отсутствует, обнаружены признаки авторизации')
+        
+        return login_status
+    
+    async def check_captcha(self) -> dict:
+        try:
+            return (await self.probe_page_state())['captcha']
+        except Exception as e:
+            return {
+                'has_captcha': False,
+                'type': None,
+                'message': None
+            }
+    
+    @traced('browser.wait_for_captcha')
     async def wait_for_captcha_completion(self, timeout: int = 300) -> bool:
+        timeout = self._manual_wait_limit(timeout)
         print("\n" + "="*60)
         print("🛡️  ОБНАРУЖЕНА ПРОВЕРКА НА БОТА!")
         print("="*60)
         print("Пожалуйста, пройдите проверку в открытом браузере.")
         print("Агент будет ждать, пока вы не пройдёте проверку...")
-        print("💡 Нажмите Enter, чтобы пропустить ожидание капчи")
+        if self.interactive:
+            print("💡 Нажмите Enter, чтобы пропустить ожидание капчи")
         print("="*60 + "\n")
         
-        initial_url = self.page.url
-        start_time = asyncio.get_event_loop().time()
-        last_check_time = start_time
-        skip_requested = False
-        
-        async def check_user_input():
-            nonlocal skip_requested
-            try:
-                import sys
-                import select
-                if sys.stdin.isatty():
-                    import termios
-                    import tty
-                    old_settings = termios.tcgetattr(sys.stdin)
-                    try:
-                        tty.setraw(sys.stdin.fileno())
-                        if select.select([sys.stdin], [], [], 0.1)[0]:
-                            char = sys.stdin.read(1)
-                            if char == '\n' or char == '\r':
-                                skip_requested = True
-                    finally:
-                        termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_settings)
-            except:
-                pass
+        def on_idle(remaining: float):
+            print(f"⏳ Ожидание прохождения капчи... (осталось ~{int(remaining)} сек){self._skip_hint()}")
         
         try:
-            while True:
-                await asyncio.sleep(0.5)
-                await check_user_input()
-                
-                if skip_requested:
-                    print("\n⏭️  Пропуск ожидания капчи по запросу пользователя")
-                    print("="*60 + "\n")
-                    return False
-                
-                await asyncio.sleep(2.5)
-                
-                current_url = self.page.url
-                url_changed = current_url != initial_url
-                
-                if url_changed:
-                    print("\n✅ Обнаружено изменение URL. Проверяю статус...")
-                    await asyncio.sleep(2)
-                    captcha_info = await self.check_captcha()
-                    if not captcha_info['has_captcha']:
-                        print("\n✅ Проверка пройдена! Продолжаю работу...\n")
-                        return True
-                    initial_url = current_url
-                
-                elapsed = asyncio.get_event_loop().time() - start_time
-                if elapsed >= timeout:
-                    print(f"\n⏱️  Превышено время ожидания ({timeout} секунд)")
-                    print("Продолжаю работу, но проверка может быть не пройдена.\n")
-                    return False
-                
-                check_elapsed = asyncio.get_event_loop().time() - last_check_time
-                if check_elapsed >= 10:
-                    try:
-                        captcha_info = await self.check_captcha()
-                        if not captcha_info['has_captcha']:
-                            print("\n✅ Проверка пройдена! Продолжаю работу...\n")
-                            return True
-                    except:
-                        pass
-                    last_check_time = asyncio.get_event_loop().time()
-                    remaining = int(timeout - elapsed)
-                    print(f"⏳ Ожидание прохождения капчи... (осталось ~{remaining} сек) | Нажмите Enter для пропуска")
-        
+            outcome = await self._wait_for_page_state(
+                lambda state: not state['captcha']['has_captcha'],
+                timeout,
+                on_idle=on_idle
+            )
         except Exception as e:
             print(f"\n⚠️  Ошибка при ожидании капчи: {e}")
             return False
+        
+        if outcome == 'done':
+            print("\n✅ Проверка пройдена! Продолжаю работу...\n")
+            return True
+        if outcome == 'skip':
+            print("\n⏭️  Пропуск ожидания капчи по запросу пользователя")
+            print("="*60 + "\n")
+            return False
+        
+        print(f"\n⏱️  Превышено время ожидания ({timeout} секунд)")
+        print("Продолжаю работу, но проверка может быть не пройдена.\n")
+        return False
     
-    async def check_login_status(self) -> dict:
-        login_status = {
-            'is_logged_in': False,
-            'has_login_form': False,
-            'indicators': []
-        }
+    async def _wait_for_page_state(self, is_done, timeout: float, on_state=None, on_idle=None) -> str:
+        # Ожидание без опроса: просыпаемся только на навигацию, загрузку, значимые ответы сети,
+        # изменения DOM и нажатие Enter; возвращает 'done', 'skip' или 'timeout'
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        skip = self._watch_skip_key(loop)
+        self.page.on('load', self._on_page_activity)
+        self.page.on('response', self._on_wait_response)
         
         try:
-            page_text = await self.page.evaluate("document.body.innerText")
-            page_url = self.page.url.lower()
-            
-            logged_in_indicators = [
-                'профиль', 'profile', 'личный кабинет', 'выход', 'logout',
-                'настройки', 'settings', 'аккаунт', 'account', 'мой профиль',
-                'добро пожаловать', 'welcome', 'ваши', 'мои'
-            ]
-            
-            has_login_url = any(path in page_url for path in ['/login', '/signin', '/auth', '/войти', '/вход', '/sign-in', '/log-in'])
-            
-            email_inputs = await self.page.query_selector_all('input[type="email"], input[type="text"][name*="email" i], input[type="text"][name*="login" i], input[type="tel"], input[type="text"][placeholder*="email" i], input[type="text"][placeholder*="телефон" i], input[type="text"][placeholder*="phone" i]')
-            password_inputs = await self.page.query_selector_all('input[type="password"]')
-            
-            has_email_field = len(email_inputs) > 0
-            has_password_field = len(password_inputs) > 0
-            
-            login_buttons = await self.page.query_selector_all('button:has-text("войти"), button:has-text("вход"), button:has-text("login"), button:has-text("sign in"), button[type="submit"], input[type="submit"]')
-            has_login_button = len(login_buttons) > 0
-            
-            if has_login_url:
-                login_status['has_login_form'] = True
-                login_status['indicators'].append('URL указывает на страницу входа')
-            elif has_email_field and has_password_field:
-                login_status['has_login_form'] = True
-                login_status['indicators'].append('Обнаружена форма входа (email/телефон + пароль)')
-            elif has_email_field and has_password_field and has_login_button:
-                login_status['has_login_form'] = True
-                login_status['indicators'].append('Обнаружена форма входа (поля + кнопка)')
-            
-            has_logged_in_text = any(indicator in page_text.lower() for indicator in logged_in_indicators)
-            
-            profile_elements = await self.page.query_selector_all('[class*="profile" i], [class*="user" i], [class*="account" i], [id*="profile" i], [id*="user" i], [id*="account" i]')
-            has_profile_elements = len(profile_elements) > 0
-            
-            logout_buttons = await self.page.query_selector_all('button:has-text("выход"), button:has-text("logout"), a:has-text("выход"), a:has-text("logout")')
-            has_logout = len(logout_buttons) > 0
+            while True:
+                self.invalidate_page_state()
+                self._page_activity.clear()
+                try:
+                    state = await self.probe_page_state()
+                except Exception:
+                    # Отправка формы входа или редирект после капчи пересоздают контекст страницы
+                    # ("Execution context was destroyed"): это не повод прекращать ожидание
+                    state = None
+                    self.invalidate_page_state()
+                    self._page_activity.clear()
+                if state is not None:
+                    if is_done(state):
+                        return 'done'
+                    if on_state:
+                        on_state(state, deadline - loop.time())
+                
+                while True:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        return 'timeout'
+                    activity = asyncio.ensure_future(self._page_activity.wait())
+                    waiters = {activity, skip} if skip else {activity}
+                    done, _ = await asyncio.wait(
+                        waiters,
+                        timeout=min(remaining, WAIT_PROGRESS_INTERVAL if state is not None else PROBE_RETRY_INTERVAL),
+                        return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if not activity.done():
+                        activity.cancel()
+                    if skip and skip.done():
+                        return 'skip'
+                    # После сбоя проверка повторяется и без события: навигация могла завершиться раньше
+                    if activity in done or state is None:
+                        break
+                    if on_idle and deadline - loop.time() > 0:
+                        on_idle(deadline - loop.time())
+                
+                # Даем серии изменений завершиться, прежде чем проверять страницу заново
+                await tracing.sleep(WAIT_SETTLE_DELAY, 'wait_settle')
+        finally:
+            self.page.remove_listener('load', self._on_page_activity)
+            self.page.remove_listener('response', self._on_wait_response)
+            self._stop_watching_skip_key(loop)
+    
+    def _on_page_activity(self, *args):
+        self._page_activity.set()
+    
+    def _on_wait_response(self, response):
+        request = response.request
+        if (request.method != 'GET'
+                or (request.resource_type == 'document' and request.frame == self.page.main_frame)
+                or 'set-cookie' in response.headers):
+            self._page_activity.set()
+    
+    def _skip_hint(self) -> str:
+        return " | Нажмите Enter для пропуска" if self.interactive else ""
+    
+    def _manual_wait_limit(self, timeout: float) -> float:
+        if self.manual_wait_timeout is None:
+            return timeout
+        return min(timeout, self.manual_wait_timeout)
+    
+    def _watch_skip_key(self, loop):
+        try:
+            # В пакетном режиме stdin может быть потоком задач, а не клавиатурой
+            if not self.interactive or not sys.stdin.isatty():
+                return None
+            skip = loop.create_future()
             
-            if has_logged_in_text or has_profile_elements or has_logout:
-                login_status['is_logged_in'] = True
-                if has_logged_in_text:
-                    login_status['indicators'].append('Обнаружен текст, указывающий на вход')
-                if has_profile_elements:
-                    login_status['indicators'].append('Обнаружены элементы профиля')
-                if has_logout:
-                    login_status['indicators'].append('Обнаружена кнопка выхода')
+            def on_input():
+                sys.stdin.readline()
+                if not skip.done():
+                    skip.set_result(True)
             
-            if not login_status['has_login_form']:
-                if has_logged_in_text or has_profile_elements:
-                    login_status['is_logged_in'] = True
-                    login_status['indicators'].append('Форма входа отсутствует, обнаружены признаки авторизации')
-        
-        except Exception as e:
+            loop.add_reader(sys.stdin.fileno(), on_input)
+            return skip
+        except Exception:
+            return None
+    
+    def _stop_watching_skip_key(self, loop):
+        try:
+            loop.remove_reader(sys.stdin.fileno())
+        except Exception:
             pass
-        
-        return login_status
     
+    async def check_login_status(self) -> dict:
+        try:
+            return (await self.probe_page_state())['login']
+        except Exception as e:
+            return {
+                'is_logged_in': False,
+                'has_login_form': False,
+                'indicators': []
+            }
+    
+    @traced('browser.wait_for_login')
     async def wait_for_login(self, timeout: int = 600) -> bool:
+        timeout = self._manual_wait_limit(timeout)
         print("\n" + "="*60)
         print("🔐 ОЖИДАНИЕ ВХОДА В АККАУНТ")
         print("="*60)
         print("Пожалуйста, войдите в свой аккаунт в открытом браузере.")
         print("Агент будет ждать успешного входа...")
-        print("💡 Нажмите Enter, чтобы пропустить ожидание входа")
+        if self.interactive:
+            print("💡 Нажмите Enter, чтобы пропустить ожидание входа")
         print("="*60 + "\n")
         
-        initial_url = self.page.url
-        start_time = asyncio.get_event_loop().time()
-        last_check_time = start_time
+        last_url = self.page.url
         last_status = None
-        skip_requested = False
+        login_status = None
         
-        async def check_user_input():
-            nonlocal skip_requested
-            try:
-                import sys
-                import select
-                if sys.stdin.isatty():
-                    import termios
-                    import tty
-                    old_settings = termios.tcgetattr(sys.stdin)
-                    try:
-                        tty.setraw(sys.stdin.fileno())
-                        if select.select([sys.stdin], [], [], 0.1)[0]:
-                            char = sys.stdin.read(1)
-                            if char == '\n' or char == '\r':
-                                skip_requested = True
-                    finally:
-                        termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_settings)
-            except:
-                pass
+        def is_logged_in(state: dict) -> bool:
+            nonlocal login_status
+            login_status = state['login']
+            return login_status['is_logged_in'] and not login_status['has_login_form']
         
-        try:
-            while True:
-                await asyncio.sleep(0.5)
-                await check_user_input()
-                
-                if skip_requested:
-                    print("\n⏭️  Пропуск ожидания входа по запросу пользователя")
-                    print("="*60 + "\n")
-                    return False
-                
-                await asyncio.sleep(2.5)
-                
-                current_url = self.page.url
-                url_changed = current_url != initial_url
-                
-                if url_changed:
-                    print(f"\n🔄 Обнаружено изменение URL: {current_url}")
-                    await asyncio.sleep(2)
-                    login_status = await self.check_login_status()
-                    
-                    if login_status['is_logged_in'] and not login_status['has_login_form']:
-                        print("\n✅ Успешный вход обнаружен!")
-                        if login_status['indicators']:
-                            print(f"   Признаки: {', '.join(login_status['indicators'])}")
-                        print("="*60 + "\n")
-                        return True
-                    
-                    initial_url = current_url
-                
-                elapsed = asyncio.get_event_loop().time() - start_time
-                if elapsed >= timeout:
-                    print(f"\n⏱️  Превышено время ожидания входа ({timeout} секунд)")
-                    print("Продолжаю работу, но вход может быть не выполнен.\n")
-                    print("="*60 + "\n")
-                    return False
-                
-                check_elapsed = asyncio.get_event_loop().time() - last_check_time
-                if check_elapsed >= 10:
-                    try:
-                        login_status = await self.check_login_status()
-                        if login_status['is_logged_in'] and not login_status['has_login_form']:
-                            print("\n✅ Успешный вход обнаружен!")
-                            if login_status['indicators']:
-                                print(f"   Признаки: {', '.join(login_status['indicators'])}")
-                            print("="*60 + "\n")
-                            return True
-                        
-                        status_str = f"Вход: {'✅' if login_status['is_logged_in'] else '⏳'}, Форма входа: {'✅' if login_status['has_login_form'] else '❌'}"
-                        if status_str != last_status:
-                            remaining = int(timeout - elapsed)
-                            print(f"⏳ {status_str} (осталось ~{remaining} сек) | Нажмите Enter для пропуска")
-                            last_status = status_str
-                    except:
-                        pass
-                    last_check_time = asyncio.get_event_loop().time()
+        def on_state(state: dict, remaining: float):
+            nonlocal last_url, last_status
+            if state['url'] != last_url:
+                print(f"\n🔄 Обнаружено изменение URL: {state['url']}")
+                last_url = state['url']
+            status = state['login']
+            status_str = f"Вход: {'✅' if status['is_logged_in'] else '⏳'}, Форма входа: {'✅' if status['has_login_form'] else '❌'}"
+            if status_str != last_status:
+                print(f"⏳ {status_str} (осталось ~{int(remaining)} сек){self._skip_hint()}")
+                last_status = status_str
         
+        try:
+            outcome = await self._wait_for_page_state(is_logged_in, timeout, on_state=on_state)
         except Exception as e:
             print(f"\n⚠️  Ошибка при ожидании входа: {e}")
             return False
+        
+        if outcome == 'done':
+            print("\n✅ Успешный вход обнаружен!")
+            if login_status['indicators']:
+                print(f"   Признаки: {', '.join(login_status['indicators'])}")
+            print("="*60 + "\n")
+            return True
+        if outcome == 'skip':
+            print("\n⏭️  Пропуск ожидания входа по запросу пользователя")
+            print("="*60 + "\n")
+            return False
+        
+        print(f"\n⏱️  Превышено время ожидания входа ({timeout} секунд)")
+        print("Продолжаю работу, но вход может быть не выполнен.\n")
+        print("="*60 + "\n")
+        return False
 
+
+class _NetworkActivity:
+    def __init__(self, loop):
+        self.loop = loop
+        self.inflight = {}
+        self.last_activity = loop.time()
+        self.load_time = None
+    
+    def on_request(self, request):
+        self.inflight[request] = self.loop.time()
+        self.last_activity = self.loop.time()
+    
+    def on_request_done(self, request):
+        if self.inflight.pop(request, None) is not None:
+            self.last_activity = self.loop.time()
+    
+    def on_load(self, *args):
+        self.load_time = self.loop.time()
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Файлы блокировок и аварийные дампы Chromium не копируются в клон профиля
+_CLONE_IGNORE = shutil.ignore_patterns('Singleton*', 'lockfile', '*.lock', 'Crashpad', 'BrowserMetrics*')
+
+
+class ProfileLock:
+    def __init__(self, profile_dir: str):
+        self.path = Path(str(profile_dir).rstrip('/\\') + '.lock')
+        self._file = None
+
+    def acquire(self, shared: bool = False):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'a+')
+        if fcntl is None:
+            return
+        try:
+            fcntl.flock(self._file.fileno(), (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+        except OSError:
+            self._file.close()
+            self._file = None
+            raise RuntimeError(
+                f"Профиль браузера {self.path.with_suffix('')} уже используется другим запуском агента. "
+                "Закройте его или используйте клонирование профиля (BROWSER_PROFILE_TEMPLATE)."
+            )
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write(str(os.getpid()))
+        self._file.flush()
+
+    def release(self):
+        if not self._file:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+
+class BrowserProfile:
+    def __init__(self, user_data_dir: str, template_dir: Optional[str] = None):
+        self.profile_dir = str(Path(user_data_dir) / 'profile')
+        self.template_dir = template_dir
+        self.path: Optional[str] = None
+        self._lock: Optional[ProfileLock] = None
+        self._temporary = False
+
+    def acquire(self) -> str:
+        if self.template_dir:
+            return self._clone_template()
+
+        self._lock = ProfileLock(self.profile_dir)
+        self._lock.acquire()
+        Path(self.profile_dir).mkdir(parents=True, exist_ok=True)
+        self.path = self.profile_dir
+        return self.path
+
+    def _clone_template(self) -> str:
+        # Каждая сессия работает с собственной копией шаблона: кеш и cookies теплые,
+        # а сам шаблон не меняется и не блокируется надолго
+        template_lock = ProfileLock(self.template_dir)
+        template_lock.acquire(shared=True)
+        try:
+            self.path = tempfile.mkdtemp(prefix='browser-ai-agent-profile-')
+            if Path(self.template_dir).exists():
+                shutil.copytree(self.template_dir, self.path, ignore=_CLONE_IGNORE, dirs_exist_ok=True)
+            self._temporary = True
+        finally:
+            template_lock.release()
+        return self.path
+
+    def release(self):
+        if self._lock:
+            self._lock.release()
+            self._lock = None
+        if self._temporary and self.path:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self._temporary = False
@@ -1,17 +1,78 @@
 import os
+import json
 from dotenv import load_dotenv
 
 load_dotenv()
 
-AI_PROVIDER = 'openrouter'
+# openrouter - одна модель через OpenRouter, router - несколько бэкендов с выбором самого быстрого,
+# mock - сценарные ответы без сети для отладки и замеров
+AI_PROVIDER = os.getenv('AI_PROVIDER', 'openrouter')
 
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY', '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')
 OPENROUTER_MODEL = os.getenv('OPENROUTER_MODEL', 'openai/gpt-4o-mini')
 
+# Бэкенды для AI_PROVIDER=router: JSON-список [{"name": "local", "base_url": "http://localhost:8000/v1", "model": "..."}];
+# бэкенд без base_url обращается к OpenRouter
+LLM_ROUTER_BACKENDS = json.loads(os.getenv('LLM_ROUTER_BACKENDS', '[]') or '[]')
+# Дублировать запрос на второй бэкенд, если первый отвечает дольше своего p95
+LLM_ROUTER_HEDGE = os.getenv('LLM_ROUTER_HEDGE', 'true').lower() == 'true'
+# AI_PROVIDER=mock: сценарий ответов модели (JSON-файл со списком шагов) и искусственная задержка ответа в секундах
+MOCK_SCRIPT = os.getenv('MOCK_SCRIPT', '')
+MOCK_LATENCY = float(os.getenv('MOCK_LATENCY', '0'))
+
+# Кеш ответов модели: off, exact (чтение и запись), record (только запись), replay (только чтение)
+LLM_CACHE_MODE = os.getenv('LLM_CACHE_MODE', 'off')
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', '')
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', '5000'))
+# Транспорт запросов к модели: таймауты в секундах, число повторов при 429/5xx и размер пула соединений
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '10'))
+LLM_READ_TIMEOUT = float(os.getenv('LLM_READ_TIMEOUT', '60'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '3'))
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '20'))
+# Потоковый ответ модели: инструменты запускаются, как только получены их аргументы
+STREAM_COMPLETIONS = os.getenv('STREAM_COMPLETIONS', 'false').lower() == 'true'
+
 BROWSER_HEADLESS = os.getenv('BROWSER_HEADLESS', 'false').lower() == 'true'
 BROWSER_START_URL = os.getenv('BROWSER_START_URL', 'about:blank')
+# Постоянный профиль в ~/.browser-ai-agent/profile: кеш и вход в аккаунты сохраняются между запусками
+BROWSER_PERSISTENT_PROFILE = os.getenv('BROWSER_PERSISTENT_PROFILE', 'false').lower() == 'true'
+# Путь к профилю-шаблону: каждая сессия получает его временную копию
+BROWSER_PROFILE_TEMPLATE = os.getenv('BROWSER_PROFILE_TEMPLATE', '')
+# Блокировка тяжелых запросов: text-only, no-media, no-third-party (можно через запятую)
+BROWSER_ROUTE_PROFILE = os.getenv('BROWSER_ROUTE_PROFILE', '')
+BROWSER_ROUTE_ALLOW_DOMAINS = [d for d in os.getenv('BROWSER_ROUTE_ALLOW_DOMAINS', '').split(',') if d.strip()]
+
+# dom - снимок страницы собирается в браузере, soup - разбор HTML через BeautifulSoup
+PAGE_ANALYZER_ENGINE = os.getenv('PAGE_ANALYZER_ENGINE', 'dom')
+# compact - построчный формат снимка страницы для модели, json - JSON с отступами
+PAGE_SUMMARY_FORMAT = os.getenv('PAGE_SUMMARY_FORMAT', 'compact')
+# Бюджет одного снимка в токенах (0 - без ограничения): при превышении отбрасываются менее важные разделы
+PAGE_SUMMARY_TOKEN_BUDGET = int(os.getenv('PAGE_SUMMARY_TOKEN_BUDGET', '1500'))
+
+# Ожидание после готовности DOM: network - затихание сети, load - событие load, none - не ждать
+NAVIGATION_SETTLE_MODE = os.getenv('NAVIGATION_SETTLE_MODE', 'network')
+NAVIGATION_MAX_SETTLE = float(os.getenv('NAVIGATION_MAX_SETTLE', '10'))
+NAVIGATION_QUIET_MS = int(os.getenv('NAVIGATION_QUIET_MS', '500'))
 
 MAX_ITERATIONS = int(os.getenv('MAX_ITERATIONS', '50'))
+MAX_CONCURRENT_SESSIONS = int(os.getenv('MAX_CONCURRENT_SESSIONS', '4'))
 MAX_CONTEXT_LENGTH = int(os.getenv('MAX_CONTEXT_LENGTH', '10000'))
+# Запись успешных задач в сценарии (macros.json в папке профиля) и их повтор без модели
+MACROS_ENABLED = os.getenv('MACROS_ENABLED', 'true').lower() == 'true'
+# Память селекторов по сайтам (selectors.json в папке профиля): найденный элемент в следующий раз ищется сразу по селектору
+SELECTOR_MEMORY_ENABLED = os.getenv('SELECTOR_MEMORY_ENABLED', 'true').lower() == 'true'
+# Простые команды (открыть адрес, прокрутить, подождать, назад, нажать) выполняются без модели
+FAST_PATH_ENABLED = os.getenv('FAST_PATH_ENABLED', 'true').lower() == 'true'
+
+# Трассировка шагов агента: файл (пусто - выключена) и формат jsonl или chrome
+TRACE_PATH = os.getenv('TRACE_PATH', '')
+TRACE_FORMAT = os.getenv('TRACE_FORMAT', 'jsonl')
 
+# Опасные действия подтверждаются без вопроса; в пакетном режиме без этого флага они отклоняются
 AUTO_CONFIRM_DESTRUCTIVE = os.getenv('AUTO_CONFIRM_DESTRUCTIVE', 'false').lower() == 'true'
+# Пакетный режим (main.py --batch): вопрос модели пользователю завершает задачу (fail)
+# или модель продолжает без ответа (continue); ожидание капчи и входа ограничено в секундах
+BATCH_ASK_USER_POLICIES = ('fail', 'continue')
+BATCH_ASK_USER_POLICY = os.getenv('BATCH_ASK_USER_POLICY', 'fail').lower()
+BATCH_WAIT_TIMEOUT = float(os.getenv('BATCH_WAIT_TIMEOUT', '30'))
@@ -1,12 +1,201 @@
-from typing import List, Dict
+import json
+from typing import List, Dict, Optional
+from token_estimator import estimate_tokens
+
+
+SUMMARY_ARGUMENTS_LIMIT = 80
+SUMMARY_RESULT_LIMIT = 120
+SUMMARY_LINES_LIMIT = 40
+TRUNCATED_CONTENT_LIMIT = 400
+PAGE_SNAPSHOT_TOOLS = ('get_page_info',)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def _shorten(text: str, limit: int) -> str:
+    text = ' '.join(str(text).split())
+    return text if len(text) <= limit else text[:limit - 1] + '…'
 
 
 class ContextManager:
-    def __init__(self, max_context_length: int = 10000):
+    def __init__(self, max_context_length: int = 10000, keep_recent_turns: int = 3, max_turns: int = 8):
+        # max_context_length - бюджет сообщений в токенах
         self.max_context_length = max_context_length
+        self.keep_recent_turns = keep_recent_turns
+        self.max_turns = max_turns
         self.history: List[Dict] = []
+        self.summary: List[str] = []
         self.current_page_info = None
-    
+        self.system_prompt = ''
+        self.task = ''
+        self.collapsed_turns = 0
+
     def update_page_info(self, page_summary: dict):
         self.current_page_info = page_summary
 
+    def start(self, system_prompt: str, task: str):
+        self.system_prompt = system_prompt
+        self.task = task
+        self.history = []
+        self.summary = []
+        self.collapsed_turns = 0
+
+    def add_message(self, message: Dict):
+        # Каждая запись истории хранит исходное сообщение и служебные данные,
+        # которые не отправляются модели
+        self.history.append({'message': message, 'snapshot': None, 'base': None, 'stub': None})
+
+    def add_tool_result(self, tool_call_id: str, function_name: str, content: str, snapshot: Optional[dict] = None):
+        # snapshot - отчет PageAnalyzer.get_page_report: номер снимка и номер полного снимка,
+        # относительно которого построена разница
+        entry = {
+            'message': {"role": "tool", "tool_call_id": tool_call_id, "content": content},
+            'snapshot': None,
+            'base': None,
+            'stub': None
+        }
+        if function_name in PAGE_SNAPSHOT_TOOLS:
+            url = (self.current_page_info or {}).get('url', '')
+            entry['snapshot'] = (snapshot or {}).get('snapshot_id', 0)
+            entry['base'] = (snapshot or {}).get('base_id')
+            entry['stub'] = f"[Устаревший снимок страницы {url}: актуальное состояние в последнем вызове get_page_info]"
+        self.history.append(entry)
+
+    def live_snapshots(self) -> List[int]:
+        # Снимки, которые модель еще видит целиком: от них можно строить разницу
+        return [entry['snapshot'] for entry in self.history if entry['snapshot'] is not None and entry['stub']]
+
+    def get_messages(self) -> List[Dict]:
+        self._stub_superseded_snapshots()
+
+        # Ходы сворачиваются сразу пачкой, а не по одному: сводка меняется реже,
+        # и начало запроса дольше остается неизменным
+        if len(self._turns()) > self.max_turns:
+            while self._collapse_oldest_turn():
+                pass
+        messages = self._render()
+
+        # Старые ходы сворачиваются в краткую сводку, пока сообщения не уложатся в бюджет
+        while self._count(messages) > self.max_context_length and self._collapse_oldest_turn():
+            messages = self._render()
+
+        if self._count(messages) > self.max_context_length:
+            messages = self._truncate_to_budget(messages)
+        return messages
+
+    def recent_messages(self, count: int) -> List[Dict]:
+        return [entry['message'] for entry in self.history[-count:]]
+
+    def estimate_size(self) -> int:
+        return self._count(self.get_messages())
+
+    def _count(self, messages: List[Dict]) -> int:
+        # Текст сообщения плюс служебные токены роли и разметки
+        total = 0
+        for message in messages:
+            total += MESSAGE_OVERHEAD_TOKENS + estimate_tokens(message.get('content') or '')
+            if message.get('tool_calls'):
+                total += estimate_tokens(json.dumps(message['tool_calls'], ensure_ascii=False))
+        return total
+
+    def _protected_snapshots(self) -> set:
+        # Модели нужен только последний снимок страницы, а если это разница - еще и ее полный снимок
+        latest = None
+        for entry in self.history:
+            if entry['snapshot'] is not None:
+                latest = entry
+        if latest is None:
+            return set()
+        return {latest['snapshot'], latest['base']} - {None}
+
+    def _stub_superseded_snapshots(self):
+        protected = self._protected_snapshots()
+        for entry in self.history:
+            if entry['snapshot'] is not None and entry['snapshot'] not in protected and entry['stub']:
+                entry['message'] = dict(entry['message'], content=entry['stub'])
+                entry['stub'] = None
+
+    def _render(self) -> List[Dict]:
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": self.task}
+        ]
+        if self.summary:
+            messages.append({
+                "role": "user",
+                "content": "Краткое содержание предыдущих шагов (подробности удалены из контекста):\n" + "\n".join(self.summary)
+            })
+        messages.extend(entry['message'] for entry in self.history)
+        return messages
+
+    def _turns(self) -> List[List[Dict]]:
+        # Ход - ответ модели вместе с результатами его инструментов и последующими сообщениями пользователя;
+        # ход удаляется целиком, поэтому пары tool_call/tool остаются согласованными
+        turns: List[List[Dict]] = []
+        for entry in self.history:
+            if entry['message']['role'] == 'assistant' or not turns:
+                turns.append([])
+            turns[-1].append(entry)
+        return turns
+
+    def _collapse_oldest_turn(self) -> bool:
+        turns = self._turns()
+        if len(turns) <= self.keep_recent_turns:
+            return False
+
+        # Полный снимок, от которого построена последняя разница, нельзя убирать из контекста:
+        # такой ход пропускается, и сворачивается следующий за ним
+        protected = self._protected_snapshots()
+        candidates = turns[:len(turns) - self.keep_recent_turns]
+        oldest = next((turn for turn in candidates
+                       if not any(entry['snapshot'] in protected for entry in turn)), None)
+        if oldest is None:
+            return False
+        self.summary.extend(self._summarize_turn(oldest))
+        if len(self.summary) > SUMMARY_LINES_LIMIT:
+            self.summary = ["..."] + self.summary[-(SUMMARY_LINES_LIMIT - 1):]
+        collapsed = {id(entry) for entry in oldest}
+        self.history = [entry for entry in self.history if id(entry) not in collapsed]
+        self.collapsed_turns += 1
+        return True
+
+    def _summarize_turn(self, turn: List[Dict]) -> List[str]:
+        results = {}
+        for entry in turn:
+            message = entry['message']
+            if message['role'] == 'tool':
+                results[message.get('tool_call_id', '')] = message.get('content') or ''
+
+        lines = []
+        for entry in turn:
+            message = entry['message']
+            if message['role'] == 'assistant':
+                if message.get('content'):
+                    lines.append(f"- Модель: {_shorten(message['content'], SUMMARY_RESULT_LIMIT)}")
+                for tool_call in message.get('tool_calls', []):
+                    function = tool_call.get('function', {})
+                    arguments = _shorten(function.get('arguments', ''), SUMMARY_ARGUMENTS_LIMIT)
+                    result = _shorten(results.get(tool_call.get('id', ''), ''), SUMMARY_RESULT_LIMIT)
+                    lines.append(f"- {function.get('name', '')}({arguments}) → {result}")
+            elif message['role'] == 'user':
+                lines.append(f"- Пользователь: {_shorten(message.get('content') or '', SUMMARY_RESULT_LIMIT)}")
+        return lines
+
+    def _truncate_to_budget(self, messages: List[Dict]) -> List[Dict]:
+        # Последняя мера: обрезаем длинные результаты инструментов, начиная со старых,
+        # последний снимок страницы обрезается последним
+        protected = self._protected_snapshots()
+        protected_ids = {id(entry['message']) for entry in self.history if entry['snapshot'] in protected}
+        tool_indexes = [i for i, message in enumerate(messages) if message['role'] == 'tool']
+        ordered = ([i for i in tool_indexes if id(messages[i]) not in protected_ids] +
+                   [i for i in tool_indexes if id(messages[i]) in protected_ids])
+        messages = [dict(message) for message in messages]
+
+        for i in ordered:
+            if self._count(messages) <= self.max_context_length:
+                break
+            content = messages[i].get('content') or ''
+            if len(content) > TRUNCATED_CONTENT_LIMIT:
+                excess = (self._count(messages) - self.max_context_length) * 3
+                keep = max(TRUNCATED_CONTENT_LIMIT, len(content) - excess)
+                messages[i]['content'] = content[:keep] + '\n… [обрезано для экономии контекста]'
+        return messages
@@ -1,13 +1,350 @@
 from playwright.async_api import Page
+from urllib.parse import urlparse
+from tracing import traced
+from selector_memory import SelectorMemory
 import re
 
 
+CANDIDATES_LIMIT = 10
+
+INPUT_KEYWORDS = ['email', 'password', 'пароль', 'имя', 'name', 'телефон', 'phone']
+
+INPUT_TYPE_MAPPING = {
+    'email': 'email',
+    'пароль': 'password',
+    'password': 'password',
+    'телефон': 'tel',
+    'phone': 'tel'
+}
+
+# Общие функции для скриптов поиска: видимость, роль и устойчивый CSS селектор
+_FINDER_HELPERS = """
+    const clean = (s) => (s || '').replace(/\\s+/g, ' ').trim();
+    const lower = (s) => clean(s).toLowerCase();
+    const isVisible = (el) => {
+        if (typeof el.checkVisibility === 'function') {
+            return el.checkVisibility({checkOpacity: true, checkVisibilityCSS: true});
+        }
+        if (!el.getClientRects().length) return false;
+        const style = getComputedStyle(el);
+        return style.visibility !== 'hidden' && style.opacity !== '0';
+    };
+    const inViewport = (el) => {
+        const rect = el.getBoundingClientRect();
+        return rect.bottom > 0 && rect.right > 0 && rect.top < innerHeight && rect.left < innerWidth;
+    };
+    const roleOf = (el) => {
+        const role = el.getAttribute('role');
+        if (role) return role;
+        const tag = el.tagName.toLowerCase();
+        if (tag === 'a' && el.hasAttribute('href')) return 'link';
+        if (tag === 'button' || tag === 'summary') return 'button';
+        if (tag === 'input') {
+            const type = (el.getAttribute('type') || 'text').toLowerCase();
+            if (['button', 'submit', 'reset', 'image'].includes(type)) return 'button';
+            if (['checkbox', 'radio'].includes(type)) return type;
+            return type === 'search' ? 'searchbox' : 'textbox';
+        }
+        if (tag === 'textarea') return 'textbox';
+        if (tag === 'select') return 'combobox';
+        return '';
+    };
+    const isUnique = (selector) => {
+        try {
+            return document.querySelectorAll(selector).length === 1;
+        } catch (e) {
+            return false;
+        }
+    };
+    const stableSelector = (el) => {
+        if (el.id && isUnique('#' + CSS.escape(el.id))) return '#' + CSS.escape(el.id);
+        for (const name of ['data-testid', 'data-qa', 'name', 'aria-label']) {
+            const value = el.getAttribute(name);
+            if (!value) continue;
+            const selector = el.tagName.toLowerCase() + '[' + name + '="' + CSS.escape(value) + '"]';
+            if (isUnique(selector)) return selector;
+        }
+        const parts = [];
+        let node = el;
+        while (node && node.nodeType === Node.ELEMENT_NODE && node !== document.documentElement) {
+            if (node !== el && node.id && isUnique('#' + CSS.escape(node.id))) {
+                parts.unshift('#' + CSS.escape(node.id));
+                break;
+            }
+            const tag = node.tagName.toLowerCase();
+            let index = 1;
+            for (let sibling = node.previousElementSibling; sibling; sibling = sibling.previousElementSibling) {
+                if (sibling.tagName === node.tagName) index++;
+            }
+            parts.unshift(tag + ':nth-of-type(' + index + ')');
+            node = node.parentElement;
+        }
+        return parts.join(' > ');
+    };
+    // Признаки элемента, по которым запомненный селектор проверяется при следующем визите;
+    // у полей ввода значение не учитывается - оно меняется после ввода
+    const fingerprintOf = (el) => {
+        const tag = el.tagName.toLowerCase();
+        const editable = ['input', 'textarea', 'select'].includes(tag) || el.isContentEditable;
+        const parts = editable
+            ? [el.getAttribute('type'), el.getAttribute('name'), el.getAttribute('placeholder'), el.getAttribute('aria-label')]
+            : [el.innerText || el.textContent || el.getAttribute('value'), el.getAttribute('aria-label'), el.getAttribute('title')];
+        return tag + ':' + lower(parts.filter(Boolean).join(' ')).slice(0, 100);
+    };
+"""
+
+# Собирает и оценивает всех кандидатов для клика за один page.evaluate
+CLICKABLE_CANDIDATES_SCRIPT = """
+({query, mainWord, limit}) => {
+""" + _FINDER_HELPERS + """
+    const CLICKABLE = 'a, button, input[type="button"], input[type="submit"], input[type="reset"], ' +
+        'input[type="image"], summary, [role="button"], [role="link"], [role="menuitem"], [role="tab"], ' +
+        '[role="option"], [onclick]';
+    const candidates = new Map();
+    const consider = (el, method, score) => {
+        const current = candidates.get(el);
+        if (!current || current.score < score) candidates.set(el, {method: method, score: score});
+    };
+    const scoreText = (el, text) => {
+        if (!text) return;
+        if (text === query) consider(el, 'text_match', 100);
+        else if (text.includes(query)) consider(el, 'partial_match', 80 - Math.min(20, (text.length - query.length) / 10));
+        else if (text.length > 1 && query.includes(text)) consider(el, 'partial_match', 60);
+        else if (mainWord && text.includes(mainWord)) consider(el, 'partial_match', 40);
+    };
+
+    for (const el of document.querySelectorAll(CLICKABLE)) {
+        scoreText(el, lower(el.innerText || el.textContent || el.getAttribute('value')));
+    }
+    for (const el of document.querySelectorAll('[aria-label]')) {
+        if (lower(el.getAttribute('aria-label')).includes(query)) consider(el, 'aria_label', 70);
+    }
+    for (const el of document.querySelectorAll('[title]')) {
+        if (lower(el.getAttribute('title')).includes(query)) consider(el, 'title', 55);
+    }
+
+    if (document.body) {
+        const needle = mainWord || query;
+        const walker = document.createTreeWalker(document.body, NodeFilter.SHOW_TEXT);
+        while (walker.nextNode()) {
+            const node = walker.currentNode;
+            if (!node.nodeValue.toLowerCase().includes(needle)) continue;
+            const parent = node.parentElement;
+            if (!parent || ['SCRIPT', 'STYLE', 'NOSCRIPT'].includes(parent.tagName)) continue;
+            const target = parent.closest(CLICKABLE) || parent;
+            if (target === parent) scoreText(target, lower(target.textContent));
+        }
+    }
+
+    const ranked = [];
+    for (const [el, info] of candidates) {
+        const visible = isVisible(el);
+        const role = roleOf(el);
+        let score = info.score;
+        if (visible) score += 20;
+        if (['button', 'link', 'menuitem', 'tab', 'option'].includes(role)) score += 10;
+        if (visible && inViewport(el)) score += 5;
+        ranked.push({el: el, method: info.method, score: score, visible: visible, role: role});
+    }
+    ranked.sort((a, b) => b.score - a.score);
+
+    return ranked.slice(0, limit).map((item) => ({
+        selector: stableSelector(item.el),
+        method: item.method,
+        score: item.score,
+        visible: item.visible,
+        role: item.role,
+        tag: item.el.tagName.toLowerCase(),
+        text: clean(item.el.innerText || item.el.textContent || item.el.getAttribute('value')).slice(0, 100),
+        fingerprint: fingerprintOf(item.el)
+    }));
+}
+"""
+
+# Собирает и оценивает поля ввода за один page.evaluate
+INPUT_CANDIDATES_SCRIPT = """
+({keywords, inputTypes, words, limit}) => {
+""" + _FINDER_HELPERS + """
+    const FIELDS = 'input:not([type="hidden"]):not([type="button"]):not([type="submit"]):not([type="reset"])' +
+        ':not([type="image"]):not([type="checkbox"]):not([type="radio"]), textarea, select, [contenteditable="true"]';
+    const ranked = [];
+    for (const el of document.querySelectorAll(FIELDS)) {
+        const type = lower(el.getAttribute('type'));
+        const label = el.labels && el.labels.length ? lower(el.labels[0].textContent) : '';
+        const attrs = [
+            lower(el.getAttribute('placeholder')),
+            lower(el.getAttribute('name')),
+            lower(el.id),
+            lower(el.getAttribute('aria-label')),
+            label
+        ];
+        let method = 'first_empty';
+        let score = 0;
+        if (keywords.some((keyword) => type === keyword || attrs.some((value) => value.includes(keyword)))) {
+            method = 'keyword_match';
+            score = 70;
+        } else if (inputTypes.includes(type)) {
+            method = 'type_match';
+            score = 60;
+        } else if (words.some((word) => attrs.some((value) => value.includes(word)))) {
+            method = 'keyword_match';
+            score = 40;
+        }
+        const value = el.isContentEditable ? el.textContent : el.value;
+        const empty = !value;
+        if (!score && !empty) continue;
+        const visible = isVisible(el) && !el.disabled && !el.readOnly;
+        if (empty) score += 10;
+        if (visible) score += 20;
+        ranked.push({el: el, method: method, score: score, visible: visible, empty: empty});
+    }
+    ranked.sort((a, b) => b.score - a.score);
+
+    return ranked.slice(0, limit).map((item) => ({
+        selector: stableSelector(item.el),
+        method: item.method,
+        score: item.score,
+        visible: item.visible,
+        role: roleOf(item.el),
+        tag: item.el.tagName.toLowerCase(),
+        empty: item.empty,
+        fingerprint: fingerprintOf(item.el)
+    }));
+}
+"""
+
+# Проверяет элемент по запомненному селектору: виден ли он и тот ли это элемент
+REMEMBERED_ELEMENT_SCRIPT = """
+(el) => {
+""" + _FINDER_HELPERS + """
+    return {visible: isVisible(el) && !el.disabled, fingerprint: fingerprintOf(el)};
+}
+"""
+
+_FIELD_STOP_WORDS = {'поле', 'поля', 'ввода', 'для', 'field', 'input', 'the', 'box'}
+
+
 class ElementFinder:
-    def __init__(self, page: Page):
+    def __init__(self, page: Page, memory: SelectorMemory = None):
         self.page = page
-    
+        self.memory = memory
+
+    def _domain(self) -> str:
+        return urlparse(self.page.url).hostname or ''
+
+    async def _find_remembered(self, kind: str, description: str) -> dict:
+        # Сначала пробуем селектор, который уже сработал на этом сайте: при совпадении
+        # весь поиск пропускается
+        if not self.memory:
+            return None
+        domain = self._domain()
+        entry = self.memory.lookup(domain, kind, description)
+        if not entry:
+            return None
+        try:
+            element = await self.page.query_selector(entry['selector'])
+            state = await element.evaluate(REMEMBERED_ELEMENT_SCRIPT) if element else None
+        except Exception:
+            state = None
+        if not state or not state['visible'] or (entry.get('fingerprint') and state['fingerprint'] != entry['fingerprint']):
+            self.memory.miss(domain, kind, description)
+            return None
+        self.memory.hit(domain, kind, description)
+        return {
+            'element': element,
+            'selector': entry['selector'],
+            'method': 'memory',
+            'domain': domain,
+            'fingerprint': state['fingerprint']
+        }
+
+    def remember(self, kind: str, description: str, found: dict):
+        # Вызывается после успешного клика или ввода; домен и признаки элемента
+        # сохранены при поиске, потому что после клика страница может смениться
+        if not self.memory or not found or found.get('method') == 'memory' or not found.get('selector'):
+            return
+        self.memory.remember(found.get('domain', ''), kind, description, found['selector'], found.get('fingerprint', ''))
+
+    async def rank_clickable_candidates(self, text: str) -> list:
+        text_lower = re.sub(r'\s+', ' ', text.lower().strip())
+        words = text_lower.split()
+        main_word = ''
+        if words:
+            main_word = words[0] if len(words[0]) > 3 else (words[1] if len(words) > 1 else words[0])
+        return await self.page.evaluate(CLICKABLE_CANDIDATES_SCRIPT, {
+            'query': text_lower,
+            'mainWord': main_word,
+            'limit': CANDIDATES_LIMIT
+        })
+
+    async def rank_input_candidates(self, description: str) -> list:
+        desc_lower = description.lower()
+        keywords = [keyword for keyword in INPUT_KEYWORDS if keyword in desc_lower]
+        input_types = sorted({input_type for keyword, input_type in INPUT_TYPE_MAPPING.items() if keyword in desc_lower})
+        words = [word for word in re.findall(r'\w+', desc_lower) if len(word) > 2 and word not in _FIELD_STOP_WORDS]
+        return await self.page.evaluate(INPUT_CANDIDATES_SCRIPT, {
+            'keywords': keywords,
+            'inputTypes': input_types,
+            'words': words,
+            'limit': CANDIDATES_LIMIT
+        })
+
+    async def _resolve_candidates(self, candidates: list) -> dict:
+        for candidate in candidates:
+            if not candidate['visible']:
+                continue
+            element = await self.page.query_selector(candidate['selector'])
+            if element:
+                return {
+                    'element': element,
+                    'selector': candidate['selector'],
+                    'method': candidate['method'],
+                    'score': candidate['score'],
+                    'role': candidate['role'],
+                    'fingerprint': candidate.get('fingerprint', ''),
+                    'candidates': candidates
+                }
+        return None
+
+    @traced('finder.find_clickable_element')
     async def find_clickable_element(self, text: str) -> dict:
-        text_lower = text.lower().strip()
+        remembered = await self._find_remembered('click', text)
+        if remembered:
+            return remembered
+        domain = self._domain()
+        try:
+            found = await self._resolve_candidates(await self.rank_clickable_candidates(text))
+        except Exception as e:
+            print(f"⚠️  Пакетный поиск элемента не удался, использую пошаговый поиск: {e}")
+            found = await self._find_clickable_element_legacy(text)
+        if found:
+            found['domain'] = domain
+        return found
+
+    @traced('finder.find_input_field')
+    async def find_input_field(self, description: str) -> dict:
+        remembered = await self._find_remembered('input', description)
+        if remembered:
+            return remembered
+        domain = self._domain()
+        try:
+            found = await self._resolve_candidates(await self.rank_input_candidates(description))
+        except Exception as e:
+            print(f"⚠️  Пакетный поиск поля не удался, использую пошаговый поиск: {e}")
+            found = await self._find_input_field_legacy(description)
+        if found:
+            found['domain'] = domain
+        return found
+
+    async def _find_clickable_element_legacy(self, text: str) -> dict:
+        for strategy in (self._find_by_text_selectors, self._find_by_partial_text, self._find_by_aria_label,
+                         self._find_by_title, self._find_by_xpath):
+            found = await strategy(text)
+            if found:
+                return found
+        return None
+
+    async def _find_by_text_selectors(self, text: str) -> dict:
         try:
             selectors = [
                 f'text="{text}"',
@@ -17,7 +354,7 @@ class ElementFinder:
                 f'[role="button"]:has-text("{text}")',
                 f'[role="link"]:has-text("{text}")'
             ]
-            
+
             for selector in selectors:
                 try:
                     element = await self.page.query_selector(selector)
@@ -31,18 +368,22 @@ class ElementFinder:
                     continue
         except Exception as e:
             pass
+        return None
+
+    async def _find_by_partial_text(self, text: str) -> dict:
+        text_lower = text.lower().strip()
         try:
             words = text_lower.split()
             if len(words) > 0:
                 main_word = words[0] if len(words[0]) > 3 else (words[1] if len(words) > 1 else words[0])
-                
+
                 selectors = [
                     f'button:has-text("{main_word}")',
                     f'a:has-text("{main_word}")',
                     f'[role="button"]:has-text("{main_word}")',
                     f'*:has-text("{main_word}")'
                 ]
-                
+
                 for selector in selectors:
                     try:
                         elements = await self.page.query_selector_all(selector)
@@ -59,6 +400,10 @@ class ElementFinder:
                         continue
         except Exception as e:
             pass
+        return None
+
+    async def _find_by_aria_label(self, text: str) -> dict:
+        text_lower = text.lower().strip()
         try:
             elements = await self.page.query_selector_all('[aria-label]')
             for elem in elements:
@@ -72,6 +417,10 @@ class ElementFinder:
                         }
         except:
             pass
+        return None
+
+    async def _find_by_title(self, text: str) -> dict:
+        text_lower = text.lower().strip()
         try:
             elements = await self.page.query_selector_all('[title]')
             for elem in elements:
@@ -85,16 +434,19 @@ class ElementFinder:
                         }
         except:
             pass
+        return None
+
+    async def _find_by_xpath(self, text: str) -> dict:
         try:
             text_escaped = text.replace("'", "\\'")
             xpath = f"//*[contains(text(), '{text_escaped}')]"
             elements = await self.page.query_selector_all(f"xpath={xpath}")
-            
+
             for elem in elements:
                 if await elem.is_visible():
                     tag_name = await elem.evaluate('el => el.tagName.toLowerCase()')
                     role = await elem.get_attribute('role')
-                    
+
                     if tag_name in ['button', 'a', 'input'] or role in ['button', 'link']:
                         return {
                             'element': elem,
@@ -103,14 +455,12 @@ class ElementFinder:
                         }
         except:
             pass
-        
         return None
-    
-    async def find_input_field(self, description: str) -> dict:
+
+    async def _find_input_field_legacy(self, description: str) -> dict:
         desc_lower = description.lower()
         try:
-            keywords = ['email', 'password', 'пароль', 'имя', 'name', 'телефон', 'phone']
-            for keyword in keywords:
+            for keyword in INPUT_KEYWORDS:
                 if keyword in desc_lower:
                     selectors = [
                         f'input[placeholder*="{keyword}"]',
@@ -118,7 +468,7 @@ class ElementFinder:
                         f'input[type="{keyword}"]',
                         f'input[id*="{keyword}"]'
                     ]
-                    
+
                     for selector in selectors:
                         try:
                             elements = await self.page.query_selector_all(selector)
@@ -133,15 +483,8 @@ class ElementFinder:
                             continue
         except:
             pass
-        type_mapping = {
-            'email': 'email',
-            'пароль': 'password',
-            'password': 'password',
-            'телефон': 'tel',
-            'phone': 'tel'
-        }
-        
-        for keyword, input_type in type_mapping.items():
+
+        for keyword, input_type in INPUT_TYPE_MAPPING.items():
             if keyword in desc_lower:
                 try:
                     elements = await self.page.query_selector_all(f'input[type="{input_type}"]')
@@ -166,6 +509,5 @@ class ElementFinder:
                     }
         except:
             pass
-        
-        return None
 
+        return None
@@ -1,6 +1,6 @@
-import re
 from typing import Dict, List, Optional, Tuple
 from enum import Enum
+from pattern_matcher import shared_matcher
 
 
 class RiskLevel(Enum):
@@ -29,19 +29,21 @@ class RelevanceClassifier:
             'сколько весит', 'какая температура', 'исторические факты',
             'математические задачи', 'физические законы', 'химические формулы'
         ]
+        self.matcher = shared_matcher({'off_topic': self.off_topic_keywords}, literal=True)
     
     def check(self, input_text: str, task: str) -> GuardrailResult:
-        input_lower = input_text.lower()
         task_lower = task.lower()
+        if 'браузер' in task_lower or 'страница' in task_lower:
+            return GuardrailResult(passed=True)
         
-        for keyword in self.off_topic_keywords:
-            if keyword in input_lower and 'браузер' not in task_lower and 'страница' not in task_lower:
-                return GuardrailResult(
-                    passed=False,
-                    risk_level=RiskLevel.LOW,
-                    reason=f"Запрос не относится к задачам браузерного агента: {keyword}",
-                    blocked=True
-                )
+        match = self.matcher.first_match(input_text)
+        if match:
+            return GuardrailResult(
+                passed=False,
+                risk_level=RiskLevel.LOW,
+                reason=f"Запрос не относится к задачам браузерного агента: {match[1]}",
+                blocked=True
+            )
         
         return GuardrailResult(passed=True)
 
@@ -77,27 +79,29 @@ class SafetyClassifier:
             r'del\s+/f',
             r'format\s+c:'
         ]
+        self.matcher = shared_matcher({
+            'jailbreak': self.jailbreak_patterns,
+            'prompt_injection': self.prompt_injection_patterns
+        })
     
     def check(self, input_text: str) -> GuardrailResult:
-        input_lower = input_text.lower()
+        found = self.matcher.first_by_category(input_text)
         
-        for pattern in self.jailbreak_patterns:
-            if re.search(pattern, input_lower, re.IGNORECASE):
-                return GuardrailResult(
-                    passed=False,
-                    risk_level=RiskLevel.HIGH,
-                    reason="Обнаружена попытка jailbreak или обхода инструкций",
-                    blocked=True
-                )
+        if 'jailbreak' in found:
+            return GuardrailResult(
+                passed=False,
+                risk_level=RiskLevel.HIGH,
+                reason="Обнаружена попытка jailbreak или обхода инструкций",
+                blocked=True
+            )
         
-        for pattern in self.prompt_injection_patterns:
-            if re.search(pattern, input_lower, re.IGNORECASE):
-                return GuardrailResult(
-                    passed=False,
-                    risk_level=RiskLevel.CRITICAL,
-                    reason="Обнаружена попытка prompt injection или выполнения кода",
-                    blocked=True
-                )
+        if 'prompt_injection' in found:
+            return GuardrailResult(
+                passed=False,
+                risk_level=RiskLevel.CRITICAL,
+                reason="Обнаружена попытка prompt injection или выполнения кода",
+                blocked=True
+            )
         
         return GuardrailResult(passed=True)
 
@@ -112,14 +116,14 @@ class PIIFilter:
             (r'\b\d{10,11}\b', 'Телефон'),
             (r'\b\d{4}[\s-]?\d{4}[\s-]?\d{4}[\s-]?\d{4}[\s-]?\d{3}\b', 'CVV'),
         ]
+        rules = {}
+        for pattern, pii_type in self.pii_patterns:
+            rules.setdefault(pii_type, []).append(pattern)
+        self.matcher = shared_matcher(rules)
     
     def check_output(self, output_text: str) -> GuardrailResult:
-        found_pii = []
-        
-        for pattern, pii_type in self.pii_patterns:
-            matches = re.findall(pattern, output_text, re.IGNORECASE)
-            if matches:
-                found_pii.append(f"{pii_type}: {len(matches)} совпадений")
+        counts = self.matcher.count_by_category(output_text)
+        found_pii = [f"{pii_type}: {counts[pii_type]} совпадений" for pii_type in self.matcher.categories if pii_type in counts]
         
         if found_pii:
             return GuardrailResult(
@@ -146,34 +150,26 @@ class ModerationFilter:
         self.violence_keywords = [
             'насилие', 'избить', 'пытка', 'взрыв', 'оружие'
         ]
+        self.matcher = shared_matcher({
+            'hate_speech': self.hate_speech_keywords,
+            'harassment': self.harassment_keywords,
+            'violence': self.violence_keywords
+        }, literal=True)
+        self.reasons = {
+            'hate_speech': "Обнаружен контент, разжигающий ненависть",
+            'harassment': "Обнаружен контент, содержащий домогательства",
+            'violence': "Обнаружен контент, содержащий насилие"
+        }
     
     def check(self, input_text: str) -> GuardrailResult:
-        input_lower = input_text.lower()
-        
-        for keyword in self.hate_speech_keywords:
-            if keyword in input_lower:
-                return GuardrailResult(
-                    passed=False,
-                    risk_level=RiskLevel.HIGH,
-                    reason="Обнаружен контент, разжигающий ненависть",
-                    blocked=True
-                )
+        found = self.matcher.first_by_category(input_text)
         
-        for keyword in self.harassment_keywords:
-            if keyword in input_lower:
+        for category in self.matcher.categories:
+            if category in found:
                 return GuardrailResult(
                     passed=False,
                     risk_level=RiskLevel.HIGH,
-                    reason="Обнаружен контент, содержащий домогательства",
-                    blocked=True
-                )
-        
-        for keyword in self.violence_keywords:
-            if keyword in input_lower:
-                return GuardrailResult(
-                    passed=False,
-                    risk_level=RiskLevel.HIGH,
-                    reason="Обнаружен контент, содержащий насилие",
+                    reason=self.reasons[category],
                     blocked=True
                 )
         
@@ -188,16 +184,25 @@ class ToolSafeguards:
             'click_element': RiskLevel.MEDIUM,
             'type_text': RiskLevel.MEDIUM,
             'scroll': RiskLevel.LOW,
+            'go_back': RiskLevel.LOW,
             'wait': RiskLevel.LOW,
             'task_complete': RiskLevel.LOW,
             'ask_user': RiskLevel.LOW,
         }
         
+        # Инструменты, которые не меняют страницу и могут выполняться одновременно.
+        # wait сюда не входит: модель вызывает его, чтобы следующие действия начались позже
+        self.read_only_tools = {
+            'get_page_info',
+            'ask_user',
+        }
+        
         self.destructive_tools = [
             'delete', 'remove', 'cancel', 'unsubscribe',
             'pay', 'purchase', 'buy', 'checkout', 'order',
             'confirm', 'submit payment', 'place order'
         ]
+        self.matcher = shared_matcher({'destructive': self.destructive_tools}, literal=True)
     
     def assess_tool_risk(self, tool_name: str, arguments: Dict) -> GuardrailResult:
         base_risk = self.tool_risk_levels.get(tool_name, RiskLevel.MEDIUM)
@@ -218,15 +223,14 @@ class ToolSafeguards:
                 blocked=False
             )
         
-        args_str = str(arguments).lower()
-        for destructive in self.destructive_tools:
-            if destructive in args_str:
-                return GuardrailResult(
-                    passed=False,
-                    risk_level=RiskLevel.HIGH,
-                    reason=f"Обнаружено деструктивное действие: {destructive}",
-                    blocked=False
-                )
+        match = self.matcher.first_match(str(arguments))
+        if match:
+            return GuardrailResult(
+                passed=False,
+                risk_level=RiskLevel.HIGH,
+                reason=f"Обнаружено деструктивное действие: {match[1]}",
+                blocked=False
+            )
         
         return GuardrailResult(passed=True, risk_level=base_risk)
 
@@ -239,6 +243,7 @@ class RulesBasedProtections:
             'xss', '<script>', 'onerror=',
             'cmd.exe', '/bin/bash', 'powershell'
         ]
+        self.matcher = shared_matcher({'blocklist': self.blocklist}, literal=True)
         
         self.max_input_length = 10000
         self.max_output_length = 50000
@@ -260,15 +265,14 @@ class RulesBasedProtections:
                 blocked=False
             )
         
-        input_lower = input_text.lower()
-        for blocked_term in self.blocklist:
-            if blocked_term in input_lower:
-                return GuardrailResult(
-                    passed=False,
-                    risk_level=RiskLevel.HIGH,
-                    reason=f"Обнаружен запрещенный термин: {blocked_term}",
-                    blocked=True
-                )
+        match = self.matcher.first_match(input_text)
+        if match:
+            return GuardrailResult(
+                passed=False,
+                risk_level=RiskLevel.HIGH,
+                reason=f"Обнаружен запрещенный термин: {match[1]}",
+                blocked=True
+            )
         
         return GuardrailResult(passed=True)
 
@@ -279,18 +283,17 @@ class OutputValidator:
             'конкурент', 'конкурирующий продукт',
             'негативный отзыв', 'критика бренда'
         ]
+        self.matcher = shared_matcher({'brand': self.brand_violations}, literal=True)
     
     def validate(self, output_text: str) -> GuardrailResult:
-        output_lower = output_text.lower()
-        
-        for violation in self.brand_violations:
-            if violation in output_lower:
-                return GuardrailResult(
-                    passed=False,
-                    risk_level=RiskLevel.MEDIUM,
-                    reason=f"Вывод может навредить целостности бренда: {violation}",
-                    blocked=False
-                )
+        match = self.matcher.first_match(output_text)
+        if match:
+            return GuardrailResult(
+                passed=False,
+                risk_level=RiskLevel.MEDIUM,
+                reason=f"Вывод может навредить целостности бренда: {match[1]}",
+                blocked=False
+            )
         
         return GuardrailResult(passed=True)
 
@@ -338,6 +341,9 @@ class GuardrailsSystem:
         result = self.tool_safeguards.assess_tool_risk(tool_name, arguments)
         return result.passed, result.reason, result.risk_level
     
+    def is_read_only_tool(self, tool_name: str) -> bool:
+        return tool_name in self.tool_safeguards.read_only_tools
+    
     def check_output(self, output_text: str) -> Tuple[bool, List[str]]:
         errors = []
         
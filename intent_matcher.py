@@ -0,0 +1,102 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+
+# Простые команды, которые выполняются без модели. Совпадение должно покрывать всю задачу:
+# все, что не распознано уверенно, уходит модели
+ToolCall = Tuple[str, Dict]
+
+# Признаки составной задачи: ее шаги должна спланировать модель
+MULTI_STEP = re.compile(r'(\s(и|а|затем|потом|после|and|then|after)\s|[,;]\s|\?$)', re.IGNORECASE)
+
+URL = r'(?P<url>(?:https?://)?(?:[\w-]+\.)+[a-zа-яё]{2,}(?::\d+)?(?:/\S*)?)'
+
+NAVIGATE = re.compile(
+    r'(?:открой|откройте|открыть|перейди|перейдите|перейти|зайди|зайдите|зайти|иди|go to|goto|open|navigate to|visit|load)'
+    r'(?:\s+(?:на|в|сайт|страницу|site|page|the|url|адрес))*\s+' + URL,
+    re.IGNORECASE
+)
+
+SCROLL = re.compile(
+    r'(?:прокрути|прокрутите|пролистай|пролистайте|листай|промотай|scroll)'
+    r'(?:\s+(?:страницу|page|the page))?\s+'
+    r'(?P<direction>вниз|вверх|down|up)'
+    r'(?:\s+(?:на|by)\s+(?P<amount>\d{1,5})\s*(?:px|пикселей|пикселя|пиксель|pixels)?)?',
+    re.IGNORECASE
+)
+
+WAIT = re.compile(
+    r'(?:подожди|подождите|жди|ждите|wait)(?:\s+(?:for))?\s+'
+    r'(?:(?P<seconds>\d{1,3}(?:[.,]\d+)?)\s*(?:секунд[уы]?|сек|с|seconds?|secs?|s)|(?P<one>секунду|a second|one second))',
+    re.IGNORECASE
+)
+
+GO_BACK = re.compile(
+    r'(?:назад|вернись|вернитесь|вернуться|go back|back|navigate back)'
+    r'(?:\s+(?:назад|на предыдущую страницу|к предыдущей странице|to the previous page))?',
+    re.IGNORECASE
+)
+
+CLICK = re.compile(
+    r'(?:нажми|нажмите|нажать|кликни|кликните|щелкни|щёлкни|click|tap)'
+    r'(?:\s+(?:на|по|on))?\s+(?P<target>.+)',
+    re.IGNORECASE
+)
+# Слова-описания роли убираются: поиск элемента идет по его тексту
+CLICK_ROLE_WORDS = re.compile(
+    r'^(?:(?:the|a|кнопк[аиуеой]|ссылк[аиуеой]|пункт|вкладк[аиуеой]|button|link|tab)\s+)+|\s+(?:button|link|tab)$',
+    re.IGNORECASE
+)
+# Порядковые и указательные цели ("первую ссылку", "click here") не описывают элемент по тексту:
+# поиск подставил бы случайное совпадение, поэтому такие задачи решает модель
+VAGUE_CLICK_TARGET = re.compile(
+    r'\b(?:first|second|third|last|next|previous|any|some|this|that|these|those|here|there|it|one|'
+    r'перв\w*|втор\w*|трет\w*|последн\w*|следующ\w*|предыдущ\w*|люб\w*|как\w*-(?:нибудь|то)|'
+    r'эт[аоуиы]т?|тут|здесь|сюда|туда|там|него|нее|неё|его|её|ее|\d+-?(?:[йяюе]|ой|ую|st|nd|rd|th))\b',
+    re.IGNORECASE
+)
+CLICK_TARGET_WORDS = 6
+# Клик без модели выполняется только по уверенно найденному элементу
+CONFIDENT_CLICK_METHODS = ('text_match', 'memory')
+CONFIDENT_CLICK_SCORE = 80
+DIRECTIONS = {'вниз': 'down', 'down': 'down', 'вверх': 'up', 'up': 'up'}
+
+
+def _normalize(task: str) -> str:
+    return ' '.join(task.split()).strip(' .!')
+
+
+def match_intent(task: str) -> Optional[List[ToolCall]]:
+    text = _normalize(task)
+    if not text or MULTI_STEP.search(text):
+        return None
+
+    match = NAVIGATE.fullmatch(text)
+    if match:
+        url = match.group('url').rstrip('/.')
+        if not url.lower().startswith(('http://', 'https://')):
+            url = 'https://' + url
+        return [('navigate_to_url', {'url': url})]
+
+    match = SCROLL.fullmatch(text)
+    if match:
+        arguments = {'direction': DIRECTIONS[match.group('direction').lower()]}
+        if match.group('amount'):
+            arguments['amount'] = int(match.group('amount'))
+        return [('scroll', arguments)]
+
+    match = WAIT.fullmatch(text)
+    if match:
+        seconds = float(match.group('seconds').replace(',', '.')) if match.group('seconds') else 1.0
+        return [('wait', {'seconds': int(seconds) if seconds.is_integer() else seconds})]
+
+    if GO_BACK.fullmatch(text):
+        return [('go_back', {})]
+
+    match = CLICK.fullmatch(text)
+    if match:
+        target = CLICK_ROLE_WORDS.sub('', match.group('target')).strip(' "\'«»“”')
+        if target and len(target.split()) <= CLICK_TARGET_WORDS and not VAGUE_CLICK_TARGET.search(target):
+            return [('click_element', {'element_text': target})]
+
+    return None
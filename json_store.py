@@ -0,0 +1,27 @@
+import json
+from pathlib import Path
+
+
+class JsonStore:
+    # Словарь в JSON-файле: испорченный или отсутствующий файл читается как пустой,
+    # запись идет во временный файл и заменяет старый целиком
+    def __init__(self, path: str, label: str):
+        self.path = Path(path)
+        self.label = label
+
+    def load(self) -> dict:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, data: dict):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            tmp_path.replace(self.path)
+        except OSError as e:
+            print(f"⚠️  Не удалось сохранить {self.label}: {e}")
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+class LLMResponseCache:
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600, max_entries: int = 5000):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.db.commit()
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict], tools: List[Dict], tool_choice: str) -> str:
+        # Канонический JSON: одинаковый запрос дает одинаковый ключ независимо от порядка ключей в словарях
+        payload = json.dumps(
+            {'model': model, 'messages': messages, 'tools': tools or [], 'tool_choice': tool_choice},
+            sort_keys=True,
+            ensure_ascii=False,
+            separators=(',', ':')
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        row = self.db.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row and (not self.ttl or now - row[1] <= self.ttl):
+            self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.db.commit()
+            self.hits += 1
+            return json.loads(row[0])
+        if row:
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.db.commit()
+        self.misses += 1
+        return None
+
+    def put(self, key: str, response: Dict):
+        now = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses (key, response, created, accessed) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(response, ensure_ascii=False), now, now)
+        )
+        self._evict(now)
+        self.db.commit()
+
+    def _evict(self, now: float):
+        if self.ttl:
+            self.db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        if self.max_entries:
+            # Вытесняем давно не использованные записи сверх лимита
+            self.db.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def get_stats(self) -> dict:
+        entries = self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': entries
+        }
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,34 @@
+import time
+from typing import Dict
+from json_store import JsonStore
+
+
+class DomainLoadProfiles:
+    def __init__(self, path: str, max_settle: float = 10.0, margin: float = 1.5, smoothing: float = 0.3):
+        self.max_settle = max_settle
+        self.margin = margin
+        self.smoothing = smoothing
+        self.store = JsonStore(path, 'профили загрузки сайтов')
+        self.profiles: Dict[str, dict] = self.store.load()
+
+    def save(self):
+        self.store.save(self.profiles)
+
+    def settle_budget(self, domain: str) -> float:
+        # Для незнакомого сайта ждем максимум, для знакомого - сколько ему обычно нужно с запасом
+        profile = self.profiles.get(domain)
+        if not profile:
+            return self.max_settle
+        return min(self.max_settle, profile['settle'] * self.margin + 0.25)
+
+    def record(self, domain: str, settle_seconds: float, settled: bool):
+        profile = self.profiles.get(domain)
+        if profile:
+            profile['settle'] += self.smoothing * (settle_seconds - profile['settle'])
+            profile['visits'] += 1
+        else:
+            profile = {'settle': settle_seconds, 'visits': 1}
+            self.profiles[domain] = profile
+        profile['settled'] = settled
+        profile['updated'] = int(time.time())
+        self.save()
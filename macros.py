@@ -0,0 +1,184 @@
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse, quote, quote_plus
+from json_store import JsonStore
+
+
+# Действия, которые сохраняются в сценарий и повторяются без модели
+MACRO_TOOLS = ('navigate_to_url', 'click_element', 'type_text', 'scroll', 'go_back')
+# Так начинаются ответы инструментов, когда действие не удалось
+FAILURE_PREFIXES = ('Не удалось', 'Ошибка', '❌', 'Действие отменено', 'Element finder', 'Page analyzer')
+SECRET_FIELD_WORDS = ('password', 'пароль', 'passwd', 'card', 'карт', 'cvv', 'cvc')
+SLOT = re.compile(r'\{(\d+)\}')
+
+
+def action_failed(result: str) -> bool:
+    return str(result).startswith(FAILURE_PREFIXES)
+
+
+def normalize_task(task: str) -> str:
+    return ' '.join(task.split())
+
+
+def page_key(url: str) -> str:
+    # Страница без параметров запроса: адрес результатов поиска зависит от введенного текста
+    parsed = urlparse(url or '')
+    return f"{parsed.hostname or ''}{parsed.path.rstrip('/')}"
+
+
+def start_domain(url: str) -> str:
+    return urlparse(url or '').hostname or ''
+
+
+def fill_slots(value, params: List[str]):
+    if isinstance(value, str):
+        return SLOT.sub(lambda m: params[int(m.group(1))] if int(m.group(1)) < len(params) else m.group(0), value)
+    if isinstance(value, dict):
+        return {key: fill_slots(item, params) for key, item in value.items()}
+    return value
+
+
+def _replace_ignore_case(text: str, value: str, slot: str) -> str:
+    return re.sub(re.escape(value), lambda m: slot, text, flags=re.IGNORECASE)
+
+
+def _parameterize(value, params: List[str]):
+    # Введенные значения, встречающиеся в задаче, заменяются слотами {0}, {1}...; в адресах
+    # значение может стоять в закодированном виде
+    if isinstance(value, dict):
+        return {key: _parameterize(item, params) for key, item in value.items()}
+    if not isinstance(value, str):
+        return value
+    for index, param in enumerate(params):
+        slot = '{' + str(index) + '}'
+        for form in (param, quote_plus(param), quote(param)):
+            value = _replace_ignore_case(value, form, slot)
+    return value
+
+
+def match_template(template: str, task: str) -> Optional[List[str]]:
+    parts = SLOT.split(template)
+    pattern = ''
+    seen = set()
+    for position, part in enumerate(parts):
+        if position % 2 == 0:
+            pattern += re.escape(part)
+        elif part in seen:
+            pattern += f'(?P=p{part})'
+        else:
+            seen.add(part)
+            pattern += f'(?P<p{part}>.+?)'
+    match = re.fullmatch(pattern, normalize_task(task), flags=re.IGNORECASE)
+    if not match:
+        return None
+    return [match.group(f'p{index}') for index in range(len(seen))]
+
+
+class MacroRecorder:
+    # Собирает разрешенные действия задачи: адреса, сработавшие селекторы и введенные значения
+    def __init__(self):
+        self.steps: List[dict] = []
+        self.recordable = True
+        self.needs_answer = False
+
+    def record(self, function_name: str, arguments: dict, resolved: Optional[dict], page_url: str, result: str):
+        if function_name == 'ask_user':
+            # Ответ пользователя нельзя воспроизвести
+            self.recordable = False
+            return
+        if action_failed(result):
+            return
+        if function_name == 'get_page_info':
+            # Модель читала страницу, и итог может зависеть от ее содержимого: при повторе
+            # итог заново получает модель, а не берется из прошлого запуска
+            self.needs_answer = True
+            return
+        if function_name not in MACRO_TOOLS:
+            return
+        resolved = dict(resolved or {})
+        input_type = resolved.pop('input_type', '')
+        if function_name == 'type_text':
+            # Значение не сохраняется, если поле - пароль, если его тип неизвестен (например, ввод
+            # по селектору, который не удалось проверить) или если описание похоже на секретное поле
+            field = f"{arguments.get('field_description', '')} {resolved.get('selector', '')}".lower()
+            if input_type in ('', 'password') or any(word in field for word in SECRET_FIELD_WORDS):
+                self.recordable = False
+                return
+        self.steps.append({
+            'tool': function_name,
+            'arguments': dict(arguments, **resolved),
+            'page': page_key(page_url)
+        })
+
+
+class MacroStore:
+    def __init__(self, path: str, max_macros: int = 200):
+        self.max_macros = max_macros
+        self.store = JsonStore(path, 'сценарии')
+        self.macros: Dict[str, dict] = self.store.load()
+
+    def save(self):
+        self.store.save(self.macros)
+
+    def match(self, task: str, domain: str) -> Optional[Tuple[dict, List[str]]]:
+        # При нескольких подходящих сценариях берется самый конкретный - с наименьшим числом слотов
+        candidates = []
+        for macro in self.macros.values():
+            if macro['domain'] != domain:
+                continue
+            params = match_template(macro['template'], task)
+            if params is not None:
+                candidates.append((len(params), -macro.get('updated', 0), macro, params))
+        if not candidates:
+            return None
+        candidates.sort(key=lambda item: item[:2])
+        return candidates[0][2], candidates[0][3]
+
+    def record(self, task: str, domain: str, recorder: MacroRecorder, result: str) -> Optional[dict]:
+        if not recorder.recordable or not recorder.steps:
+            return None
+        task = normalize_task(task)
+        typed = {step['arguments'].get('text', '') for step in recorder.steps if step['tool'] == 'type_text'}
+        params = sorted((value for value in typed if len(value) > 2 and value.lower() in task.lower()),
+                        key=len, reverse=True)
+        template = task
+        for index, param in enumerate(params):
+            template = _replace_ignore_case(template, param, '{' + str(index) + '}')
+
+        key = f"{domain}|{template.lower()}"
+        previous = self.macros.get(key, {})
+        macro = {
+            'key': key,
+            'domain': domain,
+            'template': template,
+            'steps': [self._template_step(step, params) for step in recorder.steps],
+            'result': _parameterize(result, params),
+            'needs_answer': recorder.needs_answer,
+            'replays': previous.get('replays', 0),
+            'updated': int(time.time())
+        }
+        self.macros[key] = macro
+        if len(self.macros) > self.max_macros:
+            oldest = min(self.macros.values(), key=lambda item: item.get('updated', 0))
+            del self.macros[oldest['key']]
+        self.save()
+        return macro
+
+    def _template_step(self, step: dict, params: List[str]) -> dict:
+        arguments = _parameterize(step['arguments'], params)
+        if step['tool'] == 'click_element' and arguments.get('element_text') != step['arguments'].get('element_text'):
+            # Цель клика зависит от параметра: селектор прошлого запуска указывает на другой элемент,
+            # поэтому при повторе элемент ищется по тексту
+            arguments.pop('selector', None)
+        return dict(step, arguments=arguments, page=_parameterize(step['page'], params))
+
+    def mark_replayed(self, macro: dict):
+        macro['replays'] = macro.get('replays', 0) + 1
+        macro['updated'] = int(time.time())
+        self.save()
+
+    def forget(self, macro: dict):
+        # Сайт изменился: сценарий будет записан заново после успешного выполнения
+        if self.macros.pop(macro['key'], None) is not None:
+            self.save()
@@ -1,34 +1,163 @@
+import argparse
 import asyncio
+import contextlib
 import os
+import sys
+import time
 from dotenv import load_dotenv
 from browser_controller import BrowserController
 from ai_agent import AIAgent
+from ai_providers import RouterProvider
+from agent_runtime import AgentRuntime
+from batch_runner import run_batch
+from provider_transport import close_shared_clients
+from tracing import configure_tracing
 from config import (
     AI_PROVIDER,
-    OPENROUTER_API_KEY, OPENROUTER_MODEL,
-    BROWSER_HEADLESS, BROWSER_START_URL, MAX_ITERATIONS
+    OPENROUTER_API_KEY, OPENROUTER_MODEL, LLM_ROUTER_BACKENDS, LLM_ROUTER_HEDGE,
+    MOCK_SCRIPT, MOCK_LATENCY,
+    LLM_CACHE_MODE, LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES,
+    LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT, LLM_MAX_RETRIES, LLM_MAX_CONNECTIONS,
+    BROWSER_HEADLESS, BROWSER_START_URL, MAX_ITERATIONS,
+    BROWSER_PERSISTENT_PROFILE, BROWSER_PROFILE_TEMPLATE,
+    BROWSER_ROUTE_PROFILE, BROWSER_ROUTE_ALLOW_DOMAINS,
+    NAVIGATION_SETTLE_MODE, NAVIGATION_MAX_SETTLE, NAVIGATION_QUIET_MS,
+    TRACE_PATH, TRACE_FORMAT,
+    MAX_CONCURRENT_SESSIONS, BATCH_WAIT_TIMEOUT, BATCH_ASK_USER_POLICY, BATCH_ASK_USER_POLICIES
 )
 
 
-async def main():
+def parse_args():
+    parser = argparse.ArgumentParser(description='Browser AI Agent')
+    parser.add_argument('--batch', metavar='FILE', help='выполнить задачи из JSONL-файла без диалога (- для stdin)')
+    parser.add_argument('--output', metavar='FILE', help='файл для результатов пакетного режима (по умолчанию stdout)')
+    parser.add_argument('--concurrency', type=int, default=MAX_CONCURRENT_SESSIONS,
+                        help='сколько задач пакета выполнять одновременно')
+    return parser.parse_args()
+
+
+async def run_batch_mode(args, provider_kwargs: dict, results):
+    runtime = AgentRuntime(
+        provider=AI_PROVIDER,
+        provider_kwargs=provider_kwargs,
+        headless=BROWSER_HEADLESS,
+        max_concurrency=max(1, args.concurrency),
+        browser_kwargs={
+            'settle_mode': NAVIGATION_SETTLE_MODE,
+            'max_settle': NAVIGATION_MAX_SETTLE,
+            'quiet_ms': NAVIGATION_QUIET_MS,
+            'route_profile': BROWSER_ROUTE_PROFILE,
+            'route_allow_domains': BROWSER_ROUTE_ALLOW_DOMAINS,
+            'interactive': False,
+            'manual_wait_timeout': BATCH_WAIT_TIMEOUT
+        }
+    )
+    try:
+        source = sys.stdin if args.batch == '-' else open(args.batch, encoding='utf-8')
+    except OSError as e:
+        print(f"❌ Не удалось открыть файл задач: {e}")
+        return
+    try:
+        output = open(args.output, 'w', encoding='utf-8') if args.output and args.output != '-' else results
+    except OSError as e:
+        print(f"❌ Не удалось открыть файл результатов: {e}")
+        if source is not sys.stdin:
+            source.close()
+        return
+    
+    started = time.perf_counter()
+    try:
+        await runtime.start()
+        print(f"📦 Пакетный режим: до {runtime.max_concurrency} задач одновременно")
+        statuses = await run_batch(source, output, runtime,
+                                   start_url=BROWSER_START_URL if BROWSER_START_URL != 'about:blank' else None)
+        summary = ', '.join(f"{status}: {count}" for status, count in statuses.most_common())
+        print(f"✅ Пакет обработан за {time.perf_counter() - started:.1f} с ({summary or 'задач нет'})")
+    except Exception as e:
+        print(f"❌ Ошибка пакетного режима: {e}")
+    finally:
+        await runtime.close()
+        if source is not sys.stdin:
+            source.close()
+        if output is not results:
+            output.close()
+
+
+async def main(args=None, results=None):
     load_dotenv()
     
     print("🚀 Запуск Browser AI Agent...")
     print(f"📡 Используется провайдер: {AI_PROVIDER.upper()}")
     print("=" * 50)
     
-    if not OPENROUTER_API_KEY:
-        print("❌ Ошибка: OPENROUTER_API_KEY не найден в .env файле")
+    if AI_PROVIDER == 'router':
+        if not LLM_ROUTER_BACKENDS:
+            print("❌ Ошибка: для AI_PROVIDER=router нужно задать LLM_ROUTER_BACKENDS")
+            return
+        print("🔀 Используется маршрутизатор провайдеров:")
+        for backend in LLM_ROUTER_BACKENDS:
+            print(f"   - {backend.get('name') or backend.get('base_url') or 'OpenRouter'}: {backend.get('model', OPENROUTER_MODEL)}")
+    elif AI_PROVIDER == 'mock':
+        print("🧪 Используется сценарная модель без сети")
+        print(f"   Сценарий: {MOCK_SCRIPT or 'нет (сразу завершает задачу)'}")
+    else:
+        if not OPENROUTER_API_KEY:
+            print("❌ Ошибка: OPENROUTER_API_KEY не найден в .env файле")
+            return
+        
+        print("🚀 Используется OpenRouter провайдер")
+        print(f"   Модель: {OPENROUTER_MODEL}")
+        print("💡 OpenRouter предоставляет доступ к множеству AI моделей")
+    
+    if args and args.batch and BATCH_ASK_USER_POLICY not in BATCH_ASK_USER_POLICIES:
+        print(f"❌ Ошибка: BATCH_ASK_USER_POLICY должен быть одним из: {', '.join(BATCH_ASK_USER_POLICIES)} "
+              f"(задано {BATCH_ASK_USER_POLICY!r})")
         return
     
-    print("🚀 Используется OpenRouter провайдер")
-    print(f"   Модель: {OPENROUTER_MODEL}")
-    print("💡 OpenRouter предоставляет доступ к множеству AI моделей")
+    tracer = configure_tracing(TRACE_PATH, TRACE_FORMAT)
+    if tracer.enabled:
+        print(f"🧭 Трассировка ({TRACE_FORMAT}) пишется в {TRACE_PATH}")
     
-    provider_kwargs = {'api_key': OPENROUTER_API_KEY, 'model': OPENROUTER_MODEL}
+    provider_kwargs = {
+        'api_key': OPENROUTER_API_KEY,
+        'model': OPENROUTER_MODEL,
+        'cache_mode': LLM_CACHE_MODE,
+        'cache_path': LLM_CACHE_PATH,
+        'cache_ttl': LLM_CACHE_TTL,
+        'cache_max_entries': LLM_CACHE_MAX_ENTRIES,
+        'connect_timeout': LLM_CONNECT_TIMEOUT,
+        'read_timeout': LLM_READ_TIMEOUT,
+        'max_retries': LLM_MAX_RETRIES,
+        'max_connections': LLM_MAX_CONNECTIONS,
+        'backends': LLM_ROUTER_BACKENDS,
+        'hedge': LLM_ROUTER_HEDGE,
+        'script': MOCK_SCRIPT or None,
+        'latency': MOCK_LATENCY
+    }
     
-    browser = BrowserController(headless=BROWSER_HEADLESS)
-    await browser.start(start_url=BROWSER_START_URL if BROWSER_START_URL != 'about:blank' else None)
+    if args and args.batch:
+        try:
+            await run_batch_mode(args, provider_kwargs, results)
+        finally:
+            tracer.close()
+        return
+    
+    browser = BrowserController(
+        headless=BROWSER_HEADLESS,
+        settle_mode=NAVIGATION_SETTLE_MODE,
+        max_settle=NAVIGATION_MAX_SETTLE,
+        quiet_ms=NAVIGATION_QUIET_MS,
+        persistent=BROWSER_PERSISTENT_PROFILE or bool(BROWSER_PROFILE_TEMPLATE),
+        profile_template=BROWSER_PROFILE_TEMPLATE or None,
+        route_profile=BROWSER_ROUTE_PROFILE,
+        route_allow_domains=BROWSER_ROUTE_ALLOW_DOMAINS
+    )
+    try:
+        await browser.start(start_url=BROWSER_START_URL if BROWSER_START_URL != 'about:blank' else None)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        await browser.close()
+        return
     
     print("✅ Браузер запущен")
     print("💡 Подсказка: Вы можете войти в аккаунты вручную, агент продолжит работу")
@@ -68,9 +197,38 @@ async def main():
     except KeyboardInterrupt:
         print("\n\n👋 Завершение работы...")
     finally:
+        cache = getattr(agent.ai_provider, 'cache', None)
+        if cache:
+            stats = cache.get_stats()
+            print(f"💾 Кеш ответов модели: попаданий {stats['hits']}, промахов {stats['misses']}")
+        router = getattr(agent.ai_provider, 'provider', agent.ai_provider)
+        if isinstance(router, RouterProvider):
+            for stats in router.get_stats():
+                if stats['requests']:
+                    print(f"🔀 {stats['backend']}: p50 {stats['p50'] or 0:.2f} с, p95 {stats['p95'] or 0:.2f} с, "
+                          f"ошибок {stats['error_rate']:.0%}, запросов {stats['requests']}")
+        usage = agent.usage_totals
+        if usage['requests']:
+            print(f"📊 Токены за сессию: промпт {usage['prompt_tokens']} (из кеша провайдера {usage['cached_tokens']}), "
+                  f"ответ {usage['completion_tokens']}")
+        if browser.request_router:
+            stats = browser.request_router.get_stats()
+            print(f"🚫 Заблокировано запросов: {stats['blocked_requests']} "
+                  f"(~{stats['estimated_blocked_bytes'] / 1024 / 1024:.1f} МБ), пропущено: {stats['allowed_requests']}")
+        if agent.selector_memory:
+            agent.selector_memory.flush()
         await browser.close()
+        await close_shared_clients()
+        tracer.close()
         print("✅ Браузер закрыт")
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    if args.batch:
+        # Журнал работы агента уходит в stderr: в stdout только результаты JSONL
+        results = sys.stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            asyncio.run(main(args, results))
+    else:
+        asyncio.run(main(args))
@@ -1,13 +1,293 @@
 from playwright.async_api import Page
 from bs4 import BeautifulSoup
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+from page_encoder import encode_page_summary, encode_page_diff
+from token_estimator import estimate_tokens
+from tracing import traced
+import json
 import re
 
 
+HEADINGS_LIMIT = 10
+LINKS_LIMIT = 30
+BUTTONS_LIMIT = 20
+FORMS_LIMIT = 5
+TEXT_LIMIT = 500
+INTERACTIVE_LIMIT = 15
+
+# Разделы снимка, которые сравниваются поэлементно при построении разницы
+DIFF_SECTIONS = ('headings', 'links', 'buttons', 'form_fields', 'interactive_elements')
+
+INTERACTIVE_SELECTORS = [
+    '[onclick]',
+    '[role="button"]',
+    '[role="link"]',
+    '.btn',
+    '.button',
+    '.clickable',
+    '[data-testid]',
+    '[data-qa]'
+]
+
+# Снимок страницы собирается прямо в браузере за один page.evaluate:
+# без сериализации всего DOM и повторного парсинга в Python
+DOM_SNAPSHOT_SCRIPT = """
+(limits) => {
+    const clean = (s) => (s || '').replace(/\\s+/g, ' ').trim();
+    const textOf = (el) => clean(el.textContent);
+    const attr = (el, name) => el.getAttribute(name) || '';
+    const isVisible = (el) => {
+        if (typeof el.checkVisibility === 'function') {
+            return el.checkVisibility({checkOpacity: true, checkVisibilityCSS: true});
+        }
+        if (!el.getClientRects().length) return false;
+        const style = getComputedStyle(el);
+        return style.visibility !== 'hidden' && style.opacity !== '0';
+    };
+
+    const headingsByLevel = {h1: [], h2: [], h3: [], h4: [], h5: [], h6: []};
+    for (const el of document.querySelectorAll('h1, h2, h3, h4, h5, h6')) {
+        const bucket = headingsByLevel[el.tagName.toLowerCase()];
+        if (bucket.length >= limits.headings) continue;
+        const text = textOf(el);
+        if (text) bucket.push({level: el.tagName.toLowerCase(), text: text, visible: isVisible(el)});
+    }
+    const headings = [].concat(...Object.values(headingsByLevel)).slice(0, limits.headings);
+
+    const links = [];
+    for (const el of document.querySelectorAll('a[href]')) {
+        if (links.length >= limits.links) break;
+        const text = textOf(el);
+        const href = attr(el, 'href');
+        if (text || href) links.push({text: text.slice(0, 100), href: href, visible: isVisible(el)});
+    }
+
+    const buttons = [];
+    const buttonTexts = new Set();
+    for (const el of document.querySelectorAll('button, input[type="button"], input[type="submit"]')) {
+        if (buttons.length >= limits.buttons) break;
+        const text = textOf(el) || attr(el, 'value') || attr(el, 'aria-label');
+        if (!text) continue;
+        buttons.push({
+            text: text.slice(0, 100),
+            type: el.tagName.toLowerCase(),
+            id: el.id || '',
+            class: clean(attr(el, 'class')),
+            visible: isVisible(el)
+        });
+        buttonTexts.add(text.slice(0, 100));
+    }
+    for (const el of document.querySelectorAll('[role="button"]')) {
+        if (buttons.length >= limits.buttons) break;
+        const text = (textOf(el) || attr(el, 'aria-label')).slice(0, 100);
+        if (!text || buttonTexts.has(text)) continue;
+        buttons.push({
+            text: text,
+            type: 'div/span with role=button',
+            id: el.id || '',
+            class: clean(attr(el, 'class')),
+            visible: isVisible(el)
+        });
+        buttonTexts.add(text);
+    }
+
+    const forms = [];
+    for (const form of document.querySelectorAll('form')) {
+        if (forms.length >= limits.forms) break;
+        const inputs = [];
+        for (const el of form.querySelectorAll('input, textarea, select')) {
+            const label = el.labels && el.labels.length ? textOf(el.labels[0]) : '';
+            inputs.push({
+                type: attr(el, 'type') || el.tagName.toLowerCase(),
+                name: attr(el, 'name'),
+                id: el.id || '',
+                placeholder: attr(el, 'placeholder'),
+                label: label,
+                visible: isVisible(el)
+            });
+        }
+        forms.push({action: attr(form, 'action'), method: attr(form, 'method') || 'GET', inputs: inputs});
+    }
+
+    const skipped = new Set(['SCRIPT', 'STYLE', 'NOSCRIPT', 'TEMPLATE', 'NAV', 'FOOTER', 'HEADER', 'ASIDE']);
+    const parts = [];
+    let textLength = 0;
+    if (document.body) {
+        const walker = document.createTreeWalker(document.body, NodeFilter.SHOW_ELEMENT | NodeFilter.SHOW_TEXT, {
+            acceptNode: (node) => node.nodeType === Node.ELEMENT_NODE && skipped.has(node.tagName)
+                ? NodeFilter.FILTER_REJECT
+                : NodeFilter.FILTER_ACCEPT
+        });
+        while (textLength <= limits.text && walker.nextNode()) {
+            const node = walker.currentNode;
+            if (node.nodeType !== Node.TEXT_NODE) continue;
+            const text = clean(node.nodeValue);
+            if (text) {
+                parts.push(text);
+                textLength += text.length + 1;
+            }
+        }
+    }
+
+    const interactive = [];
+    for (const selector of limits.interactiveSelectors) {
+        if (interactive.length >= limits.interactive) break;
+        for (const el of document.querySelectorAll(selector)) {
+            if (interactive.length >= limits.interactive) break;
+            const text = textOf(el) || attr(el, 'aria-label');
+            if (!text) continue;
+            interactive.push({
+                text: text.slice(0, 100),
+                selector: selector,
+                id: el.id || '',
+                class: clean(attr(el, 'class')),
+                visible: isVisible(el)
+            });
+        }
+    }
+
+    return {
+        url: location.href,
+        title: document.title,
+        headings: headings,
+        links: links,
+        buttons: buttons,
+        forms: forms,
+        text_content: parts.join(' ').slice(0, limits.text),
+        interactive_elements: interactive
+    };
+}
+"""
+
+
+def _page_key(url: str) -> str:
+    return (url or '').split('#', 1)[0]
+
+
+def _form_fields(summary: dict) -> List[dict]:
+    fields = []
+    for form in summary.get('forms', []):
+        for field in form.get('inputs', []):
+            fields.append(dict(field, form=form.get('action', '')))
+    return fields
+
+
+def _section_items(summary: dict, section: str) -> List[dict]:
+    if section == 'form_fields':
+        return _form_fields(summary)
+    return summary.get(section, [])
+
+
+def _item_key(item) -> str:
+    return json.dumps(item, sort_keys=True, ensure_ascii=False)
+
+
+def _difference(items: Iterable, other: Iterable) -> List:
+    # Разность мультимножеств с сохранением порядка: повторяющиеся элементы учитываются по количеству
+    remaining = Counter(_item_key(item) for item in other)
+    result = []
+    for item in items:
+        key = _item_key(item)
+        if remaining[key]:
+            remaining[key] -= 1
+        else:
+            result.append(item)
+    return result
+
+
+def diff_page_summaries(previous: dict, current: dict) -> dict:
+    diff = {'url': current.get('url', '')}
+    if current.get('title') != previous.get('title'):
+        diff['title'] = current.get('title')
+    
+    added = {}
+    removed = {}
+    for section in DIFF_SECTIONS:
+        old_items = _section_items(previous, section)
+        new_items = _section_items(current, section)
+        section_added = _difference(new_items, old_items)
+        section_removed = _difference(old_items, new_items)
+        if section_added:
+            added[section] = section_added
+        if section_removed:
+            removed[section] = section_removed
+    if added:
+        diff['added'] = added
+    if removed:
+        diff['removed'] = removed
+    
+    if current.get('text_content') != previous.get('text_content'):
+        diff['text_content'] = current.get('text_content')
+    if len(diff) == 1:
+        diff['unchanged'] = True
+    return diff
+
+
 class PageAnalyzer:
-    def __init__(self, page: Page):
+    def __init__(self, page: Page, engine: str = 'dom', summary_format: str = 'compact',
+                 token_budget: Optional[int] = None):
         self.page = page
+        self.engine = engine
+        # compact - построчный формат page_encoder, json - прежний JSON с отступами
+        self.summary_format = summary_format
+        self.token_budget = token_budget
+        # Последний полный снимок, отправленный модели, для каждой страницы
+        self._base_snapshots: Dict[str, dict] = {}
+        self._next_snapshot_id = 1
+    
+    @traced('page.get_page_report')
+    def get_page_report(self, summary: dict, live_snapshots: Iterable[int] = ()) -> dict:
+        # Отправляет модели разницу с последним полным снимком этой страницы, если она короче самого снимка.
+        # Разница всегда строится от полного снимка, поэтому модели нужны только он и последняя разница;
+        # live_snapshots - снимки, которые еще есть в контексте модели
+        snapshot_id = self._next_snapshot_id
+        self._next_snapshot_id += 1
+        key = _page_key(summary.get('url', ''))
+        base = self._base_snapshots.get(key)
+        full_content = self.encode_summary(summary, snapshot_id)
+        
+        if base and base['id'] in set(live_snapshots):
+            diff = dict(diff_from_snapshot=base['id'], snapshot_id=snapshot_id,
+                        **diff_page_summaries(base['summary'], summary))
+            diff_content = self.encode_diff(diff)
+            if estimate_tokens(diff_content) < estimate_tokens(full_content):
+                return {'content': diff_content, 'snapshot_id': snapshot_id, 'base_id': base['id']}
+        
+        self._base_snapshots[key] = {'id': snapshot_id, 'summary': summary}
+        return {'content': full_content, 'snapshot_id': snapshot_id, 'base_id': None}
+    
+    def encode_summary(self, summary: dict, snapshot_id: Optional[int] = None) -> str:
+        if self.summary_format == 'json':
+            return json.dumps(dict(summary, snapshot_id=snapshot_id), ensure_ascii=False, indent=2)
+        return encode_page_summary(summary, snapshot_id, token_budget=self.token_budget)
     
+    def encode_diff(self, diff: dict) -> str:
+        if self.summary_format == 'json':
+            return json.dumps(diff, ensure_ascii=False, indent=2)
+        return encode_page_diff(diff, token_budget=self.token_budget)
+    
+    @traced('page.get_page_summary')
     async def get_page_summary(self) -> dict:
+        if self.engine == 'dom':
+            try:
+                return await self._get_dom_summary()
+            except Exception as e:
+                print(f"⚠️  Не удалось собрать снимок страницы в браузере, использую HTML-парсер: {e}")
+        return await self._get_soup_summary()
+    
+    async def _get_dom_summary(self) -> dict:
+        return await self.page.evaluate(DOM_SNAPSHOT_SCRIPT, {
+            'headings': HEADINGS_LIMIT,
+            'links': LINKS_LIMIT,
+            'buttons': BUTTONS_LIMIT,
+            'forms': FORMS_LIMIT,
+            'text': TEXT_LIMIT,
+            'interactive': INTERACTIVE_LIMIT,
+            'interactiveSelectors': INTERACTIVE_SELECTORS
+        })
+    
+    async def _get_soup_summary(self) -> dict:
         html = await self.page.content()
         soup = BeautifulSoup(html, 'lxml')
         for script in soup(["script", "style", "noscript"]):
@@ -33,7 +313,7 @@ class PageAnalyzer:
                 text = heading.get_text(strip=True)
                 if text:
                     headings.append({'level': tag, 'text': text})
-        return headings[:10]
+        return headings[:HEADINGS_LIMIT]
     
     def _extract_links(self, soup: BeautifulSoup) -> list:
         links = []
@@ -46,7 +326,7 @@ class PageAnalyzer:
                     'href': href,
                     'visible': bool(text)
                 })
-        return links[:30]
+        return links[:LINKS_LIMIT]
     
     def _extract_buttons(self, soup: BeautifulSoup) -> list:
         buttons = []
@@ -69,7 +349,7 @@ class PageAnalyzer:
                     'class': ' '.join(btn.get('class', []))
                 })
         
-        return buttons[:20]
+        return buttons[:BUTTONS_LIMIT]
     
     def _extract_forms(self, soup: BeautifulSoup) -> list:
         forms = []
@@ -91,7 +371,7 @@ class PageAnalyzer:
                 form_info['inputs'].append(input_info)
             
             forms.append(form_info)
-        return forms[:5]
+        return forms[:FORMS_LIMIT]
     
     def _get_input_label(self, input_elem) -> str:
         input_id = input_elem.get('id')
@@ -110,22 +390,11 @@ class PageAnalyzer:
             elem.decompose()
         text = soup.get_text(separator=' ', strip=True)
         text = re.sub(r'\s+', ' ', text)
-        return text[:500]
+        return text[:TEXT_LIMIT]
     
     def _extract_interactive_elements(self, soup: BeautifulSoup) -> list:
         elements = []
-        clickable_selectors = [
-            '[onclick]',
-            '[role="button"]',
-            '[role="link"]',
-            '.btn',
-            '.button',
-            '.clickable',
-            '[data-testid]',
-            '[data-qa]'
-        ]
-        
-        for selector in clickable_selectors:
+        for selector in INTERACTIVE_SELECTORS:
             for elem in soup.select(selector):
                 text = elem.get_text(strip=True) or elem.get('aria-label', '')
                 if text:
@@ -136,6 +405,6 @@ class PageAnalyzer:
                         'class': ' '.join(elem.get('class', []))
                     })
         
-        return elements[:15]
+        return elements[:INTERACTIVE_LIMIT]
     
 
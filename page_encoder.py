@@ -0,0 +1,143 @@
+from typing import Dict, List, Optional
+from token_estimator import estimate_tokens
+
+
+# Компактный построчный формат снимка страницы: короткие метки вместо ключей JSON,
+# пустые поля не выводятся. Описание меток добавляется в системный промпт
+PAGE_FORMAT_LEGEND = (
+    "Формат снимков страницы: H - заголовок, L - ссылка (текст -> адрес), B - кнопка, "
+    "F - форма, I - поле ввода, E - интерактивный элемент, T - текст страницы; "
+    "~ в конце строки - элемент скрыт; в разнице снимков + добавлено, - удалено."
+)
+
+# Разделы в порядке удаления при нехватке бюджета: первыми отбрасываются наименее важные
+TRIM_ORDER = ('interactive_elements', 'headings', 'text_content', 'links', 'buttons', 'forms', 'form_fields')
+TEXT_ITEM_LIMIT = 100
+
+
+def _hidden(item: dict) -> str:
+    return ' ~' if item.get('visible') is False else ''
+
+
+def _clip(text: str, limit: int = TEXT_ITEM_LIMIT) -> str:
+    text = ' '.join(str(text or '').split())
+    return text if len(text) <= limit else text[:limit - 1] + '…'
+
+
+def encode_heading(item: dict) -> str:
+    return f"{item.get('level', 'h').upper()} {_clip(item.get('text'))}{_hidden(item)}"
+
+
+def encode_link(item: dict) -> str:
+    text = _clip(item.get('text'))
+    href = item.get('href', '')
+    return f"L {text} -> {href}{_hidden(item)}" if text else f"L -> {href}{_hidden(item)}"
+
+
+def encode_button(item: dict) -> str:
+    line = f"B {_clip(item.get('text'))}"
+    if item.get('id'):
+        line += f" #{item['id']}"
+    return line + _hidden(item)
+
+
+def encode_field(item: dict) -> str:
+    parts = [f"I {item.get('type') or 'text'}"]
+    if item.get('name'):
+        parts.append(f"name={item['name']}")
+    if item.get('id'):
+        parts.append(f"#{item['id']}")
+    if item.get('placeholder'):
+        parts.append(f'"{_clip(item["placeholder"])}"')
+    if item.get('label'):
+        parts.append(f"[{_clip(item['label'])}]")
+    if item.get('form'):
+        parts.append(f"в форме {item['form']}")
+    return ' '.join(parts) + _hidden(item)
+
+
+def encode_form(form: dict) -> str:
+    lines = [f"F {(form.get('method') or 'GET').upper()} {form.get('action') or '(без адреса)'}"]
+    lines.extend('  ' + encode_field(field) for field in form.get('inputs', []))
+    return '\n'.join(lines)
+
+
+def encode_interactive(item: dict) -> str:
+    line = f"E {_clip(item.get('text'))} ({item.get('selector', '')})"
+    if item.get('id'):
+        line += f" #{item['id']}"
+    return line + _hidden(item)
+
+
+SECTION_ENCODERS = {
+    'headings': encode_heading,
+    'links': encode_link,
+    'buttons': encode_button,
+    'forms': encode_form,
+    'form_fields': encode_field,
+    'interactive_elements': encode_interactive,
+}
+SECTION_ORDER = ('headings', 'forms', 'form_fields', 'buttons', 'links', 'interactive_elements', 'text_content')
+
+
+def _dropped_marker(name: str, count: int) -> str:
+    return f"… пропущено {count} ({name})"
+
+
+def _fit(header: List[str], sections: Dict[str, List[str]], token_budget: Optional[int]) -> str:
+    # Если текст не помещается в бюджет, с конца наименее важных разделов убираются строки,
+    # а на их месте остается пометка с числом пропущенных элементов
+    costs = {name: [estimate_tokens(line) + 1 for line in lines] for name, lines in sections.items()}
+    total = sum(estimate_tokens(line) + 1 for line in header) + sum(sum(c) for c in costs.values())
+    dropped = {name: 0 for name in sections}
+
+    if token_budget:
+        for name in TRIM_ORDER:
+            lines = sections.get(name)
+            while lines and total > token_budget:
+                if not dropped[name]:
+                    total += estimate_tokens(_dropped_marker(name, len(lines))) + 1
+                lines.pop()
+                total -= costs[name].pop()
+                dropped[name] += 1
+            if total <= token_budget:
+                break
+
+    output = list(header)
+    for name in SECTION_ORDER:
+        output.extend(sections.get(name, []))
+        if dropped.get(name):
+            output.append(_dropped_marker(name, dropped[name]))
+    return '\n'.join(output)
+
+
+def encode_page_summary(summary: dict, snapshot_id: Optional[int] = None,
+                        token_budget: Optional[int] = None) -> str:
+    title = _clip(summary.get('title'), 200)
+    number = f" #{snapshot_id}" if snapshot_id is not None else ''
+    header = [f"PAGE{number} {title} | {summary.get('url', '')}"]
+    sections = {
+        name: [encoder(item) for item in summary.get(name, [])]
+        for name, encoder in SECTION_ENCODERS.items() if name in summary
+    }
+    if summary.get('text_content'):
+        sections['text_content'] = [f"T {' '.join(summary['text_content'].split())}"]
+    return _fit(header, sections, token_budget)
+
+
+def encode_page_diff(diff: dict, token_budget: Optional[int] = None) -> str:
+    header = [f"DIFF #{diff.get('snapshot_id')} от #{diff.get('diff_from_snapshot')} | {diff.get('url', '')}"]
+    if 'title' in diff:
+        header.append(f"title {_clip(diff['title'], 200)}")
+    if diff.get('unchanged'):
+        header.append("без изменений")
+
+    sections: Dict[str, List[str]] = {}
+    for sign, key in (('-', 'removed'), ('+', 'added')):
+        for name, items in diff.get(key, {}).items():
+            encoder = SECTION_ENCODERS.get(name)
+            if encoder:
+                sections.setdefault(name, []).extend(sign + encoder(item) for item in items)
+    if 'text_content' in diff:
+        sections['text_content'] = [f"T {' '.join((diff['text_content'] or '').split())}"]
+    return _fit(header, sections, token_budget)
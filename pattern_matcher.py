@@ -0,0 +1,94 @@
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+_last_lowered: List[str] = ['', '']
+
+
+def lowered(text: str) -> str:
+    # Несколько проверок подряд получают один и тот же текст - переводим в нижний регистр один раз
+    if text is not _last_lowered[0]:
+        _last_lowered[0] = text
+        _last_lowered[1] = text.lower()
+    return _last_lowered[1]
+
+
+class PatternMatcher:
+    def __init__(self, rules: Dict[str, Sequence[str]], literal: bool = False):
+        self.categories = list(rules)
+        self._rules: Dict[str, Tuple[str, str]] = {}
+        # Совпадения одного общего выражения не пересекаются: совпадение одной категории скрывает
+        # пересекающееся с ним совпадение другой, поэтому категории ищутся своими выражениями,
+        # а для подсчета каждое правило компилируется отдельно, как в прежнем цикле по шаблонам
+        self._categories: Dict[str, Tuple[re.Pattern, re.Pattern]] = {}
+        self._compiled_rules: List[Tuple[str, re.Pattern]] = []
+        scan_parts = []
+        resolve_parts = []
+
+        for category_index, (category, patterns) in enumerate(rules.items()):
+            category_scan = []
+            category_resolve = []
+            for rule_index, pattern in enumerate(patterns):
+                source = re.escape(pattern) if literal else pattern
+                group = f"c{category_index}r{rule_index}"
+                self._rules[group] = (category, pattern)
+                category_scan.append(f"(?:{source})")
+                category_resolve.append(f"(?P<{group}>{source})")
+                self._compiled_rules.append((category, re.compile(source)))
+            if category_scan:
+                self._categories[category] = (re.compile('|'.join(category_scan)),
+                                              re.compile('|'.join(category_resolve)))
+            scan_parts.extend(category_scan)
+            resolve_parts.extend(category_resolve)
+
+        # Общее выражение без именованных групп сохраняет быстрый поиск по префиксу в re,
+        # выражение с группами применяется только в найденной позиции, чтобы узнать правило
+        self._scanner = re.compile('|'.join(scan_parts)) if scan_parts else None
+        self._resolver = re.compile('|'.join(resolve_parts)) if resolve_parts else None
+
+    def _resolve(self, text: str, match: re.Match, resolver: re.Pattern = None) -> Tuple[str, str]:
+        resolved = (resolver or self._resolver).match(text, match.start())
+        return self._rules[resolved.lastgroup]
+
+    def first_match(self, text: str) -> Optional[Tuple[str, str]]:
+        if not self._scanner or not text:
+            return None
+        text = lowered(text)
+        match = self._scanner.search(text)
+        if not match:
+            return None
+        return self._resolve(text, match)
+
+    def first_by_category(self, text: str) -> Dict[str, str]:
+        found: Dict[str, str] = {}
+        if not self._scanner or not text:
+            return found
+        text = lowered(text)
+        for category, (scanner, resolver) in self._categories.items():
+            match = scanner.search(text)
+            if match:
+                found[category] = self._resolve(text, match, resolver)[1]
+        return found
+
+    def count_by_category(self, text: str) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        if not self._scanner or not text:
+            return counts
+        text = lowered(text)
+        for category, regex in self._compiled_rules:
+            matches = sum(1 for _ in regex.finditer(text))
+            if matches:
+                counts[category] = counts.get(category, 0) + matches
+        return counts
+
+
+@lru_cache(maxsize=None)
+def _compile(rules: Tuple[Tuple[str, Tuple[str, ...]], ...], literal: bool) -> PatternMatcher:
+    return PatternMatcher(dict(rules), literal=literal)
+
+
+def shared_matcher(rules: Dict[str, Sequence[str]], literal: bool = False) -> PatternMatcher:
+    # Одинаковые наборы правил компилируются один раз на процесс и разделяются всеми экземплярами
+    key = tuple((category, tuple(patterns)) for category, patterns in rules.items())
+    return _compile(key, literal)
@@ -0,0 +1,181 @@
+import importlib.util
+import random
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Optional
+import httpx
+import openai
+from tracing import span
+import tracing
+
+# httpx включает HTTP/2 только при установленном пакете h2 (httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+
+class ProviderError(RuntimeError):
+    # Базовая ошибка провайдера; retryable - имеет ли смысл повторить запрос
+    retryable = False
+
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class ProviderAuthError(ProviderError):
+    # 401, 402, 403: неверный ключ, нет кредитов или доступа к модели
+    pass
+
+
+class ProviderBadRequestError(ProviderError):
+    pass
+
+
+class ProviderRateLimitError(ProviderError):
+    retryable = True
+
+
+class ProviderServerError(ProviderError):
+    retryable = True
+
+
+class ProviderTimeoutError(ProviderError):
+    retryable = True
+
+
+class ProviderConnectionError(ProviderError):
+    retryable = True
+
+
+class TransportSettings:
+    def __init__(self, connect_timeout: float = 10.0, read_timeout: float = 60.0, max_retries: int = 3,
+                 backoff_base: float = 0.5, backoff_max: float = 20.0, max_connections: int = 20,
+                 max_keepalive_connections: int = 10, keepalive_expiry: float = 60.0):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+
+    @property
+    def timeout(self) -> httpx.Timeout:
+        # Соединение должно устанавливаться быстро, а ответ модели может генерироваться долго
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+
+_shared_clients: Dict[tuple, httpx.AsyncClient] = {}
+
+
+def shared_http_client(settings: TransportSettings) -> httpx.AsyncClient:
+    # Один пул соединений на процесс для всех провайдеров и сессий: TLS-рукопожатие
+    # выполняется один раз, а HTTP/2 (если установлен пакет h2) мультиплексирует запросы
+    key = (settings.max_connections, settings.max_keepalive_connections, settings.keepalive_expiry,
+           settings.connect_timeout, settings.read_timeout)
+    client = _shared_clients.get(key)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=settings.timeout,
+            limits=httpx.Limits(
+                max_connections=settings.max_connections,
+                max_keepalive_connections=settings.max_keepalive_connections,
+                keepalive_expiry=settings.keepalive_expiry
+            )
+        )
+        _shared_clients[key] = client
+    return client
+
+
+async def close_shared_clients():
+    for client in list(_shared_clients.values()):
+        await client.aclose()
+    _shared_clients.clear()
+
+
+def openai_client(api_key: str, base_url: str, settings: TransportSettings,
+                  default_headers: Dict = None) -> openai.AsyncOpenAI:
+    # Повторы выполняет with_retries, встроенные повторы клиента отключены
+    return openai.AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        default_headers=default_headers,
+        timeout=settings.timeout,
+        max_retries=0,
+        http_client=shared_http_client(settings)
+    )
+
+
+def _retry_after(headers) -> Optional[float]:
+    if not headers:
+        return None
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def translate_error(error: Exception, provider: str) -> ProviderError:
+    if isinstance(error, ProviderError):
+        return error
+    message = f"Ошибка {provider}: {error}"
+    if isinstance(error, openai.APITimeoutError):
+        return ProviderTimeoutError(message)
+    if isinstance(error, openai.APIConnectionError):
+        return ProviderConnectionError(message)
+    if isinstance(error, openai.APIStatusError):
+        status = error.status_code
+        retry_after = _retry_after(getattr(error.response, 'headers', None))
+        if status in (401, 402, 403):
+            return ProviderAuthError(message, status)
+        if status == 429:
+            return ProviderRateLimitError(message, status, retry_after)
+        if status == 408 or status >= 500:
+            return ProviderServerError(message, status, retry_after)
+        return ProviderBadRequestError(message, status)
+    if isinstance(error, httpx.TimeoutException):
+        return ProviderTimeoutError(message)
+    if isinstance(error, httpx.TransportError):
+        return ProviderConnectionError(message)
+    return ProviderError(message)
+
+
+def backoff_delay(attempt: int, settings: TransportSettings, retry_after: Optional[float] = None) -> float:
+    # Экспоненциальная задержка с полным случайным разбросом, чтобы параллельные сессии
+    # не повторяли запросы одновременно; Retry-After от сервера имеет приоритет
+    if retry_after is not None:
+        return min(retry_after, settings.backoff_max)
+    return random.uniform(0, min(settings.backoff_max, settings.backoff_base * (2 ** attempt)))
+
+
+async def with_retries(call: Callable[[], Awaitable], settings: TransportSettings, provider: str):
+    attempt = 0
+    while True:
+        try:
+            with span('llm.request', provider=provider, attempt=attempt):
+                return await call()
+        except Exception as e:
+            error = translate_error(e, provider)
+            if not error.retryable or attempt >= settings.max_retries:
+                if error is e:
+                    raise
+                raise error from e
+            delay = backoff_delay(attempt, settings, error.retry_after)
+            attempt += 1
+            print(f"🔁 {error} - повтор {attempt}/{settings.max_retries} через {delay:.1f} с")
+            await tracing.sleep(delay, 'retry_backoff')
@@ -0,0 +1,126 @@
+from typing import Dict, List
+from urllib.parse import urlparse
+
+
+ROUTE_PROFILES = {
+    'text-only': {'resource_types': {'image', 'media', 'font'}, 'trackers': True, 'third_party': False},
+    'no-media': {'resource_types': {'image', 'media'}, 'trackers': False, 'third_party': False},
+    'no-third-party': {'resource_types': set(), 'trackers': True, 'third_party': True},
+}
+
+TRACKER_DOMAINS = [
+    'doubleclick.net', 'googlesyndication.com', 'google-analytics.com', 'googletagmanager.com',
+    'googleadservices.com', 'adservice.google.com', 'facebook.net', 'connect.facebook.net',
+    'mc.yandex.ru', 'an.yandex.ru', 'yandexadexchange.net', 'top-fwz1.mail.ru', 'ad.mail.ru',
+    'hotjar.com', 'scorecardresearch.com', 'criteo.com', 'criteo.net', 'adnxs.com', 'taboola.com',
+    'outbrain.com', 'amazon-adsystem.com', 'tiktok.com/i18n/pixel', 'clarity.ms', 'segment.io'
+]
+
+# Заблокированный ответ не скачивается, поэтому его размер оценивается по средним размерам
+# разрешенных ответов того же типа, а до первых замеров - по типичным значениям
+DEFAULT_RESOURCE_SIZES = {
+    'image': 40_000,
+    'media': 500_000,
+    'font': 30_000,
+    'script': 50_000,
+    'stylesheet': 20_000,
+}
+DEFAULT_RESOURCE_SIZE = 10_000
+
+_SECOND_LEVEL_SUFFIXES = {'co', 'com', 'net', 'org', 'gov', 'edu', 'ac', 'msk', 'spb'}
+
+
+def site_of(host: str) -> str:
+    labels = (host or '').lower().strip('.').split('.')
+    if len(labels) > 2 and labels[-2] in _SECOND_LEVEL_SUFFIXES:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+
+def _host_matches(host: str, domains: List[str]) -> bool:
+    return any(host == domain or host.endswith('.' + domain) for domain in domains)
+
+
+class RequestRouter:
+    def __init__(self, profiles: List[str], allow_domains: List[str] = None):
+        unknown = [name for name in profiles if name not in ROUTE_PROFILES]
+        if unknown:
+            raise ValueError(f"Неизвестный профиль блокировки запросов: {', '.join(unknown)}")
+
+        # Профили можно совмещать: "no-media,no-third-party"
+        self.profiles = profiles
+        self.blocked_types = set()
+        self.block_trackers = False
+        self.block_third_party = False
+        for name in profiles:
+            profile = ROUTE_PROFILES[name]
+            self.blocked_types |= profile['resource_types']
+            self.block_trackers = self.block_trackers or profile['trackers']
+            self.block_third_party = self.block_third_party or profile['third_party']
+        self.allow_domains = [domain.lower().strip() for domain in (allow_domains or []) if domain.strip()]
+
+        self.blocked_requests = 0
+        self.allowed_requests = 0
+        self.blocked_by_type: Dict[str, int] = {}
+        self.estimated_blocked_bytes = 0
+        self._sizes: Dict[str, List[int]] = {}
+
+    async def attach(self, context):
+        # Пока в контексте есть перехват запросов, Playwright не использует HTTP-кеш браузера
+        await context.route('**/*', self._handle_route)
+        context.on('response', self._on_response)
+
+    def should_block(self, url: str, resource_type: str, page_url: str) -> bool:
+        host = (urlparse(url).hostname or '').lower()
+        page_host = (urlparse(page_url).hostname or '').lower()
+        if not host or _host_matches(host, self.allow_domains) or _host_matches(page_host, self.allow_domains):
+            return False
+        if resource_type in self.blocked_types:
+            return True
+        if self.block_trackers and any(tracker in url for tracker in TRACKER_DOMAINS):
+            return True
+        if self.block_third_party and page_host and site_of(host) != site_of(page_host):
+            return True
+        return False
+
+    async def _handle_route(self, route):
+        request = route.request
+        page_url = ''
+        try:
+            if request.is_navigation_request() and request.frame.parent_frame is None:
+                await route.continue_()
+                return
+            page_url = request.frame.page.url
+        except Exception:
+            pass
+
+        if self.should_block(request.url, request.resource_type, page_url):
+            self.blocked_requests += 1
+            self.blocked_by_type[request.resource_type] = self.blocked_by_type.get(request.resource_type, 0) + 1
+            self.estimated_blocked_bytes += self._estimated_size(request.resource_type)
+            await route.abort('blockedbyclient')
+        else:
+            self.allowed_requests += 1
+            await route.continue_()
+
+    def _on_response(self, response):
+        length = response.headers.get('content-length')
+        if length and length.isdigit():
+            sizes = self._sizes.setdefault(response.request.resource_type, [0, 0])
+            sizes[0] += int(length)
+            sizes[1] += 1
+
+    def _estimated_size(self, resource_type: str) -> int:
+        total, count = self._sizes.get(resource_type, (0, 0))
+        if count:
+            return total // count
+        return DEFAULT_RESOURCE_SIZES.get(resource_type, DEFAULT_RESOURCE_SIZE)
+
+    def get_stats(self) -> dict:
+        return {
+            'profiles': self.profiles,
+            'blocked_requests': self.blocked_requests,
+            'allowed_requests': self.allowed_requests,
+            'blocked_by_type': dict(self.blocked_by_type),
+            'estimated_blocked_bytes': self.estimated_blocked_bytes
+        }
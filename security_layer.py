@@ -1,4 +1,5 @@
-import re
+from pattern_matcher import shared_matcher
+from config import AUTO_CONFIRM_DESTRUCTIVE
 
 
 class SecurityLayer:
@@ -26,26 +27,30 @@ class SecurityLayer:
     
     @classmethod
     def is_destructive_action(cls, action: str, element_text: str = '') -> bool:
-        action_lower = action.lower()
-        text_lower = element_text.lower()
-        
         # Проверяем ключевые слова в действии
-        for keyword in cls.DESTRUCTIVE_KEYWORDS:
-            if keyword in action_lower:
-                return True
+        if shared_matcher({'destructive': cls.DESTRUCTIVE_KEYWORDS}, literal=True).first_match(action):
+            return True
         
         # Проверяем текст элемента
-        for pattern in cls.DANGEROUS_BUTTON_TEXT:
-            if re.search(pattern, text_lower):
-                return True
+        if shared_matcher({'dangerous_button': cls.DANGEROUS_BUTTON_TEXT}).first_match(element_text):
+            return True
         
         return False
     
     @classmethod
-    async def check_and_confirm(cls, action: str, element_text: str = '') -> bool:
+    async def check_and_confirm(cls, action: str, element_text: str = '', interactive: bool = True) -> bool:
         if not cls.is_destructive_action(action, element_text):
             return True
         
+        if AUTO_CONFIRM_DESTRUCTIVE:
+            print(f"⚠️  Опасное действие подтверждено автоматически (AUTO_CONFIRM_DESTRUCTIVE): {action} {element_text}")
+            return True
+        
+        # Без пользователя подтвердить действие некому: оно отклоняется
+        if not interactive:
+            print(f"⚠️  Опасное действие отклонено, подтвердить некому: {action} {element_text}")
+            return False
+        
         print(f"\n⚠️  ВНИМАНИЕ: Обнаружено потенциально опасное действие!")
         print(f"   Действие: {action}")
         if element_text:
@@ -0,0 +1,87 @@
+import re
+import time
+from typing import Dict, Optional
+from json_store import JsonStore
+
+
+# После стольких промахов подряд запомненный селектор удаляется
+MAX_MISSES = 2
+# Счетчики попаданий и промахов сбрасываются на диск не чаще раза за столько секунд
+SAVE_INTERVAL = 30
+
+
+def normalize_description(description: str) -> str:
+    return ' '.join(re.sub(r'[«»"\'`]', ' ', description or '').lower().split())
+
+
+class SelectorMemory:
+    # Селекторы, которые на конкретном сайте уже нашли нужный элемент и по ним успешно кликнули
+    # или ввели текст; ключ - домен, тип элемента (click или input) и описание элемента
+    def __init__(self, path: str, max_entries: int = 2000):
+        self.max_entries = max_entries
+        self.store = JsonStore(path, 'память селекторов')
+        self.entries: Dict[str, dict] = self.store.load()
+        self.dirty = False
+        self.last_save = time.monotonic()
+
+    def save(self):
+        self.store.save(self.entries)
+        self.dirty = False
+        self.last_save = time.monotonic()
+
+    def _changed(self):
+        # Поиск по памяти не должен каждый раз синхронно переписывать весь файл
+        self.dirty = True
+        if time.monotonic() - self.last_save >= SAVE_INTERVAL:
+            self.save()
+
+    def flush(self):
+        if self.dirty:
+            self.save()
+
+    @staticmethod
+    def _key(domain: str, kind: str, description: str) -> str:
+        return f"{domain}|{kind}|{normalize_description(description)}"
+
+    def lookup(self, domain: str, kind: str, description: str) -> Optional[dict]:
+        return self.entries.get(self._key(domain, kind, description))
+
+    def remember(self, domain: str, kind: str, description: str, selector: str, fingerprint: str = ''):
+        key = self._key(domain, kind, description)
+        entry = self.entries.get(key)
+        if entry and entry['selector'] == selector:
+            entry['misses'] = 0
+            entry['fingerprint'] = fingerprint or entry.get('fingerprint', '')
+        else:
+            entry = {'selector': selector, 'fingerprint': fingerprint, 'hits': 0, 'misses': 0}
+            self.entries[key] = entry
+        entry['updated'] = int(time.time())
+        if len(self.entries) > self.max_entries:
+            oldest = min(self.entries, key=lambda name: self.entries[name].get('updated', 0))
+            del self.entries[oldest]
+        self.save()
+
+    def hit(self, domain: str, kind: str, description: str):
+        entry = self.lookup(domain, kind, description)
+        if entry:
+            entry['hits'] += 1
+            entry['misses'] = 0
+            entry['updated'] = int(time.time())
+            self._changed()
+
+    def miss(self, domain: str, kind: str, description: str):
+        # Селектор больше не находит тот же элемент: после нескольких промахов запись удаляется
+        key = self._key(domain, kind, description)
+        entry = self.entries.get(key)
+        if not entry:
+            return
+        entry['misses'] += 1
+        if entry['misses'] >= MAX_MISSES:
+            del self.entries[key]
+        self._changed()
+
+    def get_stats(self) -> dict:
+        return {
+            'entries': len(self.entries),
+            'hits': sum(entry['hits'] for entry in self.entries.values())
+        }
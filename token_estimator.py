@@ -0,0 +1,33 @@
+import re
+from math import ceil
+
+
+# Оценка числа токенов без токенизатора. BPE-словари современных моделей кодируют
+# частые английские слова целиком, кириллицу - по 3-4 символа, цифры - по 3,
+# а стоящие подряд знаки препинания (": ", "\",") часто склеивают в один токен.
+# Оценка намеренно немного завышена, чтобы бюджет не превышался
+_RUNS = re.compile(r'[A-Za-z]+|[Ѐ-ӿ]+|[0-9]+|\s+|[^A-Za-z0-9Ѐ-ӿ\s]+')
+LATIN_CHARS_PER_TOKEN = 5.0
+CYRILLIC_CHARS_PER_TOKEN = 3.5
+DIGITS_PER_TOKEN = 3.0
+PUNCTUATION_PER_TOKEN = 2.0
+
+
+def estimate_tokens(text: str) -> int:
+    tokens = 0
+    for match in _RUNS.finditer(text or ''):
+        run = match.group()
+        first = run[0]
+        if first.isspace():
+            # Одиночный пробел обычно входит в следующий токен, переводы строк и отступы - нет
+            tokens += 0 if run == ' ' else ceil(len(run) / 4)
+        elif first.isascii() and first.isalpha():
+            tokens += ceil(len(run) / LATIN_CHARS_PER_TOKEN)
+        elif 'Ѐ' <= first <= 'ӿ':
+            tokens += ceil(len(run) / CYRILLIC_CHARS_PER_TOKEN)
+        elif first.isdigit():
+            tokens += ceil(len(run) / DIGITS_PER_TOKEN)
+        else:
+            # Знаки препинания и символы других алфавитов
+            tokens += ceil(len(run) / PUNCTUATION_PER_TOKEN)
+    return tokens
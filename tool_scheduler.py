@@ -0,0 +1,56 @@
+import asyncio
+from typing import Awaitable, Callable, List, Optional
+
+
+class ToolScheduler:
+    def __init__(self):
+        self.stopped = False
+        self._tasks: List[asyncio.Task] = []
+        # Оценка последнего поставленного вызова и последнего изменяющего страницу вызова
+        self._last: Optional[asyncio.Task] = None
+        self._barrier: Optional[asyncio.Task] = None
+
+    def submit(self, run: Callable[[], Awaitable], read_only: bool = False,
+               evaluate: Callable = None) -> asyncio.Task:
+        # Вызовы запускаются сразу, не дожидаясь окончания ответа модели.
+        # Изменяющий страницу вызов ждет, пока выполнятся и будут оценены все предыдущие;
+        # вызовы только для чтения ждут лишь последний изменяющий и выполняются одновременно друг с другом.
+        # Результаты оцениваются строго в порядке поступления
+        previous = self._last
+        barrier = self._barrier if read_only else previous
+
+        async def execute():
+            if barrier is not None:
+                await asyncio.gather(barrier, return_exceptions=True)
+            if self.stopped:
+                return None
+            return await run()
+
+        execution = asyncio.ensure_future(execute())
+
+        async def job():
+            outcome = await execution
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            if outcome is None or self.stopped:
+                return None
+            if evaluate is not None:
+                outcome = evaluate(outcome)
+            if outcome[1] is not None:
+                # Задача завершена - следующие вызовы уже не нужны
+                self.stopped = True
+            return outcome
+
+        task = asyncio.ensure_future(job())
+        self._tasks.extend((execution, task))
+        self._last = task
+        if not read_only:
+            self._barrier = task
+        return task
+
+    def stop(self):
+        self.stopped = True
+
+    async def drain(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,175 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import os
+import time
+from typing import Dict, Optional
+
+
+# Трассировка шагов агента: вложенные интервалы (span) пишутся в JSONL или в формат
+# Chrome trace events (открывается в chrome://tracing и ui.perfetto.dev).
+# Выключенная трассировка сводится к одной проверке флага на вызов
+TRACE_FORMATS = ('jsonl', 'chrome')
+
+_current_span = contextvars.ContextVar('trace_span', default=None)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'attributes', 'span_id', 'parent_id', 'root_id', 'start', '_token')
+
+    def __init__(self, tracer: 'Tracer', name: str, attributes: Dict):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.span_id = next(tracer._ids)
+        self.parent_id = None
+        self.root_id = self.span_id
+        self.start = 0.0
+        self._token = None
+
+    def __enter__(self):
+        # Родитель берется из contextvars, поэтому задачи asyncio, созданные внутри интервала,
+        # становятся его дочерними интервалами
+        parent = _current_span.get()
+        if parent is not None:
+            self.parent_id = parent.span_id
+            self.root_id = parent.root_id
+        self._token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        self.tracer._finish(self, end)
+        return False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.format = 'jsonl'
+        self.origin = time.perf_counter()
+        self.events = []
+        self._file = None
+        self._ids = itertools.count(1)
+
+    def configure(self, path: Optional[str], format: str = 'jsonl'):
+        self.close()
+        if not path:
+            return
+        if format not in TRACE_FORMATS:
+            raise ValueError(f"Неизвестный формат трассировки: {format}")
+        self.path = path
+        self.format = format
+        self.origin = time.perf_counter()
+        self.events = []
+        if format == 'jsonl':
+            self._file = open(path, 'a', encoding='utf-8')
+        self.enabled = True
+
+    def span(self, name: str, **attributes):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, attributes)
+
+    def _finish(self, span: Span, end: float):
+        if not self.enabled:
+            return
+        if self.format == 'jsonl':
+            self._file.write(json.dumps({
+                'name': span.name,
+                'span_id': span.span_id,
+                'parent_id': span.parent_id,
+                'start_ms': round((span.start - self.origin) * 1000, 3),
+                'duration_ms': round((end - span.start) * 1000, 3),
+                'attributes': span.attributes
+            }, ensure_ascii=False, default=str) + '\n')
+        else:
+            # Каждая задача верхнего уровня (process_task, сессия) получает свою дорожку
+            self.events.append({
+                'name': span.name,
+                'ph': 'X',
+                'ts': round((span.start - self.origin) * 1_000_000, 1),
+                'dur': round((end - span.start) * 1_000_000, 1),
+                'pid': os.getpid(),
+                'tid': span.root_id,
+                'args': span.attributes
+            })
+
+    def close(self):
+        if self.enabled and self.format == 'chrome':
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False, default=str)
+        if self._file:
+            self._file.close()
+            self._file = None
+        self.events = []
+        self.enabled = False
+
+
+tracer = Tracer()
+
+
+def configure_tracing(path: Optional[str], format: str = 'jsonl') -> Tracer:
+    tracer.configure(path, format)
+    return tracer
+
+
+def span(name: str, **attributes):
+    if not tracer.enabled:
+        return NULL_SPAN
+    return Span(tracer, name, attributes)
+
+
+def traced(name: str):
+    # Декоратор для методов: при выключенной трассировке вызывает функцию напрямую
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not tracer.enabled:
+                    return await func(*args, **kwargs)
+                with Span(tracer, name, {}):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with Span(tracer, name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def sleep(seconds: float, reason: str):
+    # Фиксированные паузы видны в трассировке отдельными интервалами
+    if not tracer.enabled:
+        return await asyncio.sleep(seconds)
+    with Span(tracer, 'sleep', {'reason': reason, 'seconds': seconds}):
+        await asyncio.sleep(seconds)